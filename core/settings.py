@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -52,6 +53,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # outermost so its numbers cover the rest, removes itself unless
+    # REQUEST_TIMING_ENABLED
+    "main.middleware.RequestTimingMiddleware",
+    # removes itself unless METRICS_ENABLED
+    "main.middleware.MetricsMiddleware",
+    # removes itself unless DATABASE_REPLICAS
+    "main.middleware.ReplicaPinMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -82,6 +90,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "core.wsgi.application"
 
+ASGI_APPLICATION = "core.asgi.application"
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -97,6 +107,62 @@ DATABASES = {
     }
 }
 
+# Read replicas, "host" or "host:port" each, with the primary's name and
+# credentials. The list, search and stats GETs read from one of them, see
+# main/routers.py; everything else uses the primary.
+DATABASE_REPLICA_HOSTS = config("DATABASE_REPLICA_HOSTS", default="", cast=Csv())
+
+for index, replica_host in enumerate(DATABASE_REPLICA_HOSTS, start=1):
+    replica_host, _, replica_port = replica_host.partition(":")
+    DATABASES[f"replica{index}"] = {
+        **DATABASES["default"],
+        "HOST": replica_host,
+        "PORT": replica_port or DATABASES["default"]["PORT"],
+        # tests read the primary's test database through the replica alias
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+
+# Shards for the shopping-list rows, "host" or "host:port" each like the
+# replicas. auth_user and the user to shard map stay on default. Only ever
+# append: a shard's position picks its id range, see main/sharding.py.
+# Put existing rows' database first, users from before sharding are found
+# there until rebalance_shopping_list_shards moves them.
+DATABASE_SHARD_HOSTS = config("DATABASE_SHARD_HOSTS", default="", cast=Csv())
+
+for index, shard_host in enumerate(DATABASE_SHARD_HOSTS, start=1):
+    shard_host, _, shard_port = shard_host.partition(":")
+    DATABASES[f"shard{index}"] = {
+        **DATABASES["default"],
+        "HOST": shard_host,
+        "PORT": shard_port or DATABASES["default"]["PORT"],
+    }
+
+SHOPPING_LIST_SHARDS = (
+    ["default"] + [f"shard{index}" for index in range(1, len(DATABASE_SHARD_HOSTS) + 1)]
+    if DATABASE_SHARD_HOSTS
+    else []
+)
+
+# how long a worker trusts its copy of a user's shard, a move waits this
+# long before and after switching
+SHOPPING_LIST_SHARD_MAP_TTL = config("SHOPPING_LIST_SHARD_MAP_TTL", default=5, cast=int)
+
+DATABASE_ROUTERS = ["main.routers.ShardRouter", "main.routers.ReplicaRouter"]
+
+# After a write the user reads from the primary for this long, set it above
+# the replicas' usual lag so they see what they just wrote
+REPLICA_PIN_SECONDS = config("REPLICA_PIN_SECONDS", default=5, cast=int)
+
+# Where the pins are kept. A write and the next read usually land on
+# different workers, so with DATABASE_REPLICAS this has to be a cache every
+# worker shares (redis/memcached); the main.E001 check rejects locmem.
+REPLICA_PIN_CACHE_BACKEND = config(
+    "REPLICA_PIN_CACHE_BACKEND",
+    default="django.core.cache.backends.locmem.LocMemCache",
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -144,8 +210,13 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # -------- REST FRAMEWORK CONFIGURATION ------------
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    )
+        "main.authentication.CachedJWTAuthentication",
+    ),
+    # renders with orjson when it is installed, same bytes either way
+    "DEFAULT_RENDERER_CLASSES": (
+        "main.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
 
 
@@ -173,12 +244,21 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 }
 
+# main.authentication.CachedJWTAuthentication keeps each user's active status
+# in a per-process cache; a deactivation elsewhere is seen within the TTL
+AUTH_USER_CACHE_TTL = config("AUTH_USER_CACHE_TTL", default=60, cast=int)
+AUTH_USER_CACHE_MAX_SIZE = config("AUTH_USER_CACHE_MAX_SIZE", default=10000, cast=int)
+
 
+# EmailAndUsernameBackend also accepts a plain username (admin login), so no
+# ModelBackend in front of it hashing the password a second time
 AUTHENTICATION_BACKENDS = [
-    "django.contrib.auth.backends.ModelBackend",
     "main.authentication_backend.EmailAndUsernameBackend",
 ]
 
+# threads that async views push password hashing onto
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=4, cast=int)
+
 
 # SWAGGER_SETTINGS = {
 #     "SECURITY_DEFINITIONS": {
@@ -192,3 +272,135 @@ CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOWED_ORIGINS = [
     "http://164.92.66.43",
 ]
+
+
+# -------- REQUEST TIMING ------------
+# main.middleware.RequestTimingMiddleware adds a Server-Timing header (SQL
+# count and time, auth, page, serialize, render, view, total) and logs one
+# line per request on the main.timing logger. Requests slower than
+# REQUEST_TIMING_SLOW_MS are logged as warnings with their SQL.
+REQUEST_TIMING_ENABLED = config("REQUEST_TIMING_ENABLED", default=False, cast=bool)
+REQUEST_TIMING_SLOW_MS = config("REQUEST_TIMING_SLOW_MS", default=500, cast=int)
+# statements kept for the slow request dump, and the slowest ones reported
+REQUEST_TIMING_MAX_QUERIES = config("REQUEST_TIMING_MAX_QUERIES", default=200, cast=int)
+REQUEST_TIMING_SLOWEST_QUERIES = config(
+    "REQUEST_TIMING_SLOWEST_QUERIES", default=5, cast=int
+)
+
+# -------- METRICS ------------
+# main.middleware.MetricsMiddleware keeps request counts and latency and SQL
+# histograms per view, method and status, served in the Prometheus text
+# format at /api/metrics/. With several worker processes set METRICS_DIR to
+# a directory they all can write (cleared when the service starts): every
+# worker flushes a snapshot there each METRICS_FLUSH_INTERVAL seconds and a
+# scrape sums them, folding the files of exited workers into one. Set
+# METRICS_TOKEN to require "Authorization: Bearer".
+METRICS_ENABLED = config("METRICS_ENABLED", default=False, cast=bool)
+METRICS_DIR = config("METRICS_DIR", default="")
+METRICS_FLUSH_INTERVAL = config("METRICS_FLUSH_INTERVAL", default=5, cast=float)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+# -------- PROFILING ------------
+# With PROFILING_ENABLED the main.views API views run under cProfile for a
+# PROFILING_SAMPLE_RATE share of requests, and for any request carrying a
+# profile token of its staff user (manage.py profile_requests token
+# <username>) in the X-Profile-Token header or the profile query parameter.
+# Profiles land in PROFILING_DIR, the newest PROFILING_MAX_FILES are kept;
+# see manage.py profile_requests list / show.
+PROFILING_ENABLED = config("PROFILING_ENABLED", default=False, cast=bool)
+PROFILING_SAMPLE_RATE = config("PROFILING_SAMPLE_RATE", default=0.0, cast=float)
+PROFILING_DIR = config(
+    "PROFILING_DIR", default=os.path.join(tempfile.gettempdir(), "shopping-list-profiles")
+)
+PROFILING_MAX_FILES = config("PROFILING_MAX_FILES", default=50, cast=int)
+PROFILING_TOKEN_MAX_AGE = config("PROFILING_TOKEN_MAX_AGE", default=3600, cast=int)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "main.timing": {
+            "handlers": ["console"],
+            "level": config("REQUEST_TIMING_LOG_LEVEL", default="INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+
+# -------- SHOPPING LIST CONFIGURATION ------------
+# Dotted path to the engine behind ShoppingList.search_shopping_list. Left
+# empty, PostgreSQL uses main.search.PostgresTrigramSearchBackend and any
+# other database main.search.NgramSearchBackend.
+SHOPPING_LIST_SEARCH_BACKEND = config("SHOPPING_LIST_SEARCH_BACKEND", default="")
+
+# List pages are serialized straight from values_list() rows by
+# main.serializer.ShoppingListValuesSerializer, which produces the same
+# output as ShoppingListModelSerializer without building model instances.
+SHOPPING_LIST_FAST_SERIALIZER = config(
+    "SHOPPING_LIST_FAST_SERIALIZER", default=True, cast=bool
+)
+
+# Rows fetched and encoded per step by the streaming export endpoint
+SHOPPING_LIST_EXPORT_CHUNK_SIZE = config(
+    "SHOPPING_LIST_EXPORT_CHUNK_SIZE", default=2000, cast=int
+)
+
+# Rows validated and written per transaction by the import endpoint
+SHOPPING_LIST_IMPORT_CHUNK_SIZE = config(
+    "SHOPPING_LIST_IMPORT_CHUNK_SIZE", default=500, cast=int
+)
+
+# Soft deleted items are kept this long before the purge_shopping_list
+# command archives or deletes them
+SHOPPING_LIST_PURGE_RETENTION_DAYS = config(
+    "SHOPPING_LIST_PURGE_RETENTION_DAYS", default=30, cast=int
+)
+
+# The changes feed only serves rows whose updated_at is at least this many
+# seconds old. updated_at is stamped by the app server before COMMIT, so a
+# row can become visible after a later stamped one; the lag has to cover the
+# longest write transaction plus the clock skew between workers.
+SHOPPING_LIST_CHANGES_LAG_SECONDS = config(
+    "SHOPPING_LIST_CHANGES_LAG_SECONDS", default=5, cast=int
+)
+
+# Serve the shopping-list CRUD, login and sign-up endpoints from the native
+# async views in main/async_views.py. Only worth it under an ASGI server
+# (core.asgi.application), under WSGI every async view runs its own loop.
+SHOPPING_LIST_ASYNC_VIEWS = config("SHOPPING_LIST_ASYNC_VIEWS", default=False, cast=bool)
+
+# GET responses are cached per user and query, and every write invalidates
+# the user's entries. Point the backend at redis/memcached in production so
+# all workers share one cache; locmem is per process.
+SHOPPING_LIST_CACHE_ENABLED = config("SHOPPING_LIST_CACHE_ENABLED", default=True, cast=bool)
+
+SHOPPING_LIST_CACHE_BACKEND = config(
+    "SHOPPING_LIST_CACHE_BACKEND",
+    default="django.core.cache.backends.locmem.LocMemCache",
+)
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shopping_list": {
+        "BACKEND": SHOPPING_LIST_CACHE_BACKEND,
+        "LOCATION": config("SHOPPING_LIST_CACHE_LOCATION", default="shopping-list"),
+        "TIMEOUT": config("SHOPPING_LIST_CACHE_TIMEOUT", default=60, cast=int),
+    },
+    "replica_pin": {
+        "BACKEND": REPLICA_PIN_CACHE_BACKEND,
+        "LOCATION": config("REPLICA_PIN_CACHE_LOCATION", default="replica-pin"),
+    },
+}
+
+# locmem evicts least recently used entries past MAX_ENTRIES, shared
+# backends bring their own eviction policy
+if SHOPPING_LIST_CACHE_BACKEND.endswith("LocMemCache"):
+    CACHES["shopping_list"]["OPTIONS"] = {
+        "MAX_ENTRIES": config("SHOPPING_LIST_CACHE_MAX_ENTRIES", default=10000, cast=int)
+    }
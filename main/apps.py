@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.models.signals import post_delete, post_migrate
+
+        # connects the auth_user signal receivers that keep the cache fresh
+        # and registers the system checks
+        from main import authentication, checks  # noqa: F401
+        from main.sharding import delete_user_rows, reserve_id_ranges
+
+        # every shard hands out ShoppingList ids from its own range
+        post_migrate.connect(reserve_id_ranges, sender=self)
+
+        # the ORM's cascade stops at the default database, not the shards
+        post_delete.connect(delete_user_rows, sender=settings.AUTH_USER_MODEL)
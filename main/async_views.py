@@ -0,0 +1,488 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
+
+from main.authentication import CachedJWTAuthentication
+from main.authentication_backend import aauthenticate, get_password_hash_executor
+from main.cache import shopping_list_cache
+from main.helpers import (
+    CustomCursorPagination,
+    CustomPagination,
+    create_account,
+    get_duplicate_account_error,
+    get_error_message,
+    get_if_match_etags,
+    get_list_validators,
+    get_tokens_for_user,
+)
+from main.models import ShoppingList
+from main.renderers import FastJSONRenderer
+from main.routers import read_from_replica
+from main.sharding import aget_read_db, aget_shard
+from main.serializer import (
+    CreateAccountSerializer,
+    LoginSerializer,
+    ShoppingListFilterSerializer,
+    ShoppingListModelSerializer,
+    ShoppingListPatchSerializer,
+    ShoppingListSerializer,
+    ShoppingListValuesSerializer,
+)
+from main.timing import timed
+
+
+@sync_to_async
+def atomic_write(using, function, *args, **kwargs):
+    """
+    Run a sync write in its own savepoint on database ``using``, on a
+    worker thread. The async ORM has no transactions, and a failed acreate()
+    inside an outer atomic block (a test case, say) would leave it unusable.
+    """
+    with transaction.atomic(using=using):
+        return function(*args, **kwargs)
+
+
+class AsyncApiView(View):
+    """
+    Native async counterpart of an APIView. Requests are parsed and
+    responses rendered with DRF, so payloads and error bodies match the
+    sync views, but handlers, JWT authentication and ORM calls are awaited
+    instead of each request being parked on the sync thread pool.
+    """
+
+    authentication_class = CachedJWTAuthentication
+    authentication_required = True
+
+    parser_classes = [JSONParser, FormParser, MultiPartParser]
+    renderer_class = FastJSONRenderer
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # same as APIView, the bearer token is the only credential
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(request, parsers=[parser() for parser in self.parser_classes])
+        self.request = request
+
+        try:
+            if self.authentication_required:
+                await self.authenticate(request)
+
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+
+    async def authenticate(self, request):
+        result = await self.authentication_class().aauthenticate(request)
+        if result is None:
+            raise exceptions.NotAuthenticated()
+
+        request.user, request.auth = result
+
+    def handle_exception(self, exc):
+        headers = {}
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            authenticator = self.authentication_class()
+            headers["WWW-Authenticate"] = authenticator.authenticate_header(self.request)
+
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {"detail": exc.detail}
+
+        return self.render(data, status=exc.status_code, headers=headers)
+
+    def render(self, data, status=status.HTTP_200_OK, headers=None):
+        return HttpResponse(
+            self.renderer_class().render(data),
+            status=status,
+            content_type="application/json",
+            headers=headers,
+        )
+
+
+""" USER ACCOUNT SECTION """
+
+
+class AsyncCreateAccountApiView(AsyncApiView):
+    authentication_required = False
+
+    serializer_class = CreateAccountSerializer
+
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        username = serializer.validated_data.get("username")
+        password = serializer.validated_data.get("password")
+        email = serializer.validated_data.get("email")
+
+        loop = asyncio.get_running_loop()
+        password = await loop.run_in_executor(
+            get_password_hash_executor(), make_password, password
+        )
+
+        try:
+            user = await atomic_write(
+                DEFAULT_DB_ALIAS,
+                create_account,
+                username=username,
+                password=password,
+                email=email,
+            )
+        except IntegrityError as e:
+            raise get_duplicate_account_error(e)
+
+        data = {
+            "error": False,
+            "code": "201",
+        }
+
+        data["tokens"] = get_tokens_for_user(user)
+
+        return self.render(data, status=status.HTTP_201_CREATED)
+
+
+class AsyncLoginApiView(AsyncApiView):
+    authentication_required = False
+
+    serializer_class = LoginSerializer
+
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        username_or_email = serializer.validated_data.get("username_or_email")
+        password = serializer.validated_data.get("password")
+
+        try:
+            user = await aauthenticate(email=username_or_email, password=password)
+        except Exception as e:
+            data = {
+                "error": True,
+                "code": "40001",
+                "message": str(e),
+            }
+
+            return self.render(data, status=status.HTTP_400_BAD_REQUEST)
+
+        data = {
+            "error": False,
+            "code": "200",
+        }
+
+        data["tokens"] = get_tokens_for_user(user)
+
+        return self.render(data, status=status.HTTP_200_OK)
+
+
+""" SHOPPING LIST SECTION """
+
+
+class AsyncShoppingListApiView(AsyncApiView):
+    serializer_class = ShoppingListSerializer
+
+    pagination_class = CustomPagination
+    cursor_pagination_class = CustomCursorPagination
+
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        create_shopping_list_payload = {
+            "user_id": request.user.id,
+            "name": serializer.validated_data.get("name"),
+            "quantity": serializer.validated_data.get("quantity"),
+            "note": serializer.validated_data.get("note"),
+        }
+
+        if request.GET.get("merge", "").lower() in ["1", "true"]:
+            shopping_list, created = await sync_to_async(
+                ShoppingList.merge_shopping_list
+            )(
+                user_id=request.user.id,
+                name=create_shopping_list_payload["name"],
+                quantity=create_shopping_list_payload["quantity"],
+                note=create_shopping_list_payload["note"],
+            )
+        else:
+            try:
+                shopping_list = await atomic_write(
+                    await aget_shard(request.user.id, write=True),
+                    ShoppingList.create_shopping_list,
+                    **create_shopping_list_payload,
+                )
+            except IntegrityError:
+                return self.duplicate_name_response()
+
+            created = True
+
+        await shopping_list_cache.ainvalidate(request.user.id)
+
+        if created:
+            data = {
+                "error": False,
+                "code": "201",
+                "message": "Shopping list created successfully",
+                "data": ShoppingListModelSerializer(shopping_list).data,
+            }
+            response_status = status.HTTP_201_CREATED
+        else:
+            data = {
+                "error": False,
+                "code": "200",
+                "message": "Shopping list merged successfully",
+                "data": ShoppingListModelSerializer(shopping_list).data,
+            }
+            response_status = status.HTTP_200_OK
+
+        return self.render(
+            data, status=response_status, headers={"ETag": shopping_list.etag}
+        )
+
+    @read_from_replica
+    async def get(self, request):
+        revision = await ShoppingList.aget_revision(request.user.id)
+        validators, not_modified = get_list_validators(request, revision)
+        if not_modified is not None:
+            return not_modified
+
+        cached_data, cache_version = await shopping_list_cache.aget(request)
+        if cached_data is not None:
+            return self.render(cached_data, headers={"X-Cache": "HIT", **validators})
+
+        filter_serializer = ShoppingListFilterSerializer(data=request.GET)
+
+        if not filter_serializer.is_valid():
+            data = {
+                "error": True,
+                "code": "40007",
+                "message": get_error_message(filter_serializer.errors),
+            }
+
+            return self.render(data, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = filter_serializer.validated_data
+
+        filter_kwargs = {
+            "search": filters.get("search"),
+            "start_date": filters.get("start_date"),
+            "end_date": filters.get("end_date"),
+            "min_quantity": filters.get("min_quantity"),
+            "max_quantity": filters.get("max_quantity"),
+            "revision": revision,
+            # resolved here, the sync lookup may read the shard map
+            "using": await aget_read_db(request.user.id),
+        }
+        if filters.get("search"):
+            # search engines may query while building the queryset
+            shopping_list = await sync_to_async(ShoppingList.filter_shopping_list)(
+                request.user.id, **filter_kwargs
+            )
+        else:
+            shopping_list = ShoppingList.filter_shopping_list(
+                request.user.id, **filter_kwargs
+            )
+
+        if filters.get("ordering"):
+            shopping_list = ShoppingList.order_data(shopping_list, filters["ordering"])
+        elif filters.get("sort_by"):
+            shopping_list = ShoppingList.sort_data(shopping_list, filters["sort_by"])
+
+        # pages are only stable over a total order, and the cursor reads its
+        # position off the ordering columns, so they have to be in the query
+        # before the fast path picks what to select
+        if not shopping_list.query.order_by:
+            shopping_list = shopping_list.order_by("id")
+
+        # ?fields=id,name,quantity prunes the columns read and the keys sent
+        fields = filters.get("fields")
+
+        fast_serializer = settings.SHOPPING_LIST_FAST_SERIALIZER
+        if fast_serializer:
+            # rows straight from values_list(), no model instances
+            shopping_list = ShoppingListValuesSerializer.get_rows(shopping_list, fields)
+        elif fields:
+            shopping_list = ShoppingList.select_fields(shopping_list, fields)
+
+        with timed("page"):
+            if filters.get("pagination") == "cursor":
+                paginator = self.cursor_pagination_class()
+                result_page = await sync_to_async(paginator.paginate_queryset)(
+                    shopping_list, request
+                )
+            else:
+                paginator = self.pagination_class()
+                result_page = await paginator.apaginate_queryset(shopping_list, request)
+
+        with timed("serialize"):
+            if fast_serializer:
+                serialized_data = ShoppingListValuesSerializer(
+                    result_page, fields=fields
+                ).data
+            else:
+                serialized_data = ShoppingListModelSerializer(
+                    result_page, many=True, fields=fields
+                ).data
+
+        data = {
+            "error": False,
+            "code": "200",
+            "message": "Shopping list retrieved successfully",
+            "data": serialized_data,
+        }
+
+        data = paginator.get_paginated_response(data).data
+
+        await shopping_list_cache.aset(request, data, cache_version)
+
+        return self.render(data, headers={"X-Cache": "MISS", **validators})
+
+    def duplicate_name_response(self):
+        data = {
+            "error": True,
+            "code": "40006",
+            "message": "Shopping list with this name already exists",
+        }
+
+        return self.render(data, status=status.HTTP_400_BAD_REQUEST)
+
+    async def write_failed_response(self, request, item_id):
+        if (
+            request.headers.get("If-Match")
+            and await ShoppingList.aget_shopping_list_by_id(request.user.id, item_id)
+            is not None
+        ):
+            data = {
+                "error": True,
+                "code": "40011",
+                "message": "Shopping list has been modified",
+            }
+
+            return self.render(data, status=status.HTTP_412_PRECONDITION_FAILED)
+
+        data = {
+            "error": True,
+            "code": "40004",
+            "message": "Shopping list does not exist",
+        }
+
+        return self.render(data, status=status.HTTP_400_BAD_REQUEST)
+
+    def item_id_required_response(self):
+        data = {
+            "error": True,
+            "code": "40007",
+            "message": "Item id is required",
+        }
+
+        return self.render(data, status=status.HTTP_400_BAD_REQUEST)
+
+    async def patch(self, request):
+        item_id = request.GET.get("item_id")
+        if not item_id:
+            return self.item_id_required_response()
+
+        serializer = ShoppingListPatchSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+
+        fields = dict(serializer.validated_data)
+        quantity_delta = fields.pop("quantity_delta", None)
+
+        try:
+            if quantity_delta is not None:
+                shopping_list = await atomic_write(
+                    await aget_shard(request.user.id, write=True),
+                    ShoppingList.adjust_quantity,
+                    request.user.id,
+                    item_id,
+                    quantity_delta,
+                    etags=get_if_match_etags(request),
+                )
+            else:
+                shopping_list = await atomic_write(
+                    await aget_shard(request.user.id, write=True),
+                    ShoppingList.update_shopping_list,
+                    request.user.id,
+                    item_id,
+                    etags=get_if_match_etags(request),
+                    **fields,
+                )
+        except IntegrityError:
+            return self.duplicate_name_response()
+
+        return await self.updated_response(request, item_id, shopping_list)
+
+    async def put(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        item_id = request.GET.get("item_id")
+        if not item_id:
+            return self.item_id_required_response()
+
+        try:
+            shopping_list = await atomic_write(
+                await aget_shard(request.user.id, write=True),
+                ShoppingList.update_shopping_list,
+                request.user.id,
+                item_id,
+                etags=get_if_match_etags(request),
+                name=serializer.validated_data.get("name"),
+                quantity=serializer.validated_data.get("quantity"),
+                note=serializer.validated_data.get("note"),
+            )
+        except IntegrityError:
+            return self.duplicate_name_response()
+
+        return await self.updated_response(request, item_id, shopping_list)
+
+    async def updated_response(self, request, item_id, shopping_list):
+        if shopping_list is None:
+            return await self.write_failed_response(request, item_id)
+
+        await shopping_list_cache.ainvalidate(request.user.id)
+
+        data = {
+            "error": False,
+            "code": "200",
+            "message": "Shopping list retrieved successfully",
+            "data": ShoppingListModelSerializer(shopping_list).data,
+        }
+
+        return self.render(
+            data, status=status.HTTP_200_OK, headers={"ETag": shopping_list.etag}
+        )
+
+    async def delete(self, request):
+        item_id = request.GET.get("item_id")
+        if not item_id:
+            return self.item_id_required_response()
+
+        shopping_list = await sync_to_async(ShoppingList.delete_shopping_list)(
+            request.user.id, item_id, etags=get_if_match_etags(request)
+        )
+
+        if shopping_list is None:
+            return await self.write_failed_response(request, item_id)
+
+        await shopping_list_cache.ainvalidate(request.user.id)
+
+        data = {
+            "error": False,
+            "code": "200",
+            "message": "Shopping list deleted successfully",
+        }
+
+        return self.render(data, status=status.HTTP_200_OK)
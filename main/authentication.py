@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from main.timing import timed
+
+
+class ActiveUserCache:
+    """
+    Per-process TTL and LRU bounded map of user id to is_active
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or getattr(settings, "AUTH_USER_CACHE_MAX_SIZE", 10000)
+        self.ttl = ttl or getattr(settings, "AUTH_USER_CACHE_TTL", 60)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            is_active, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+
+            self._entries.move_to_end(user_id)
+            return is_active
+
+    def set(self, user_id, is_active):
+        with self._lock:
+            self._entries[user_id] = (is_active, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+active_user_cache = ActiveUserCache()
+
+
+def is_user_active(user_id):
+    is_active = active_user_cache.get(user_id)
+
+    if is_active is None:
+        is_active = bool(
+            get_user_model()
+            .objects.filter(pk=user_id)
+            .values_list("is_active", flat=True)
+            .first()
+        )
+        active_user_cache.set(user_id, is_active)
+
+    return is_active
+
+
+async def ais_user_active(user_id):
+    is_active = active_user_cache.get(user_id)
+
+    if is_active is None:
+        is_active = bool(
+            await get_user_model()
+            .objects.filter(pk=user_id)
+            .values_list("is_active", flat=True)
+            .afirst()
+        )
+        active_user_cache.set(user_id, is_active)
+
+    return is_active
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_active_user(sender, instance, **kwargs):
+    active_user_cache.invalidate(instance.pk)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that skips loading auth_user: request.user is a
+    TokenUser built from the validated user_id claim and only the user's
+    active status is looked up, through ActiveUserCache.
+    """
+
+    def authenticate(self, request):
+        with timed("auth"):
+            return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = api_settings.TOKEN_USER_CLASS(validated_token)
+
+        if not is_user_active(user.id):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views, the active check on the async ORM
+        """
+        with timed("auth"):
+            return await self._aauthenticate(request)
+
+    async def _aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = api_settings.TOKEN_USER_CLASS(validated_token)
+
+        if not await ais_user_active(user.id):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user, validated_token
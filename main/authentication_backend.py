@@ -1,29 +1,144 @@
-from django.contrib.auth import get_user_model
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model, load_backend
 from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+from django.db.models import F, Lookup, Q, Value
+from django.db.models.functions import Upper
+from django.db.models.lookups import Exact
+
+_password_hash_executor = None
+
+
+def get_password_hash_executor():
+    """
+    Thread pool that password hashing is pushed onto from async code, so
+    PBKDF2 does not stall the event loop
+    """
+    global _password_hash_executor
+
+    if _password_hash_executor is None:
+        _password_hash_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "PASSWORD_HASH_WORKERS", 4),
+            thread_name_prefix="password-hash",
+        )
+
+    return _password_hash_executor
+
+
+class NotEqual(Lookup):
+    """
+    ``<>``, which the ORM only offers as NOT (... = ...)
+    """
+
+    lookup_name = "ne"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} <> {rhs}", [*lhs_params, *rhs_params]
 
 
 class EmailAndUsernameBackend(ModelBackend):
     """
     Authenticate using e-mail address or username.
+
+    One query resolves either identifier and the password is hashed exactly
+    once per attempt, for unknown users too, so response times do not tell
+    which accounts exist.
     """
 
-    def authenticate(self, request, email=None, password=None, **kwargs):
-        User = get_user_model()
+    def get_identifier(self, email=None, username=None, **kwargs):
+        return email or username or kwargs.get(get_user_model().USERNAME_FIELD)
 
-        user = User.objects.filter(email=email).first()
-        if user and user.check_password(password):
-            return user
+    def get_users(self, identifier):
+        """
+        Up to two users whose e-mail (ignoring case) or username is
+        ``identifier``. The e-mail half repeats the expression and predicate
+        of the partial index from migration 0006, UPPER(email) WHERE
+        email <> '', since email__iexact can use neither.
+        """
+        email = Q(
+            Exact(Upper("email"), Upper(Value(identifier))),
+            NotEqual(F("email"), Value("")),
+        )
+        return get_user_model().objects.filter(email | Q(username=identifier))[:2]
 
-        elif user and not user.check_password(password):
-            raise Exception("Invalid Credentials")
+    def get_user_by_identifier(self, identifier):
+        return self.pick_user(list(self.get_users(identifier)), identifier)
 
-        elif not user:
-            user = User.objects.filter(username=email).first()
-            if user and user.check_password(password):
+    def pick_user(self, users, identifier):
+        # an e-mail match wins over someone else's identical username
+        for user in users:
+            if user.email and user.email.lower() == identifier.lower():
                 return user
 
-            elif user and not user.check_password(password):
-                raise Exception("Invalid Credentials")
+        return users[0] if users else None
+
+    def verify(self, user, password):
+        """
+        The single password hash of an attempt, raising on failure or for
+        a user is_active says may not log in
+        """
+        if user is None:
+            # hash anyway so unknown users cost as much as wrong passwords
+            get_user_model()().set_password(password)
+            raise Exception("User does not exist")
+
+        if not user.check_password(password):
+            raise Exception("Invalid Credentials")
+
+        if not self.user_can_authenticate(user):
+            raise Exception("User is inactive")
+
+        return user
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        identifier = self.get_identifier(email=email, **kwargs)
+        if identifier is None or password is None:
+            return None
+
+        return self.verify(self.get_user_by_identifier(identifier), password)
+
+    async def aauthenticate(self, request, email=None, password=None, **kwargs):
+        """
+        authenticate() for async views: async ORM lookup, hash on the
+        password hash executor
+        """
+        identifier = self.get_identifier(email=email, **kwargs)
+        if identifier is None or password is None:
+            return None
+
+        users = [user async for user in self.get_users(identifier)]
+        user = self.pick_user(users, identifier)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            get_password_hash_executor(), self.verify, user, password
+        )
+
+
+async def aauthenticate(request=None, **credentials):
+    """
+    django.contrib.auth.authenticate() for async views, which Django 4.2
+    lacks. Backends without aauthenticate() run on a worker thread.
+    """
+    for backend_path in settings.AUTHENTICATION_BACKENDS:
+        backend = load_backend(backend_path)
+
+        try:
+            if hasattr(backend, "aauthenticate"):
+                user = await backend.aauthenticate(request, **credentials)
+            else:
+                user = await sync_to_async(backend.authenticate)(request, **credentials)
+        except PermissionDenied:
+            break
+
+        if user is not None:
+            user.backend = backend_path
+            return user
 
-            elif not user:
-                raise Exception("User does not exist")
+    return None
@@ -0,0 +1,158 @@
+import hashlib
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+
+from main.metrics import get_registry
+
+
+class ShoppingListCache:
+    """
+    Read cache for shopping list GET responses.
+
+    Entries are keyed by user, request URL and a per-user version counter.
+    Every write bumps the counter, which orphans all of that user's cached
+    pages at once; orphans age out through the backend's TTL and LRU culling.
+    A miss hands back the version it looked under and the page is stored
+    under that one, so a write landing while the page is built orphans it
+    too instead of it being cached as current.
+
+    Lookups are always counted per process, see stats(), and also exported
+    as shopping_list_cache_lookups_total when METRICS_ENABLED is on.
+    """
+
+    def __init__(self, alias="shopping_list"):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return getattr(settings, "SHOPPING_LIST_CACHE_ENABLED", True)
+
+    def version_key(self, user_id):
+        return f"shopping-list:{user_id}:version"
+
+    def get_version(self, user_id):
+        key = self.version_key(user_id)
+        version = self.cache.get(key)
+
+        if version is None:
+            # start from the clock rather than 1, so a version key lost to
+            # eviction can never match pages cached under an older one
+            self.cache.add(key, time.time_ns(), timeout=None)
+            version = self.cache.get(key)
+
+        return version
+
+    def make_key(self, request, version):
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        # next/previous links in the payload are absolute, so the host matters
+        url = f"{request.scheme}://{request.get_host()}{request.path}?{query}"
+        digest = hashlib.sha1(url.encode()).hexdigest()
+
+        return f"shopping-list:{request.user.id}:{version}:{digest}"
+
+    def record(self, data):
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if settings.METRICS_ENABLED:
+            result = "miss" if data is None else "hit"
+            get_registry().inc("shopping_list_cache_lookups_total", (result,))
+
+    def stats(self):
+        """
+        This process's lookup counters and hit rate
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def get(self, request):
+        """
+        (payload, version) for this request, the payload None on a miss.
+        Pass the version on to set().
+        """
+        if not self.enabled:
+            return None, None
+
+        version = self.get_version(request.user.id)
+        data = self.cache.get(self.make_key(request, version))
+        self.record(data)
+
+        return data, version
+
+    def set(self, request, data, version):
+        if not self.enabled or version is None:
+            return
+
+        self.cache.set(self.make_key(request, version), data)
+
+    def invalidate(self, user_id):
+        """
+        Bump the user's version after a write
+        """
+        key = self.version_key(user_id)
+
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, time.time_ns(), timeout=None)
+
+    async def aget_version(self, user_id):
+        key = self.version_key(user_id)
+        version = await self.cache.aget(key)
+
+        if version is None:
+            await self.cache.aadd(key, time.time_ns(), timeout=None)
+            version = await self.cache.aget(key)
+
+        return version
+
+    async def aget(self, request):
+        """
+        get() for async views
+        """
+        if not self.enabled:
+            return None, None
+
+        version = await self.aget_version(request.user.id)
+        data = await self.cache.aget(self.make_key(request, version))
+        self.record(data)
+
+        return data, version
+
+    async def aset(self, request, data, version):
+        if not self.enabled or version is None:
+            return
+
+        await self.cache.aset(self.make_key(request, version), data)
+
+    async def ainvalidate(self, user_id):
+        key = self.version_key(user_id)
+
+        try:
+            await self.cache.aincr(key)
+        except ValueError:
+            await self.cache.aadd(key, time.time_ns(), timeout=None)
+
+
+shopping_list_cache = ShoppingListCache()
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+from main.routers import PIN_CACHE_ALIAS, get_replicas
+
+
+@register(Tags.caches, Tags.database)
+def check_replica_pin_cache(app_configs, **kwargs):
+    """
+    With read replicas the pin a write sets has to reach the worker serving
+    the next read, which a per-process cache does not do
+    """
+    if not get_replicas():
+        return []
+
+    if PIN_CACHE_ALIAS not in settings.CACHES:
+        return [
+            Error(
+                f"DATABASE_REPLICAS needs a '{PIN_CACHE_ALIAS}' cache.",
+                id="main.E002",
+            )
+        ]
+
+    if isinstance(caches[PIN_CACHE_ALIAS], (LocMemCache, DummyCache)):
+        return [
+            Error(
+                f"The '{PIN_CACHE_ALIAS}' cache is not shared between workers.",
+                hint=(
+                    "Point REPLICA_PIN_CACHE_BACKEND at redis or memcached, "
+                    "otherwise reads after a write can miss it on a replica."
+                ),
+                id="main.E001",
+            )
+        ]
+
+    return []
@@ -0,0 +1,65 @@
+import csv
+import io
+from itertools import islice
+
+from main.renderers import FastJSONRenderer
+from main.serializer import ShoppingListValuesSerializer
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def iter_chunks(rows, chunk_size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def iter_serialized(queryset, fields=None, chunk_size=2000):
+    """
+    Serialized rows of ``queryset``, read through a server-side cursor where
+    the database has one and serialized ``chunk_size`` rows at a time, so
+    memory does not grow with the size of the list
+    """
+    rows = ShoppingListValuesSerializer.get_rows(queryset, fields)
+
+    for chunk in iter_chunks(rows.iterator(chunk_size=chunk_size), chunk_size):
+        yield ShoppingListValuesSerializer(chunk, fields=fields).data
+
+
+def iter_ndjson(queryset, fields=None, chunk_size=2000):
+    """
+    One JSON object per line, each chunk of rows yielded as one bytestring
+    """
+    renderer = FastJSONRenderer()
+
+    for data in iter_serialized(queryset, fields, chunk_size):
+        yield b"".join(renderer.render(row) + b"\n" for row in data)
+
+
+def iter_csv(queryset, fields=None, chunk_size=2000):
+    """
+    A header line, then one line per row; null values are empty cells
+    """
+    field_names = [
+        field.field_name for field in ShoppingListValuesSerializer.get_fields(fields)
+    ]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=field_names)
+
+    writer.writeheader()
+    yield buffer.getvalue().encode()
+
+    for data in iter_serialized(queryset, fields, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(data)
+        yield buffer.getvalue().encode()
+
+
+EXPORTERS = {
+    "ndjson": iter_ndjson,
+    "csv": iter_csv,
+}
@@ -1,4 +1,18 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_etags
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from main.sharding import assign_shard
 
 
 class Paginator:
@@ -21,4 +35,186 @@ class Paginator:
 class CustomPagination(PageNumberPagination):
     page_size = 10  # Number of items per page
     page_size_query_param = "page_size"
-    max_page_size = 100 
\ No newline at end of file
+    max_page_size = 100
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() for async views, COUNT and the page itself
+        fetched through the async ORM
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count is a cached_property, prime it without a sync query
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            )
+            raise NotFound(msg)
+
+        self.page.object_list = [item async for item in self.page.object_list]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+
+        self.request = request
+        return list(self.page)
+
+
+class CustomCursorPagination(CursorPagination):
+    """
+    Keyset pagination, no COUNT query and no OFFSET scan
+    """
+
+    page_size = CustomPagination.page_size
+    page_size_query_param = CustomPagination.page_size_query_param
+    max_page_size = CustomPagination.max_page_size
+    ordering = "id"
+
+    def get_ordering(self, request, queryset, view):
+        # follow whatever ordering the view applied, id when there is none
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+
+        return ("id",)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # DRF answers a cursor it cannot decode with a 404, and one whose
+        # position does not fit the ordering column with a 500
+        try:
+            return super().paginate_queryset(queryset, request, view)
+        except (NotFound, ValueError, DjangoValidationError):
+            raise ValidationError({"cursor": self.invalid_cursor_message})
+
+
+def validate_items(serializer_class, items, **kwargs):
+    """
+    Validate ``items`` in one pass and split them into (index, data)
+    pairs for the valid ones and (index, errors) pairs for the rest
+    """
+    serializer = serializer_class(data=items, many=True, **kwargs)
+    if serializer.is_valid():
+        return list(enumerate(serializer.validated_data)), []
+
+    valid_indexes = [index for index, error in enumerate(serializer.errors) if not error]
+    invalid = [(index, error) for index, error in enumerate(serializer.errors) if error]
+
+    serializer = serializer_class(
+        data=[items[index] for index in valid_indexes], many=True, **kwargs
+    )
+    serializer.is_valid(raise_exception=True)
+
+    return list(zip(valid_indexes, serializer.validated_data)), invalid
+
+
+def get_error_message(errors):
+    """
+    First message out of a serializer's (possibly nested) errors
+    """
+    while isinstance(errors, (dict, list)):
+        errors = next(iter(errors.values())) if isinstance(errors, dict) else errors[0]
+
+    return str(errors)
+
+
+def get_list_etag(request, revision):
+    """
+    Validator for a list response, changes whenever any of the user's rows
+    is written (see ShoppingList.get_revision) or the query changes
+    """
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    value = f"{request.user.id}:{query}:{revision['count']}:{revision['last_modified']}"
+
+    return '"%s"' % hashlib.sha1(value.encode()).hexdigest()
+
+
+def get_list_validators(request, revision):
+    """
+    ETag for a list response at ``revision``, plus the 304 response to send
+    instead when the client's copy is current. There is no Last-Modified:
+    HTTP dates stop at the second, so If-Modified-Since would answer 304
+    after a write in the same second as the cached response.
+    """
+    validators = {"ETag": get_list_etag(request, revision)}
+
+    not_modified = get_conditional_response(request, etag=validators["ETag"])
+    if not_modified is not None:
+        for header, value in validators.items():
+            not_modified[header] = value
+
+    return validators, not_modified
+
+
+def get_if_match_etags(request):
+    """
+    Etags listed in the If-Match header, None when there is no header
+    """
+    if_match = request.headers.get("If-Match")
+    if not if_match:
+        return None
+
+    return parse_etags(if_match)
+
+
+def encode_sync_cursor(updated_at, id):
+    """
+    Opaque high-water mark for the changes feed
+    """
+    microseconds = int(updated_at.timestamp()) * 1000000 + updated_at.microsecond
+    return base64.urlsafe_b64encode(f"{microseconds}:{id}".encode()).decode()
+
+
+def decode_sync_cursor(cursor):
+    """
+    (updated_at, id) out of encode_sync_cursor, ValueError when malformed
+    """
+    microseconds, id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+    seconds, microseconds = divmod(int(microseconds), 1000000)
+
+    updated_at = datetime.fromtimestamp(seconds, tz=timezone.utc)
+    return updated_at.replace(microsecond=microseconds), int(id)
+
+
+def get_tokens_for_user(user):
+    """
+    Refresh and access token pair, the access token derived from the refresh
+    """
+    refresh = RefreshToken.for_user(user)
+    return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+
+def create_account(**fields):
+    """
+    Create the user and place them on a shopping-list shard, inside a
+    transaction on the default database
+    """
+    user = get_user_model().objects.create(**fields)
+    assign_shard(user.id)
+    return user
+
+
+# the case-insensitive e-mail index created by migration 0006
+USER_EMAIL_INDEX = "main_user_email_upper_uniq"
+
+
+def get_duplicate_account_error(error):
+    """
+    Validation error for a sign-up INSERT rejected by a unique index, told
+    apart by the name of the index rather than the rejected values
+    """
+    # psycopg reports the constraint by name, SQLite puts the name of an
+    # expression index in the message
+    diag = getattr(error.__cause__, "diag", None)
+    constraint = getattr(diag, "constraint_name", None) or str(error)
+
+    if USER_EMAIL_INDEX in constraint:
+        return ValidationError({"email": "Email already exists"})
+
+    return ValidationError({"username": "Username already exists"})
@@ -0,0 +1,203 @@
+import csv
+import json
+from operator import itemgetter
+
+from django.db import IntegrityError, transaction
+
+from main.exports import iter_chunks
+from main.helpers import validate_items
+from main.models import ShoppingList
+from main.serializer import ShoppingListSerializer
+from main.sharding import get_shard
+
+CSV_COLUMNS = ["name", "quantity", "note"]
+
+# rejected rows past this many are counted but not itemized
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def iter_lines(stream):
+    """
+    Decoded lines of a binary ``stream`` (an upload or the request body),
+    read one line at a time
+    """
+    for line_number, line in enumerate(stream, start=1):
+        try:
+            text = line.decode("utf-8")
+        except UnicodeDecodeError:
+            raise ImportFormatError(f"Line {line_number} is not valid UTF-8")
+
+        if line_number == 1:
+            text = text.lstrip("\ufeff")
+
+        yield text
+
+
+def iter_ndjson_rows(lines):
+    """
+    (line number, item, error) for every non-blank line
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield line_number, None, "Invalid JSON"
+            continue
+
+        if not isinstance(item, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+
+        yield line_number, item, None
+
+
+def iter_csv_rows(lines):
+    """
+    (line number, item, error) for every record after the header. Empty
+    cells count as missing, other columns (an export's id and dates) are
+    ignored.
+    """
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return
+
+    if not {"name", "quantity"} <= set(reader.fieldnames):
+        raise ImportFormatError("CSV header must include name and quantity")
+
+    line_number = reader.line_num
+    for row in reader:
+        # a quoted field may span lines, report where the record starts
+        start, line_number = line_number + 1, reader.line_num
+        item = {
+            column: row[column]
+            for column in CSV_COLUMNS
+            if row.get(column) not in (None, "")
+        }
+        yield start, item, None
+
+
+ROW_READERS = {
+    "ndjson": iter_ndjson_rows,
+    "csv": iter_csv_rows,
+}
+
+
+class ShoppingListImport:
+    """
+    Imports parsed rows into a user's list ``chunk_size`` rows at a time:
+    each chunk is validated with ShoppingListSerializer and written with
+    bulk inserts (or multi-row upserts when merging) in its own
+    transaction, so a large file never holds one long transaction and
+    earlier chunks stay written if a later one fails.
+    """
+
+    def __init__(self, user_id, merge=False, chunk_size=500):
+        self.user_id = user_id
+        self.merge = merge
+        self.chunk_size = chunk_size
+        self.summary = {"accepted": 0, "created": 0, "rejected": 0, "errors": []}
+        self.rejected = []
+
+    def reject(self, line_number, status, errors=None):
+        error = {"line": line_number, "status": status}
+        if errors is not None:
+            error["errors"] = errors
+        self.rejected.append(error)
+
+    def run(self, rows):
+        for chunk in iter_chunks(rows, self.chunk_size):
+            self.rejected = []
+            self.import_chunk(chunk)
+            self.report_rejected()
+
+        return self.summary
+
+    def report_rejected(self):
+        """
+        Add the chunk's rejected rows to the summary in line order, whichever
+        step rejected them
+        """
+        self.summary["rejected"] += len(self.rejected)
+
+        room = max(MAX_REPORTED_ERRORS - len(self.summary["errors"]), 0)
+        self.rejected.sort(key=itemgetter("line"))
+        self.summary["errors"] += self.rejected[:room]
+
+    def import_chunk(self, chunk):
+        parsed = []
+        for line_number, item, error in chunk:
+            if error is None:
+                parsed.append((line_number, item))
+            else:
+                self.reject(line_number, "invalid", {"non_field_errors": [error]})
+
+        valid, invalid = validate_items(
+            ShoppingListSerializer, [item for _, item in parsed]
+        )
+
+        for index, errors in invalid:
+            self.reject(parsed[index][0], "invalid", errors)
+
+        items = [(parsed[index][0], data) for index, data in valid]
+        if not items:
+            return
+
+        using = get_shard(self.user_id, write=True)
+        if self.merge:
+            with transaction.atomic(using=using):
+                results = ShoppingList.bulk_merge_shopping_list(
+                    self.user_id,
+                    [data for _, data in items],
+                    batch_size=self.chunk_size,
+                )
+
+            self.summary["accepted"] += len(items)
+            self.summary["created"] += sum(created for _, created in results)
+            return
+
+        try:
+            with transaction.atomic(using=using):
+                self.create_items(items)
+        except IntegrityError:
+            # a concurrent write took one of the names, go row by row
+            for line_number, data in items:
+                try:
+                    with transaction.atomic(using=using):
+                        self.create_items([(line_number, data)])
+                except IntegrityError:
+                    self.reject(line_number, "duplicate")
+
+    def create_items(self, items):
+        """
+        Insert the items whose name is not live yet, rejecting the rest as
+        duplicates; earlier chunks are live by now, so repeats across the
+        whole file are caught too
+        """
+        taken_names = ShoppingList.get_live_names(
+            self.user_id, [data["name"] for _, data in items]
+        )
+
+        accepted, duplicates = [], []
+        for line_number, data in items:
+            if data["name"].lower() in taken_names:
+                duplicates.append(line_number)
+            else:
+                taken_names.add(data["name"].lower())
+                accepted.append(data)
+
+        ShoppingList.bulk_create_shopping_list(
+            self.user_id, accepted, batch_size=self.chunk_size
+        )
+
+        # only counted once the transaction is sure to commit
+        for line_number in duplicates:
+            self.reject(line_number, "duplicate")
+        self.summary["accepted"] += len(accepted)
+        self.summary["created"] += len(accepted)
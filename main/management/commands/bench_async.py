@@ -0,0 +1,155 @@
+import asyncio
+import statistics
+import threading
+import time
+import types
+
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.urls import include, path
+
+from main.helpers import get_tokens_for_user
+from main.models import ShoppingList
+from main.sharding import get_shard
+from main.urls import get_urlpatterns
+
+
+def get_urlconf(async_views):
+    urlconf = types.ModuleType(f"bench_urls_{'async' if async_views else 'sync'}")
+    urlconf.urlpatterns = [path("api/", include(get_urlpatterns(async_views)))]
+    return urlconf
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the ASGI application with many simultaneous slow clients and "
+        "compare the sync and async shopping-list views"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=100)
+        parser.add_argument("--requests", type=int, default=5, help="per client")
+        parser.add_argument(
+            "--client-delay",
+            type=float,
+            default=50,
+            help="milliseconds each client takes to upload its request and "
+            "again to read the response",
+        )
+        parser.add_argument(
+            "--db-latency",
+            type=float,
+            default=2,
+            help="milliseconds added to every SQL statement, a stand-in for "
+            "the network round trip to a remote database",
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = User.objects.create_user(
+            f"bench-async-{time.time_ns()}", password="password123"
+        )
+        ShoppingList.bulk_create_shopping_list(
+            user.id,
+            [{"name": f"item {index}", "quantity": index} for index in range(50)],
+        )
+        token = get_tokens_for_user(user)["access"]
+
+        db_latency = options["db_latency"] / 1000
+
+        def add_latency(execute, sql, params, many, context):
+            time.sleep(db_latency)
+            return execute(sql, params, many, context)
+
+        def install_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(add_latency)
+
+        if db_latency:
+            connection_created.connect(install_latency)
+
+        try:
+            for async_views in [False, True]:
+                # cache off, every request reaches the database
+                with override_settings(
+                    ROOT_URLCONF=get_urlconf(async_views),
+                    SHOPPING_LIST_CACHE_ENABLED=False,
+                ):
+                    result = asyncio.run(self.run(token, options))
+
+                self.stdout.write(
+                    f"{'async' if async_views else 'sync':6} "
+                    f"requests={result['requests']} "
+                    f"throughput={result['throughput']:.1f}/s "
+                    f"p50={result['p50'] * 1000:.1f}ms "
+                    f"p99={result['p99'] * 1000:.1f}ms "
+                    f"peak_threads={result['peak_threads']}"
+                )
+        finally:
+            connection_created.disconnect(install_latency)
+            ShoppingList.objects.using(get_shard(user.id)).filter(user=user).delete()
+            user.delete()
+
+    async def run(self, token, options):
+        application = get_asgi_application()
+        client_delay = options["client_delay"] / 1000
+        timings = []
+        peak_threads = threading.active_count()
+
+        async def request(page):
+            nonlocal peak_threads
+
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": "/api/shopping-list/",
+                "raw_path": b"/api/shopping-list/",
+                "query_string": f"page={page}&sort_by=asc".encode(),
+                "root_path": "",
+                "headers": [
+                    (b"host", b"localhost"),
+                    (b"authorization", f"Bearer {token}".encode()),
+                ],
+                "client": ("127.0.0.1", 0),
+                "server": ("localhost", 80),
+            }
+            messages = []
+
+            async def receive():
+                # a slow client trickles its request in
+                await asyncio.sleep(client_delay)
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                messages.append(message)
+                if message["type"] == "http.response.body":
+                    await asyncio.sleep(client_delay)
+
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            timings.append(time.perf_counter() - start)
+            peak_threads = max(peak_threads, threading.active_count())
+
+            assert messages[0]["status"] == 200, messages
+
+        async def client(index):
+            for number in range(options["requests"]):
+                await request((index + number) % 5 + 1)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(index) for index in range(options["clients"])))
+        elapsed = time.perf_counter() - start
+
+        timings.sort()
+        return {
+            "requests": len(timings),
+            "throughput": len(timings) / elapsed,
+            "p50": statistics.median(timings),
+            "p99": timings[max(int(len(timings) * 0.99) - 1, 0)],
+            "peak_threads": peak_threads,
+        }
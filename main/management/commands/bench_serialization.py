@@ -0,0 +1,94 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from main.models import ShoppingList
+from main.renderers import FastJSONRenderer
+from main.serializer import ShoppingListModelSerializer, ShoppingListValuesSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time fetching, serializing and rendering list pages with "
+        "ShoppingListModelSerializer and the values_list() fast path"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create(
+                    username=f"bench-{time.time_ns()}"
+                )
+                items = [
+                    {"name": f"item {index}", "quantity": index, "note": "note " * 20}
+                    for index in range(max(options["sizes"]))
+                ]
+                ShoppingList.bulk_create_shopping_list(user.id, items)
+
+                for size in options["sizes"]:
+                    self.bench(user, size, options["repeat"])
+
+                raise Rollback
+        except Rollback:
+            pass
+
+    def bench(self, user, size, repeat):
+        queryset = ShoppingList.get_shopping_list(user.id).order_by("id")
+
+        instances = list(queryset[:size])
+        rows = list(ShoppingListValuesSerializer.get_rows(queryset)[:size])
+
+        def model_serializer():
+            data = ShoppingListModelSerializer(queryset[:size], many=True).data
+            return JSONRenderer().render(data)
+
+        def values_serializer():
+            page = ShoppingListValuesSerializer.get_rows(queryset)[:size]
+            return FastJSONRenderer().render(ShoppingListValuesSerializer(page).data)
+
+        def model_render():
+            data = ShoppingListModelSerializer(instances, many=True).data
+            return JSONRenderer().render(data)
+
+        def values_render():
+            return FastJSONRenderer().render(ShoppingListValuesSerializer(rows).data)
+
+        if model_serializer() != values_serializer():
+            raise AssertionError(f"outputs differ for {size} rows")
+
+        timings = {}
+        for name, function in [
+            ("model", model_serializer),
+            ("values", values_serializer),
+            ("model_render", model_render),
+            ("values_render", values_render),
+        ]:
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                samples.append(time.perf_counter() - start)
+            timings[name] = statistics.median(samples)
+
+        # with the query, then serialization and rendering alone
+        self.stdout.write(
+            f"rows={size:5} "
+            f"total model={timings['model'] * 1000:.2f}ms "
+            f"values={timings['values'] * 1000:.2f}ms "
+            f"({timings['model'] / timings['values']:.1f}x) "
+            f"serialize+render model={timings['model_render'] * 1000:.2f}ms "
+            f"values={timings['values_render'] * 1000:.2f}ms "
+            f"({timings['model_render'] / timings['values_render']:.1f}x)"
+        )
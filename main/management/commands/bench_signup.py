@@ -0,0 +1,116 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.tokens import AccessToken
+
+from main.views import CreateAccountApiView
+
+
+class Rollback(Exception):
+    pass
+
+
+def legacy_signup(username, email, password):
+    """
+    The sign-up flow before the single-INSERT rewrite, kept for comparison
+    """
+    User = get_user_model()
+
+    if User.objects.filter(email=email).exists():
+        raise ValueError("Email already exists")
+    elif User.objects.filter(username=username).exists():
+        raise ValueError("Username already exists")
+
+    user = User.objects.create(
+        username=username, password=make_password(password), email=email
+    )
+    user.save()
+
+    tokenr = TokenObtainPairSerializer().get_token(user)
+    tokena = AccessToken().for_user(user)
+    return {"refresh": str(tokenr), "access": str(tokena)}
+
+
+class Command(BaseCommand):
+    help = "Compare queries per sign-up and latency of the legacy and current flows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=200)
+        parser.add_argument(
+            "--real-hasher",
+            action="store_true",
+            help="Keep the configured password hasher instead of MD5, latency "
+            "is then dominated by hashing",
+        )
+
+    def handle(self, *args, **options):
+        overrides = {}
+        if not options["real_hasher"]:
+            overrides["PASSWORD_HASHERS"] = [
+                "django.contrib.auth.hashers.MD5PasswordHasher"
+            ]
+
+        view = CreateAccountApiView.as_view()
+        factory = APIRequestFactory()
+
+        def current_signup(username, email, password):
+            request = factory.post(
+                "/api/create/",
+                {
+                    "username": username,
+                    "email": email,
+                    "password": password,
+                    "confirm_password": password,
+                },
+                format="json",
+            )
+            response = view(request)
+            assert response.status_code == 201, response.data
+
+        for name, signup in [("legacy", legacy_signup), ("current", current_signup)]:
+            with override_settings(**overrides):
+                queries, timings = self.run(signup, options["count"])
+
+            timings.sort()
+            self.stdout.write(
+                f"{name:8} queries/signup={queries / options['count']:.2f} "
+                f"p50={statistics.median(timings) * 1000:.2f}ms "
+                f"p99={timings[int(len(timings) * 0.99) - 1] * 1000:.2f}ms"
+            )
+
+    def run(self, signup, count):
+        queries = 0
+        timings = []
+
+        try:
+            with transaction.atomic():
+                for _ in range(count):
+                    suffix = uuid.uuid4().hex[:12]
+
+                    with CaptureQueriesContext(connection) as context:
+                        start = time.perf_counter()
+                        signup(
+                            f"bench{suffix}", f"bench{suffix}@example.com", "password123"
+                        )
+                        timings.append(time.perf_counter() - start)
+
+                    queries += sum(
+                        1
+                        for query in context.captured_queries
+                        if "SAVEPOINT" not in query["sql"]
+                    )
+
+                raise Rollback
+        except Rollback:
+            pass
+
+        return queries, timings
@@ -0,0 +1,67 @@
+import io
+import os
+import pstats
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from main.profiling import get_profile_dir, list_profiles, make_profile_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Work with request profiles: 'list' the stored ones, 'show' the top "
+        "cumulative functions of one (the newest by default) or issue a "
+        "profile 'token' for a staff user"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["list", "show", "token"])
+        parser.add_argument(
+            "name",
+            nargs="?",
+            help="profile to show (a prefix is enough), or the username to "
+            "issue a token for",
+        )
+        parser.add_argument("--limit", type=int, default=25)
+        parser.add_argument(
+            "--sort",
+            default="cumulative",
+            help="pstats sort key, e.g. cumulative, tottime, ncalls",
+        )
+
+    def handle(self, *args, **options):
+        getattr(self, f"handle_{options['action']}")(options)
+
+    def handle_list(self, options):
+        directory = get_profile_dir()
+        for name in list_profiles(directory)[: options["limit"]]:
+            stats = pstats.Stats(os.path.join(directory, f"{name}.pstats"))
+            self.stdout.write(f"{name}  {stats.total_tt * 1000:.1f}ms")
+
+    def handle_show(self, options):
+        names = list_profiles()
+        if options["name"]:
+            names = [name for name in names if name.startswith(options["name"])]
+        if not names:
+            raise CommandError("No such profile")
+
+        path = os.path.join(get_profile_dir(), f"{names[0]}.pstats")
+        output = io.StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.strip_dirs().sort_stats(options["sort"]).print_stats(options["limit"])
+
+        self.stdout.write(names[0])
+        self.stdout.write(output.getvalue())
+
+    def handle_token(self, options):
+        if not options["name"]:
+            raise CommandError("Pass the username to issue a token for")
+
+        try:
+            user = get_user_model().objects.get(username=options["name"])
+            token = make_profile_token(user)
+        except (get_user_model().DoesNotExist, ValueError) as error:
+            raise CommandError(error)
+
+        self.stdout.write(token)
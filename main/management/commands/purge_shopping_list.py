@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.purge import PURGE_MODES, ShoppingListPurge
+from main.sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive or hard delete soft deleted shopping-list items older than "
+        "the retention window, in small throttled batches. Safe to stop and "
+        "run again, it resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-days",
+            type=int,
+            default=settings.SHOPPING_LIST_PURGE_RETENTION_DAYS,
+            help="only purge items deleted more than this many days ago",
+        )
+        parser.add_argument(
+            "--mode",
+            choices=PURGE_MODES,
+            default="archive",
+            help="copy rows into the archive table before deleting them, or "
+            "just delete them",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.1,
+            help="seconds to pause between batches",
+        )
+        parser.add_argument(
+            "--after-id",
+            type=int,
+            default=0,
+            help="start after this id, the last_id a previous run reported",
+        )
+        parser.add_argument("--max-batches", type=int, default=None)
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="only purge this database, every shard in turn by default",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only count the items that would be purged",
+        )
+
+    def handle(self, *args, **options):
+        databases = [options["database"]] if options["database"] else get_shards()
+        for using in databases:
+            self.purge(using, options)
+
+    def purge(self, using, options):
+        purge = ShoppingListPurge(
+            timedelta(days=options["retention_days"]),
+            mode=options["mode"],
+            batch_size=options["batch_size"],
+            sleep=options["sleep"],
+            after_id=options["after_id"],
+            max_batches=options["max_batches"],
+            using=using,
+        )
+
+        if options["dry_run"]:
+            self.stdout.write(
+                f"{using}: {purge.count()} items deleted before "
+                f"{purge.cutoff.isoformat()} would be purged"
+            )
+            return
+
+        def progress(summary):
+            self.stdout.write(
+                f"{using} batch {summary['batches']}: {summary['purged']} purged, "
+                f"last_id={summary['last_id']}"
+            )
+
+        summary = purge.run(progress=progress)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{using}: {summary['purged']} items purged ({options['mode']}) in "
+                f"{summary['batches']} batches, last_id={summary['last_id']}"
+            )
+        )
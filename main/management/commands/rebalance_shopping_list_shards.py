@@ -0,0 +1,93 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from main.sharding import ShardMove, get_placement, get_shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users' shopping-list rows between shards while the API keeps "
+        "serving them: the given users to --to, or with --all every user the "
+        "hash ring now places on another shard (after adding one)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="user_ids",
+            help="move this user id, may be repeated",
+        )
+        parser.add_argument("--to", help="the shard to move --user users to")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="move every user whose shard is not the ring's placement",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--wait",
+            type=float,
+            default=None,
+            help="seconds to wait for workers to see a map change, "
+            "SHOPPING_LIST_SHARD_MAP_TTL + 1 by default",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only list the moves",
+        )
+
+    def handle(self, *args, **options):
+        if len(get_shards()) < 2:
+            raise CommandError("SHOPPING_LIST_SHARDS lists fewer than two shards")
+
+        if options["all"]:
+            moves = self.get_misplaced()
+        elif options["user_ids"] and options["to"]:
+            moves = [(user_id, options["to"]) for user_id in options["user_ids"]]
+        else:
+            raise CommandError("Pass --user and --to, or --all")
+
+        moved = 0
+        for user_id, target in moves:
+            if options["dry_run"]:
+                self.stdout.write(f"user {user_id} -> {target}")
+                continue
+
+            try:
+                move = ShardMove(
+                    user_id,
+                    target,
+                    batch_size=options["batch_size"],
+                    wait=options["wait"],
+                )
+            except ValueError as error:
+                raise CommandError(error)
+
+            summary = move.run()
+            if summary["source"] != target:
+                moved += 1
+            self.stdout.write(
+                f"user {user_id}: {summary['source']} -> {target}, "
+                f"{summary['copied']} items copied"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"{moved} users moved"))
+
+    def get_misplaced(self):
+        # users without a map row are still on the first shard
+        users = (
+            get_user_model()
+            .objects.using(DEFAULT_DB_ALIAS)
+            .order_by("id")
+            .values_list("id", "shoppinglistshard__alias")
+        )
+        first = get_shards()[0]
+        return [
+            (user_id, get_placement(user_id))
+            for user_id, alias in users.iterator()
+            if (alias or first) != get_placement(user_id)
+        ]
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from main.models import ShoppingListStats
+from main.sharding import get_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-user shopping-list stats rollups from the items, "
+        "a batch of users per grouped aggregation"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="user_ids",
+            help="only rebuild this user id, may be repeated",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="rebuild on this database, each user's shard by default",
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by("id")
+        if options["user_ids"]:
+            users = users.filter(id__in=options["user_ids"])
+
+        last_id, rebuilt = 0, 0
+        while True:
+            user_ids = list(
+                users.filter(id__gt=last_id).values_list("id", flat=True)[
+                    : options["batch_size"]
+                ]
+            )
+            if not user_ids:
+                break
+
+            shards = {}
+            for user_id in user_ids:
+                using = options["database"] or get_shard(user_id)
+                shards.setdefault(using, []).append(user_id)
+            for using, shard_user_ids in shards.items():
+                ShoppingListStats.rebuild(shard_user_ids, using=using)
+
+            last_id = user_ids[-1]
+            rebuilt += len(user_ids)
+            self.stdout.write(f"{rebuilt} users rebuilt, last_id={last_id}")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {rebuilt} users"))
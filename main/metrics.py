@@ -0,0 +1,336 @@
+import atexit
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where a shared METRICS_DIR goes unlocked
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, math.inf)
+
+# the numbers of workers that are gone, folded together by compact()
+RETIRED_FILENAME = "metrics-retired.json"
+WORKER_FILENAME = re.compile(r"metrics-(\d+)-\d+\.json")
+# a file nobody flushed for this many intervals is retired whatever its pid,
+# which says nothing about workers on other hosts sharing the directory
+STALE_FLUSHES = 60
+
+# name: (type, help, label names, histogram buckets)
+METRICS = {
+    "shopping_http_requests_total": (
+        "counter",
+        "Requests served by view, method and status, 5xx statuses are errors",
+        ("view", "method", "status"),
+        None,
+    ),
+    "shopping_http_request_duration_seconds": (
+        "histogram",
+        "Request latency by view, method and status",
+        ("view", "method", "status"),
+        LATENCY_BUCKETS,
+    ),
+    "shopping_db_queries_per_request": (
+        "histogram",
+        "SQL statements run per request by view and method",
+        ("view", "method"),
+        QUERY_BUCKETS,
+    ),
+    "shopping_list_cache_lookups_total": (
+        "counter",
+        "Shopping list GET cache lookups by result, hit or miss",
+        ("result",),
+        None,
+    ),
+}
+
+
+class MetricsRegistry:
+    """
+    This process's counters and fixed-bucket histograms. Updates take one
+    uncontended lock for a few dict operations. With ``directory`` set the
+    process writes a snapshot file there every ``flush_interval`` seconds
+    and collect() sums the files of all workers, after compact() folds the
+    ones of dead workers into a single retired snapshot.
+    """
+
+    def __init__(self, directory=None, flush_interval=5, stale_after=None):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.stale_after = (
+            stale_after if stale_after is not None else flush_interval * STALE_FLUSHES
+        )
+        self.reset()
+
+    def reset(self):
+        """
+        Start empty under a new file name, also run in a forked worker so it
+        does not report the parent's numbers twice
+        """
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        # a recycled pid must not overwrite a dead worker's cumulative file
+        self.filename = f"metrics-{os.getpid()}-{time.time_ns()}.json"
+        self.last_flush = time.monotonic()
+        # what the file holds, so it can be taken back out once retired
+        self.flushed = None
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        index = bisect_left(buckets, value)
+        key = (name, labels)
+
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # one count per bucket, then the sum of observed values
+                histogram = self.histograms[key] = [0] * len(buckets) + [0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def record_request(self, view, method, status, duration, queries):
+        self.inc("shopping_http_requests_total", (view, method, str(status)))
+        self.observe(
+            "shopping_http_request_duration_seconds", (view, method, str(status)), duration
+        )
+        self.observe("shopping_db_queries_per_request", (view, method), queries)
+
+        if self.directory and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return make_snapshot(self.counters, self.histograms)
+
+    def subtract(self, snapshot):
+        counters, histograms = merge_snapshots([snapshot])
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] -= value
+            for key, values in histograms.items():
+                self.histograms[key] = [
+                    a - b for a, b in zip(self.histograms[key], values)
+                ]
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the directory's lock file, flush() and compact() must not
+        interleave
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def write(self, filename, snapshot):
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(snapshot, file)
+        os.replace(path, os.path.join(self.directory, filename))
+
+    def flush(self):
+        """
+        Atomically replace this process's snapshot file
+        """
+        self.last_flush = time.monotonic()
+
+        with self.locked():
+            path = os.path.join(self.directory, self.filename)
+            if self.flushed is not None and not os.path.exists(path):
+                # compact() took this worker for dead, its numbers so far are
+                # in the retired file; go on with the rest under a new name
+                self.subtract(self.flushed)
+                self.filename = f"metrics-{os.getpid()}-{time.time_ns()}.json"
+
+            self.flushed = self.snapshot()
+            self.write(self.filename, self.flushed)
+
+    def is_retired(self, filename):
+        match = WORKER_FILENAME.fullmatch(filename)
+        if not match:
+            return False
+
+        path = os.path.join(self.directory, filename)
+        try:
+            if time.time() - os.path.getmtime(path) > self.stale_after:
+                return True
+            os.kill(int(match.group(1)), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            # gone meanwhile, or a live process owned by another user
+            return False
+        return False
+
+    def compact(self):
+        """
+        Fold the files of dead workers into RETIRED_FILENAME, so the
+        directory holds one file per live worker plus one. Run with the
+        lock held.
+        """
+        retired = [
+            filename
+            for filename in sorted(os.listdir(self.directory))
+            if filename != self.filename and self.is_retired(filename)
+        ]
+        if not retired:
+            return
+
+        snapshots = read_snapshots(self.directory, [RETIRED_FILENAME, *retired])
+        self.write(RETIRED_FILENAME, make_snapshot(*merge_snapshots(snapshots)))
+        for filename in retired:
+            os.remove(os.path.join(self.directory, filename))
+
+    def collect(self):
+        """
+        Snapshots of every worker, this one live, the others as last flushed
+        """
+        snapshots = [self.snapshot()]
+
+        if self.directory and os.path.isdir(self.directory):
+            with self.locked():
+                self.compact()
+                filenames = [
+                    filename
+                    for filename in sorted(os.listdir(self.directory))
+                    if filename != self.filename and filename.endswith(".json")
+                ]
+                snapshots += read_snapshots(self.directory, filenames)
+
+        return merge_snapshots(snapshots)
+
+
+def read_snapshots(directory, filenames):
+    snapshots = []
+    for filename in filenames:
+        try:
+            with open(os.path.join(directory, filename)) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def make_snapshot(counters, histograms):
+    return {
+        "counters": [
+            [name, list(labels), value] for (name, labels), value in counters.items()
+        ],
+        "histograms": [
+            [name, list(labels), list(values)]
+            for (name, labels), values in histograms.items()
+        ],
+    }
+
+
+def merge_snapshots(snapshots):
+    counters, histograms = {}, {}
+
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(labels))
+            counters[key] = counters.get(key, 0) + value
+
+        for name, labels, values in snapshot["histograms"]:
+            key = (name, tuple(labels))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = list(values)
+
+    return counters, histograms
+
+
+def format_labels(label_names, labels, **extra):
+    pairs = list(zip(label_names, labels)) + list(extra.items())
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def render_metrics(counters, histograms):
+    """
+    Prometheus text exposition format, version 0.0.4
+    """
+    lines = []
+
+    for name, (metric_type, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+        if metric_type == "counter":
+            for (sample_name, labels), value in sorted(counters.items()):
+                if sample_name == name:
+                    lines.append(
+                        f"{name}{format_labels(label_names, labels)} {format_number(value)}"
+                    )
+            continue
+
+        for (sample_name, labels), values in sorted(histograms.items()):
+            if sample_name != name:
+                continue
+
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                bucket_labels = format_labels(label_names, labels, le=format_number(bound))
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+
+            label_text = format_labels(label_names, labels)
+            lines.append(f"{name}_sum{label_text} {format_number(values[-1])}")
+            lines.append(f"{name}_count{label_text} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(
+                    directory=settings.METRICS_DIR or None,
+                    flush_interval=settings.METRICS_FLUSH_INTERVAL,
+                )
+                # workers forked from a preloaded master start from zero
+                os.register_at_fork(after_in_child=_registry.reset)
+                if _registry.directory:
+                    atexit.register(_registry.flush)
+
+    return _registry
@@ -0,0 +1,245 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from main.metrics import get_registry
+from main.routers import apin_to_primary, get_replicas, pin_to_primary
+from main.timing import RequestTiming, current_timing, install_query_recorder
+
+timing_logger = logging.getLogger("main.timing")
+
+
+class RequestTimingMiddleware:
+    """
+    Times every request: SQL statements and their total time, the slowest
+    ones, the auth, page, serialize and render segments, the view and the
+    whole request. The numbers go out as a Server-Timing header and one
+    log line on the main.timing logger; requests slower than
+    REQUEST_TIMING_SLOW_MS log a warning with the captured SQL.
+
+    Not loaded at all unless REQUEST_TIMING_ENABLED is set. A streamed
+    body is produced after the middleware returns, so its queries are not
+    counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_TIMING_ENABLED", False):
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.slow_ms = settings.REQUEST_TIMING_SLOW_MS
+        self.max_queries = settings.REQUEST_TIMING_MAX_QUERIES
+        self.slowest = settings.REQUEST_TIMING_SLOWEST_QUERIES
+        install_query_recorder()
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            # Django would push a sync process_view onto a thread
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timing = RequestTiming(self.max_queries, self.slowest)
+        token = current_timing.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+
+        self.finish(request, response, timing)
+        return response
+
+    async def __acall__(self, request):
+        timing = RequestTiming(self.max_queries, self.slowest)
+        token = current_timing.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(token)
+
+        self.finish(request, response, timing)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.start_view()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.start_view()
+
+    def start_view(self):
+        timing = current_timing.get()
+        if timing is not None:
+            timing.view_start = time.perf_counter()
+
+    def finish(self, request, response, timing):
+        end = time.perf_counter()
+        total_ms = (end - timing.start) * 1000
+        view_ms = (end - timing.view_start) * 1000 if timing.view_start else None
+        db_ms = timing.query_time * 1000
+
+        metrics = [f'db;dur={db_ms:.1f};desc="{timing.query_count} queries"']
+        metrics += [
+            f"{name};dur={duration * 1000:.1f}"
+            for name, duration in timing.segments.items()
+        ]
+        if view_ms is not None:
+            metrics.append(f"view;dur={view_ms:.1f}")
+        metrics.append(f"total;dur={total_ms:.1f}")
+        response["Server-Timing"] = ", ".join(metrics)
+
+        match = request.resolver_match
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": match.view_name if match else None,
+            "status": response.status_code,
+            "total_ms": round(total_ms, 1),
+            "view_ms": round(view_ms, 1) if view_ms is not None else None,
+            "db_ms": round(db_ms, 1),
+            "queries": timing.query_count,
+            **{
+                f"{name}_ms": round(duration * 1000, 1)
+                for name, duration in timing.segments.items()
+            },
+        }
+        message = " ".join(f"{key}={value}" for key, value in record.items())
+
+        if total_ms < self.slow_ms:
+            timing_logger.info(message, extra={"timing": record})
+            return
+
+        record["slowest"] = [
+            {"ms": round(duration * 1000, 1), "db": alias, "sql": sql}
+            for duration, alias, sql in timing.get_slowest()
+        ]
+        sql = "\n".join(
+            f"  {duration * 1000:.1f}ms [{alias}] {sql}"
+            for duration, alias, sql in timing.queries
+        )
+        timing_logger.warning(
+            f"slow request {message}\n{sql}", extra={"timing": record}
+        )
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and records latency and SQL statement histograms per
+    view, method and status in main.metrics. Not loaded unless
+    METRICS_ENABLED is set.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "METRICS_ENABLED", False):
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.registry = get_registry()
+        install_query_recorder()
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        # share RequestTimingMiddleware's query count when it runs too
+        timing = current_timing.get()
+        token = None
+        if timing is None:
+            timing = RequestTiming(max_queries=0, slowest=0)
+            token = current_timing.set(timing)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                current_timing.reset(token)
+
+        self.record(request, response, timing, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        timing = current_timing.get()
+        token = None
+        if timing is None:
+            timing = RequestTiming(max_queries=0, slowest=0)
+            token = current_timing.set(timing)
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                current_timing.reset(token)
+
+        self.record(request, response, timing, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, timing, duration):
+        match = request.resolver_match
+        # unmatched paths share one label, so scanners cannot grow the series
+        view = match.view_name if match else "unmatched"
+
+        self.registry.record_request(
+            view, request.method, response.status_code, duration, timing.query_count
+        )
+
+
+class ReplicaPinMiddleware:
+    """
+    Pins a user to the primary for REPLICA_PIN_SECONDS after each write
+    they make (a successful POST, PUT, PATCH or DELETE), so the reads
+    read_from_replica() would send to a lagging replica see it. Not loaded
+    unless DATABASE_REPLICAS is set.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_replicas():
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        response = self.get_response(request)
+        user_id = self.get_written_user_id(request, response)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        user_id = self.get_written_user_id(request, response)
+        if user_id is not None:
+            await apin_to_primary(user_id)
+        return response
+
+    def get_written_user_id(self, request, response):
+        if request.method in ("GET", "HEAD", "OPTIONS") or response.status_code >= 400:
+            return None
+        # DRF hands the authenticated user down to the Django request
+        user = getattr(request, "user", None)
+        if user is None or not user.is_authenticated:
+            return None
+        return user.id
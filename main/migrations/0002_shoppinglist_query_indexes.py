@@ -0,0 +1,25 @@
+# Generated by Django 4.2.5 on 2026-10-18 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'id'], name='shopping_user_id_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'created_at'], name='shopping_user_created_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'name'], name='shopping_user_name_live_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# GIN trigram indexes need pg_trgm, so they are created only on PostgreSQL;
+# other databases fall back to main.search.NgramSearchBackend
+TRIGRAM_INDEXES = {
+    "shopping_name_trgm_live_idx": "name",
+    "shopping_note_trgm_live_idx": "note",
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for index_name, column in TRIGRAM_INDEXES.items():
+        # UPPER(column::text) is exactly what Django emits for icontains
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "main_shoppinglist" '
+            f'USING gin ((UPPER("{column}"::text)) gin_trgm_ops) '
+            f'WHERE NOT "is_deleted"'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for index_name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{index_name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0002_shoppinglist_query_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.5 on 2026-10-18 06:50
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Lower
+from django.utils import timezone
+import django.db.models.functions.text
+
+
+def merge_duplicate_names(apps, schema_editor):
+    """
+    Fold live rows sharing a user and a case-insensitive name into the
+    oldest one, so the unique constraint below can be created
+    """
+    ShoppingList = apps.get_model("main", "ShoppingList")
+    live = ShoppingList.objects.using(schema_editor.connection.alias).filter(
+        is_deleted=False
+    )
+
+    duplicates = (
+        live.annotate(lower_name=Lower("name"))
+        .values("user_id", "lower_name")
+        .annotate(count=Count("id"), total_quantity=Sum("quantity"))
+        .filter(count__gt=1)
+    )
+
+    now = timezone.now()
+    for duplicate in list(duplicates):
+        ids = list(
+            live.annotate(lower_name=Lower("name"))
+            .filter(user_id=duplicate["user_id"], lower_name=duplicate["lower_name"])
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        live.filter(id=ids[0]).update(
+            quantity=duplicate["total_quantity"], updated_at=now
+        )
+        live.filter(id__in=ids[1:]).update(is_deleted=True, updated_at=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_shoppinglist_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shoppinglist',
+            constraint=models.UniqueConstraint(models.F('user'), django.db.models.functions.text.Lower('name'), condition=models.Q(('is_deleted', False)), name='shopping_user_name_live_uniq'),
+        ),
+    ]
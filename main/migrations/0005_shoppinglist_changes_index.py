@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_shoppinglist_unique_live_name'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='shopping_user_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Upper
+
+INDEX_NAME = "main_user_email_upper_uniq"
+
+
+def create_email_index(apps, schema_editor):
+    """
+    Case-insensitive unique index on the user e-mail, which serves the
+    single email-or-username lookup at login and makes the database the
+    judge of duplicate sign-ups. Blank e-mails stay allowed.
+    """
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    users = User.objects.using(schema_editor.connection.alias).exclude(email="")
+
+    duplicates = (
+        users.annotate(upper_email=Upper("email"))
+        .values("upper_email")
+        .annotate(count=Count("pk"))
+        .filter(count__gt=1)
+    )
+    if duplicates.exists():
+        raise RuntimeError(
+            "Some users share an e-mail address (ignoring case), resolve them "
+            "before applying this migration: "
+            + ", ".join(duplicate["upper_email"] for duplicate in duplicates[:10])
+        )
+
+    quote_name = schema_editor.quote_name
+    column = quote_name(User._meta.get_field("email").column)
+    # UPPER(email::text) is what Django emits for email__iexact on PostgreSQL
+    if schema_editor.connection.vendor == "postgresql":
+        expression = f"UPPER({column}::text)"
+    else:
+        expression = f"UPPER({column})"
+
+    schema_editor.execute(
+        f"CREATE UNIQUE INDEX {quote_name(INDEX_NAME)} "
+        f"ON {quote_name(User._meta.db_table)} ({expression}) "
+        f"WHERE {column} <> ''"
+    )
+
+
+def drop_email_index(apps, schema_editor):
+    schema_editor.execute(f"DROP INDEX IF EXISTS {schema_editor.quote_name(INDEX_NAME)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("main", "0005_shoppinglist_changes_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main', '0006_user_email_ci_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=200)),
+                ('quantity', models.IntegerField()),
+                ('note', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('deleted_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'SHOPPING LIST ARCHIVE',
+                'verbose_name_plural': 'SHOPPING LIST ARCHIVES',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShoppingListPurgeMark',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('purged_through', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['id'], name='shopping_deleted_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='shoppinglistarchive',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglistarchive',
+            index=models.Index(fields=['user', 'deleted_at'], name='shopping_archive_user_idx'),
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:16
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill_stats(apps, schema_editor):
+    """
+    Seed the rollups from the existing rows; from here on the ShoppingList
+    write classmethods keep them current
+    """
+    db = schema_editor.connection.alias
+    ShoppingList = apps.get_model("main", "ShoppingList")
+    ShoppingListArchive = apps.get_model("main", "ShoppingListArchive")
+    ShoppingListStats = apps.get_model("main", "ShoppingListStats")
+    ShoppingListDailyStats = apps.get_model("main", "ShoppingListDailyStats")
+
+    totals = (
+        ShoppingList.objects.using(db)
+        .filter(is_deleted=False)
+        .values("user")
+        .annotate(item_count=Count("id"), total_quantity=Sum("quantity"))
+        .values_list("user", "item_count", "total_quantity")
+    )
+    ShoppingListStats.objects.using(db).bulk_create(
+        (
+            ShoppingListStats(
+                user_id=user_id, item_count=item_count, total_quantity=total_quantity
+            )
+            for user_id, item_count, total_quantity in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+    added = Counter()
+    for model in [ShoppingList, ShoppingListArchive]:
+        rows = (
+            model.objects.using(db)
+            .annotate(day=TruncDate("created_at"))
+            .values("user", "day")
+            .annotate(added=Count("id"))
+            .values_list("user", "day", "added")
+        )
+        for user_id, day, count in rows.iterator():
+            added[user_id, day] += count
+
+    ShoppingListDailyStats.objects.using(db).bulk_create(
+        (
+            ShoppingListDailyStats(user_id=user_id, day=day, added=count)
+            for (user_id, day), count in added.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0007_shoppinglist_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('item_count', models.IntegerField(default=0)),
+                ('total_quantity', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShoppingListDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('added', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistdailystats',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='shopping_daily_stats_uniq'),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,66 @@
+from collections import Counter
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import Q
+from django.core.exceptions import EmptyResultSet
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Count, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, Lower, TruncDate
+from django.utils import timezone
+
+from main.search import get_search_backend
+from main.sharding import aget_read_db, get_read_db, get_shard
+
+
+class LiveShoppingListManager(models.Manager):
+    """
+    Default ShoppingList manager, soft deleted rows are left out. Use
+    ShoppingList.all_objects to see tombstones too.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
+
+def supports_update_returning(connection):
+    """
+    Whether the database can return columns from an UPDATE, which is not
+    the same feature as returning them from an INSERT (MariaDB has only
+    the latter)
+    """
+    if connection.vendor == "postgresql":
+        return True
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def compile_update(queryset, values):
+    """
+    (sql, params) of the UPDATE that ``queryset.update(**values)`` runs,
+    None when Django's internal UpdateQuery is not usable. Raises
+    EmptyResultSet when the queryset cannot match anything.
+    """
+    try:
+        from django.db.models.sql import UpdateQuery
+
+        query = queryset.query.chain(UpdateQuery)
+        query.add_update_values(values)
+        compiler = query.get_compiler(queryset.db)
+    except (ImportError, AttributeError, TypeError):
+        # the internals moved in this Django version, use the fallback
+        return None
+
+    return compiler.as_sql()
 
 
 # Create your models here.
 class ShoppingList(models.Model):
-    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    # auth_user stays on the default database while the rows may live on a
+    # shard, see main.sharding, so there is no constraint to enforce
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, db_constraint=False
+    )
     name = models.CharField(max_length=200)
     quantity = models.IntegerField(default=1)
     note = models.TextField(blank=True, null=True)
@@ -13,30 +68,646 @@ class ShoppingList(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_deleted = models.BooleanField(default=False)
 
+    objects = LiveShoppingListManager()
+    all_objects = models.Manager()
+
+    # fields clients may order by, see order_data
+    ORDERING_FIELDS = ["name", "quantity", "created_at", "updated_at"]
+
     class Meta:
         verbose_name = "SHOPPING LIST"
         verbose_name_plural = "SHOPPING LISTS"
+        constraints = [
+            # one live item per name and user, merge_shopping_list upserts
+            # against it with ON CONFLICT
+            models.UniqueConstraint(
+                F("user"),
+                Lower("name"),
+                condition=Q(is_deleted=False),
+                name="shopping_user_name_live_uniq",
+            ),
+        ]
+        # every classmethod below filters on the owner and live rows, so the
+        # indexes are partial on is_deleted=False and lead with user
+        indexes = [
+            models.Index(
+                fields=["user", "id"],
+                condition=Q(is_deleted=False),
+                name="shopping_user_id_live_idx",
+            ),
+            models.Index(
+                fields=["user", "created_at"],
+                condition=Q(is_deleted=False),
+                name="shopping_user_created_live_idx",
+            ),
+            models.Index(
+                fields=["user", "name"],
+                condition=Q(is_deleted=False),
+                name="shopping_user_name_live_idx",
+            ),
+            # the changes feed reads tombstones too, so this one is not partial
+            models.Index(
+                fields=["user", "updated_at", "id"],
+                name="shopping_user_updated_idx",
+            ),
+            # main.purge walks tombstones in id order, dead rows only
+            models.Index(
+                fields=["id"],
+                condition=Q(is_deleted=True),
+                name="shopping_deleted_id_idx",
+            ),
+        ]
+
+    @property
+    def etag(self):
+        updated_at = int(self.updated_at.timestamp()) * 1000000
+        return f'"{self.id}-{updated_at + self.updated_at.microsecond}"'
 
     @classmethod
     def create_shopping_list(cls, **kwargs):
-        return cls.objects.create(**kwargs)
+        using = get_shard(kwargs["user_id"], write=True)
+        with transaction.atomic(using=using):
+            shopping_list = cls.objects.using(using).create(**kwargs)
+            ShoppingListStats.apply(
+                shopping_list.user_id,
+                items=1,
+                quantity=shopping_list.quantity,
+                added={timezone.localdate(shopping_list.created_at): 1},
+                using=using,
+            )
+
+        return shopping_list
+
+    @classmethod
+    def bulk_create_shopping_list(cls, user_id, items, batch_size=None):
+        using = get_shard(user_id, write=True)
+        with transaction.atomic(using=using):
+            shopping_lists = cls.objects.using(using).bulk_create(
+                (cls(user_id=user_id, **item) for item in items), batch_size=batch_size
+            )
+            if shopping_lists:
+                ShoppingListStats.apply(
+                    user_id,
+                    items=len(shopping_lists),
+                    quantity=sum(item.quantity for item in shopping_lists),
+                    added={timezone.localdate(): len(shopping_lists)},
+                    using=using,
+                )
+
+        return shopping_lists
+
+    @classmethod
+    def bulk_update_shopping_list(cls, user_id, items):
+        """
+        ``items`` maps item id to the fields to change. Rows are locked and
+        written back with a single bulk UPDATE. Returns the updated rows and
+        the ids left untouched because their new name is taken, see
+        get_name_conflicts
+        """
+        using = get_shard(user_id, write=True)
+        shopping_lists = (
+            cls.get_shopping_list(user_id, using=using)
+            .select_for_update()
+            .in_bulk(items.keys())
+        )
+
+        conflicts = cls.get_name_conflicts(
+            user_id,
+            {id: items[id]["name"] for id in shopping_lists if "name" in items[id]},
+            using=using,
+        )
+        for id in conflicts:
+            del shopping_lists[id]
+
+        if not shopping_lists:
+            return [], conflicts
+
+        now = timezone.now()
+        fields = {"updated_at"}
+        quantity = 0
+        for id, shopping_list in shopping_lists.items():
+            quantity -= shopping_list.quantity
+            for field, value in items[id].items():
+                setattr(shopping_list, field, value)
+                fields.add(field)
+            shopping_list.updated_at = now
+            quantity += shopping_list.quantity
+
+        cls.objects.using(using).bulk_update(shopping_lists.values(), sorted(fields))
+        if quantity:
+            ShoppingListStats.apply(user_id, quantity=quantity, using=using)
+
+        return list(shopping_lists.values()), conflicts
+
+    @classmethod
+    def get_name_conflicts(cls, user_id, names, using=None):
+        """
+        The ids among ``names`` (item id to new name) whose rename would
+        break the live-name unique constraint: the name (case insensitive)
+        belongs to another live item, or to a lower id of the same batch.
+        The unique index is checked row by row, so renames that only work
+        in some order, such as swapping two names, conflict as well.
+        """
+        if not names:
+            return set()
+
+        holders = dict(
+            cls.get_shopping_list(user_id, using=using)
+            .annotate(lower_name=Lower("name"))
+            .filter(lower_name__in={name.lower() for name in names.values()})
+            .values_list("lower_name", "id")
+        )
+
+        conflicts, claimed = set(), set()
+        for id, name in sorted(names.items()):
+            name = name.lower()
+            if holders.get(name, id) != id or name in claimed:
+                conflicts.add(id)
+            else:
+                claimed.add(name)
+
+        return conflicts
+
+    @classmethod
+    def bulk_delete_shopping_list(cls, user_id, ids):
+        """
+        Soft delete the user's live items among ``ids`` in one UPDATE and
+        return the ids that were deleted
+        """
+        using = get_shard(user_id, write=True)
+        shopping_list = cls.get_shopping_list(user_id, using=using).filter(id__in=ids)
+        deleted = list(shopping_list.select_for_update().values_list("id", "quantity"))
+        deleted_ids = [id for id, _ in deleted]
+
+        if deleted_ids:
+            cls.objects.using(using).filter(id__in=deleted_ids).update(
+                is_deleted=True, updated_at=timezone.now()
+            )
+            ShoppingListStats.apply(
+                user_id,
+                items=-len(deleted),
+                quantity=-sum(quantity for _, quantity in deleted),
+                using=using,
+            )
+
+        return deleted_ids
+
+    @classmethod
+    def filter_by_etags(cls, queryset, etags):
+        """
+        Narrow ``queryset`` to rows whose etag is in ``etags`` (an If-Match
+        list), so the precondition is checked by the UPDATE itself
+        """
+        if etags is None or "*" in etags:
+            return queryset
+
+        # match the whole (id, updated_at) pair, rows written by one bulk
+        # update share their updated_at
+        matches = Q(pk__in=[])
+        for etag in etags:
+            try:
+                id, updated_at = etag.strip('"').split("-")
+                seconds, microseconds = divmod(int(updated_at), 1000000)
+                id = int(id)
+            except ValueError:
+                continue
+
+            updated_at = datetime.fromtimestamp(seconds, tz=dt_timezone.utc).replace(
+                microsecond=microseconds
+            )
+            matches |= Q(id=id, updated_at=updated_at)
+
+        return queryset.filter(matches)
+
+    @classmethod
+    def update_returning(cls, queryset, **values):
+        """
+        UPDATE the single row matched by ``queryset``, touching only the
+        given columns plus updated_at, and return it. One round trip with
+        RETURNING where the database supports it, None when nothing matched
+        """
+        values["updated_at"] = timezone.now()
+        connection = connections[queryset.db]
+
+        update = None
+        if supports_update_returning(connection):
+            try:
+                update = compile_update(queryset, values)
+            except EmptyResultSet:
+                return None
+
+        if update is None:
+            with transaction.atomic(using=queryset.db):
+                pk = queryset.select_for_update().values_list("pk", flat=True).first()
+                if pk is None:
+                    return None
+
+                shopping_list = cls.all_objects.using(queryset.db).filter(pk=pk)
+                shopping_list.update(**values)
+                return shopping_list.get()
+
+        update_sql, params = update
+        with connection.cursor() as cursor:
+            cursor.execute(f"{update_sql} RETURNING {cls.returning_sql(connection)}", params)
+            row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return cls.from_returning_row(queryset.db, row)
+
+    @classmethod
+    def returning_sql(cls, connection):
+        return ", ".join(
+            connection.ops.quote_name(field.column)
+            for field in cls._meta.concrete_fields
+        )
+
+    @classmethod
+    def from_returning_row(cls, using, row):
+        """
+        Build an instance from a raw row in concrete field order, running
+        the same value converters the ORM would
+        """
+        connection = connections[using]
+        fields = cls._meta.concrete_fields
+
+        values = []
+        for value, field in zip(row, fields):
+            column = field.get_col(cls._meta.db_table)
+            converters = connection.ops.get_db_converters(
+                column
+            ) + column.get_db_converters(connection)
+            for converter in converters:
+                value = converter(value, column, connection)
+            values.append(value)
+
+        return cls.from_db(using, [field.attname for field in fields], values)
+
+    @classmethod
+    def merge_shopping_list(cls, user_id, name, quantity, note=None, using=None):
+        """
+        Add ``quantity`` to the user's live item with the same name (case
+        insensitive), or create it. Returns (shopping_list, created).
+
+        On PostgreSQL and SQLite this is an INSERT ... ON CONFLICT against
+        the partial unique constraint, so concurrent adds cannot race.
+        """
+        using = using or get_shard(user_id, write=True)
+        connection = connections[using]
+        now = timezone.now()
+
+        with transaction.atomic(using=using):
+            if connection.vendor not in ("postgresql", "sqlite"):
+                shopping_list, created = cls._merge_shopping_list_fallback(
+                    user_id, name, quantity, note, now, using
+                )
+            else:
+                with connection.cursor() as cursor:
+                    [(shopping_list, created)] = cls.merge_rows(
+                        cursor,
+                        using,
+                        [cls.merge_params(connection, user_id, name, quantity, note, now)],
+                    )
+
+            ShoppingListStats.apply(
+                user_id,
+                items=int(created),
+                quantity=quantity,
+                added={timezone.localdate(now): 1} if created else None,
+                using=using,
+            )
+
+        return shopping_list, created
+
+    @classmethod
+    def merge_rows(cls, cursor, using, rows):
+        """
+        Upsert ``rows`` (merge_params() lists with distinct names) and
+        return (shopping_list, created) pairs
+        """
+        connection = connections[using]
+        params = [param for row in rows for param in row]
+
+        if connection.vendor == "postgresql":
+            # only a row version written by the DO UPDATE has xmax set
+            sql = cls.merge_sql(connection, len(rows))
+            cursor.execute(f'{sql}, ("xmax" = 0)', params)
+            return [
+                (cls.from_returning_row(using, row[:-1]), row[-1])
+                for row in cursor.fetchall()
+            ]
+
+        # SQLite's RETURNING cannot tell an insert from an update, and the
+        # timestamps cannot either when both land in the same tick: insert
+        # the new names first, then merge into the rest. The insert takes
+        # the write lock, so no other writer can get in between
+        cursor.execute(cls.merge_sql(connection, len(rows), merge=False), params)
+        results = [
+            (cls.from_returning_row(using, row), True) for row in cursor.fetchall()
+        ]
+
+        inserted = {shopping_list.name for shopping_list, _ in results}
+        for user_id, name, quantity, note, _, updated_at, _ in rows:
+            if name in inserted:
+                continue
+            cursor.execute(
+                cls.merge_update_sql(connection),
+                [quantity, note, updated_at, user_id, name],
+            )
+            results.append((cls.from_returning_row(using, cursor.fetchone()), False))
+
+        return results
 
     @classmethod
-    def get_shopping_list(cls, user_id):
-        return cls.objects.filter(user__id=user_id, is_deleted=False)
+    def merge_sql(cls, connection, rows, merge=True):
+        """
+        INSERT of ``rows`` rows that adds to the quantity of a live item
+        with the same name instead (or, without ``merge``, skips it),
+        against the partial unique constraint
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * rows)
+        if merge:
+            action = (
+                f'DO UPDATE SET "quantity" = {table}."quantity" + EXCLUDED."quantity", '
+                f'"note" = COALESCE({table}."note", EXCLUDED."note"), '
+                '"updated_at" = EXCLUDED."updated_at" '
+            )
+        else:
+            action = "DO NOTHING "
+
+        return (
+            f"INSERT INTO {table} "
+            '("user_id", "name", "quantity", "note", "created_at", "updated_at", "is_deleted") '
+            f"VALUES {values} "
+            'ON CONFLICT ("user_id", LOWER("name")) WHERE NOT "is_deleted" '
+            f"{action}"
+            f"RETURNING {cls.returning_sql(connection)}"
+        )
+
+    @classmethod
+    def merge_update_sql(cls, connection):
+        """
+        The DO UPDATE of merge_sql() for one existing live item
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        return (
+            f'UPDATE {table} SET "quantity" = "quantity" + %s, '
+            '"note" = COALESCE("note", %s), "updated_at" = %s '
+            'WHERE "user_id" = %s AND LOWER("name") = LOWER(%s) AND NOT "is_deleted" '
+            f"RETURNING {cls.returning_sql(connection)}"
+        )
+
+    @classmethod
+    def merge_params(cls, connection, user_id, name, quantity, note, now):
+        field = cls._meta.get_field
+        return [
+            user_id,
+            name,
+            quantity,
+            note,
+            field("created_at").get_db_prep_save(now, connection),
+            field("updated_at").get_db_prep_save(now, connection),
+            False,
+        ]
+
+    @classmethod
+    def bulk_merge_shopping_list(cls, user_id, items, batch_size=500, using=None):
+        """
+        merge_shopping_list() for many ``items`` (name, quantity and
+        optional note dicts), one multi-row upsert per batch. Items sharing
+        a name (case insensitive) are folded together first, since one
+        statement may not upsert the same row twice. Returns
+        (shopping_list, created) pairs, one per distinct name.
+        """
+        merged = {}
+        for item in items:
+            key = item["name"].lower()
+            if key in merged:
+                merged[key]["quantity"] += item["quantity"]
+                if merged[key].get("note") is None:
+                    merged[key]["note"] = item.get("note")
+            else:
+                merged[key] = dict(item)
+
+        using = using or get_shard(user_id, write=True)
+        connection = connections[using]
+        if connection.vendor not in ("postgresql", "sqlite"):
+            return [
+                cls.merge_shopping_list(user_id, using=using, **item)
+                for item in merged.values()
+            ]
+
+        max_query_params = connection.features.max_query_params
+        if max_query_params:
+            batch_size = min(batch_size, max_query_params // 7)
+
+        now = timezone.now()
+        items = list(merged.values())
+        results = []
+
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            for start in range(0, len(items), batch_size):
+                rows = [
+                    cls.merge_params(
+                        connection,
+                        user_id,
+                        item["name"],
+                        item["quantity"],
+                        item.get("note"),
+                        now,
+                    )
+                    for item in items[start : start + batch_size]
+                ]
+                results += cls.merge_rows(cursor, using, rows)
+
+            created_count = sum(created for _, created in results)
+            ShoppingListStats.apply(
+                user_id,
+                items=created_count,
+                quantity=sum(item["quantity"] for item in items),
+                added={timezone.localdate(now): created_count} if created_count else None,
+                using=using,
+            )
+
+        return results
+
+    @classmethod
+    def _merge_shopping_list_fallback(cls, user_id, name, quantity, note, now, using):
+        for attempt in range(2):
+            try:
+                with transaction.atomic(using=using):
+                    existing = (
+                        cls.objects.using(using)
+                        .select_for_update()
+                        .filter(user__id=user_id, name__iexact=name)
+                        .first()
+                    )
+                    if existing is None:
+                        shopping_list = cls.objects.using(using).create(
+                            user_id=user_id, name=name, quantity=quantity, note=note
+                        )
+                        return shopping_list, True
+
+                    shopping_list = cls.update_returning(
+                        cls.objects.using(using).filter(pk=existing.pk),
+                        quantity=F("quantity") + quantity,
+                        note=Coalesce("note", Value(note)),
+                    )
+                    return shopping_list, False
+            except IntegrityError:
+                # a concurrent insert won, the next attempt merges into it
+                if attempt:
+                    raise
+
+    @classmethod
+    def update_shopping_list(cls, user_id, id, etags=None, **fields):
+        using = get_shard(user_id, write=True)
+        shopping_list = cls.filter_by_etags(
+            cls.get_shopping_list(user_id, using=using).filter(id=id), etags
+        )
+        if "quantity" not in fields and not fields.get("is_deleted"):
+            return cls.update_returning(shopping_list, **fields)
+
+        # quantity and delete writes move the user's stats in the same
+        # transaction, a new quantity needs the old one read under lock
+        with transaction.atomic(using=using):
+            old_quantity = None
+            if "quantity" in fields:
+                old_quantity = (
+                    shopping_list.select_for_update()
+                    .values_list("quantity", flat=True)
+                    .first()
+                )
+                if old_quantity is None:
+                    return None
+
+            updated = cls.update_returning(shopping_list, **fields)
+            if updated is None:
+                return None
+
+            if old_quantity is None:
+                old_quantity = updated.quantity
+
+            if updated.is_deleted:
+                ShoppingListStats.apply(
+                    updated.user_id, items=-1, quantity=-old_quantity, using=using
+                )
+            else:
+                ShoppingListStats.apply(
+                    updated.user_id, quantity=updated.quantity - old_quantity, using=using
+                )
+
+        return updated
+
+    @classmethod
+    def adjust_quantity(cls, user_id, id, delta, etags=None):
+        """
+        Atomically add ``delta`` (negative to subtract) to the quantity
+        """
+        using = get_shard(user_id, write=True)
+        shopping_list = cls.filter_by_etags(
+            cls.get_shopping_list(user_id, using=using).filter(id=id), etags
+        )
+
+        # the change is known up front, no need to read the old quantity
+        with transaction.atomic(using=using):
+            updated = cls.update_returning(shopping_list, quantity=F("quantity") + delta)
+            if updated is not None:
+                ShoppingListStats.apply(updated.user_id, quantity=delta, using=using)
+
+        return updated
+
+    @classmethod
+    def delete_shopping_list(cls, user_id, id, etags=None):
+        return cls.update_shopping_list(user_id, id, etags=etags, is_deleted=True)
+
+    @classmethod
+    def get_shopping_list(cls, user_id, using=None):
+        """
+        The user's live items, read from their shard (or a replica) unless
+        ``using`` says otherwise
+        """
+        return cls.objects.using(using or get_read_db(user_id)).filter(user__id=user_id)
 
     @classmethod
     def get_shopping_list_by_id(cls, user_id, id):
-        return cls.objects.filter(user__id=user_id, id=id, is_deleted=False).first()
+        return cls.get_shopping_list(user_id).filter(id=id).first()
+
+    @classmethod
+    async def aget_shopping_list_by_id(cls, user_id, id):
+        using = await aget_read_db(user_id)
+        return await cls.get_shopping_list(user_id, using=using).filter(id=id).afirst()
+
+    @classmethod
+    def get_live_names(cls, user_id, names):
+        """
+        The lower cased names among ``names`` the user already has live
+        """
+        return set(
+            cls.get_shopping_list(user_id)
+            .annotate(lower_name=Lower("name"))
+            .filter(lower_name__in={name.lower() for name in names})
+            .values_list("lower_name", flat=True)
+        )
 
     @classmethod
     def get_shopping_list_by_name(cls, user_id, name):
-        return cls.objects.filter(user__id=user_id, name=name, is_deleted=False).first()
+        return cls.get_shopping_list(user_id).filter(name=name).first()
+
+    @classmethod
+    def get_revision(cls, user_id):
+        """
+        Row count and latest updated_at over all the user's rows, soft
+        deleted ones included, so any create, update or delete changes it
+        """
+        return (
+            cls.all_objects.using(get_read_db(user_id))
+            .filter(user__id=user_id)
+            .aggregate(count=Count("id"), last_modified=Max("updated_at"))
+        )
+
+    @classmethod
+    async def aget_revision(cls, user_id):
+        using = await aget_read_db(user_id)
+        return await (
+            cls.all_objects.using(using)
+            .filter(user__id=user_id)
+            .aaggregate(count=Count("id"), last_modified=Max("updated_at"))
+        )
+
+    @classmethod
+    def get_changes(cls, user_id, since=None, limit=100, until=None):
+        """
+        Rows created, updated or soft deleted after the ``since`` high-water
+        mark, an (updated_at, id) pair, and up to ``until``, oldest first
+        """
+        changes = cls.all_objects.using(get_read_db(user_id)).filter(user__id=user_id)
+
+        if until is not None:
+            changes = changes.filter(updated_at__lte=until)
+
+        if since is not None:
+            updated_at, id = since
+            changes = changes.filter(
+                Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=id)
+            )
+
+        return changes.order_by("updated_at", "id")[:limit]
+
+    @classmethod
+    def text_match(cls, search):
+        return Q(name__icontains=search) | Q(note__icontains=search)
 
     @classmethod
     def search_shopping_list(cls, user_id, search):
-        return cls.objects.filter(
-            Q(user__id=user_id) & Q(name__icontains=search) & Q(is_deleted=False)
+        """
+        Name and note search, most relevant first, through the engine
+        configured in settings.SHOPPING_LIST_SEARCH_BACKEND
+        """
+        return get_search_backend().search(
+            cls.get_shopping_list(user_id), user_id, search
         )
 
     @classmethod
@@ -49,9 +720,372 @@ class ShoppingList(models.Model):
         return queryset
 
     @classmethod
-    def filter_by_date(cls, start_date, end_date, user_id):
-        return cls.objects.filter(
-            Q(user__id=user_id)
-            & Q(created_at__range=[start_date, end_date])
-            & Q(is_deleted=False)
+    def order_data(cls, queryset, ordering):
+        """
+        Multi-key ordering such as ["-quantity", "name"], id breaks ties
+        """
+        for term in ordering:
+            if term.lstrip("-") not in cls.ORDERING_FIELDS:
+                raise ValueError(f"Cannot order shopping list by {term}")
+
+        return queryset.order_by(*ordering, "id")
+
+    @classmethod
+    def select_fields(cls, queryset, fields):
+        """
+        Load only ``fields`` plus the columns the queryset is ordered by,
+        so a cursor position never needs a deferred column
+        """
+        names = {field.name for field in cls._meta.concrete_fields}
+        ordering = [
+            term.lstrip("-") for term in queryset.query.order_by if isinstance(term, str)
+        ]
+
+        return queryset.only(*fields, *[name for name in ordering if name in names])
+
+    @classmethod
+    def filter_by_date(cls, start_date, end_date, user_id, using=None):
+        """
+        Items created between ``start_date`` and ``end_date``, datetimes or
+        dates, which stand for their midnight in the current time zone
+        """
+        start_date, end_date = [
+            timezone.make_aware(datetime.combine(value, time.min))
+            if isinstance(value, date) and not isinstance(value, datetime)
+            else value
+            for value in [start_date, end_date]
+        ]
+        return cls.get_shopping_list(user_id, using=using).filter(
+            created_at__range=[start_date, end_date]
         )
+
+    @classmethod
+    def filter_shopping_list(
+        cls,
+        user_id,
+        search=None,
+        start_date=None,
+        end_date=None,
+        min_quantity=None,
+        max_quantity=None,
+        revision=None,
+        using=None,
+    ):
+        """
+        Combine any of the filters into a single query over the user's list.
+        ``revision`` (see get_revision) spares the search engine reading it,
+        ``using`` spares looking up the user's database.
+        """
+        if start_date and end_date:
+            shopping_list = cls.filter_by_date(
+                start_date, end_date, user_id, using=using
+            )
+        else:
+            shopping_list = cls.get_shopping_list(user_id, using=using)
+
+        if min_quantity is not None:
+            shopping_list = shopping_list.filter(quantity__gte=min_quantity)
+
+        if max_quantity is not None:
+            shopping_list = shopping_list.filter(quantity__lte=max_quantity)
+
+        if search:
+            shopping_list = get_search_backend().search(
+                shopping_list, user_id, search, revision=revision
+            )
+
+        return shopping_list
+
+
+class ShoppingListArchive(models.Model):
+    """
+    Soft deleted shopping-list rows moved out of the live table by
+    main.purge.ShoppingListPurge, under their original id
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, db_constraint=False
+    )
+    name = models.CharField(max_length=200)
+    quantity = models.IntegerField()
+    note = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    # updated_at of the tombstone, when the item was deleted
+    deleted_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "SHOPPING LIST ARCHIVE"
+        verbose_name_plural = "SHOPPING LIST ARCHIVES"
+        indexes = [
+            models.Index(
+                fields=["user", "deleted_at"],
+                name="shopping_archive_user_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_shopping_list(cls, shopping_list):
+        return cls(
+            id=shopping_list.id,
+            user_id=shopping_list.user_id,
+            name=shopping_list.name,
+            quantity=shopping_list.quantity,
+            note=shopping_list.note,
+            created_at=shopping_list.created_at,
+            deleted_at=shopping_list.updated_at,
+        )
+
+
+class ShoppingListPurgeMark(models.Model):
+    """
+    Latest deletion time among a user's purged tombstones. A sync cursor
+    from before it may have missed a deletion that the changes feed can no
+    longer show.
+    """
+
+    user = models.OneToOneField(
+        get_user_model(), on_delete=models.CASCADE, primary_key=True, db_constraint=False
+    )
+    purged_through = models.DateTimeField()
+
+    @classmethod
+    def get_purged_through(cls, user_id):
+        return (
+            cls.objects.using(get_read_db(user_id))
+            .filter(user__id=user_id)
+            .values_list("purged_through", flat=True)
+            .first()
+        )
+
+    @classmethod
+    def advance(cls, purged_through, using="default"):
+        """
+        Move the marks of the users in ``purged_through`` (user id to
+        deletion time) forward, never back. Run inside the purge
+        transaction.
+        """
+        marks = (
+            cls.objects.using(using)
+            .select_for_update()
+            .in_bulk(purged_through.keys())
+        )
+
+        for user_id, deleted_at in purged_through.items():
+            if user_id in marks:
+                mark = marks[user_id]
+                mark.purged_through = max(mark.purged_through, deleted_at)
+            else:
+                marks[user_id] = cls(user_id=user_id, purged_through=deleted_at)
+
+        cls.objects.using(using).bulk_create(
+            marks.values(),
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=["purged_through"],
+        )
+
+
+def increment_or_create(queryset, lookup, **deltas):
+    """
+    Add ``deltas`` to the columns of the row matching ``lookup``, creating
+    it with the deltas as its values when it does not exist yet
+    """
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+
+    for attempt in range(2):
+        if queryset.filter(**lookup).update(**updates):
+            return
+
+        try:
+            with transaction.atomic(using=queryset.db):
+                queryset.create(**lookup, **deltas)
+            return
+        except IntegrityError:
+            # a concurrent write created it, the next attempt updates it
+            if attempt:
+                raise
+
+
+class ShoppingListStats(models.Model):
+    """
+    Rollup of a user's live list, maintained by the ShoppingList write
+    classmethods in the same transaction as the write, so reading it is a
+    primary key lookup however long the list is
+    """
+
+    user = models.OneToOneField(
+        get_user_model(), on_delete=models.CASCADE, primary_key=True, db_constraint=False
+    )
+    item_count = models.IntegerField(default=0)
+    total_quantity = models.BigIntegerField(default=0)
+
+    @classmethod
+    def apply(cls, user_id, items=0, quantity=0, added=None, using=None):
+        """
+        Add ``items`` and ``quantity`` to the user's totals and ``added``
+        (date to item count) to their daily adds. The totals row is always
+        written first, its lock orders the user's writes against rebuild().
+        """
+        if not (items or quantity or added):
+            return
+
+        using = using or get_shard(user_id, write=True)
+        with transaction.atomic(using=using, savepoint=False):
+            increment_or_create(
+                cls.objects.using(using),
+                {"user_id": user_id},
+                item_count=items,
+                total_quantity=quantity,
+            )
+
+            for day, count in (added or {}).items():
+                increment_or_create(
+                    ShoppingListDailyStats.objects.using(using),
+                    {"user_id": user_id, "day": day},
+                    added=count,
+                )
+
+    @classmethod
+    def get_stats(cls, user_id, days=30):
+        """
+        Totals plus the items added on each of the last ``days`` days and in
+        each week (starting Monday) those days fall in, two indexed queries.
+        A week only partly inside the window counts just those ``days`` and
+        is flagged ``partial``.
+        """
+        using = get_read_db(user_id)
+        totals = cls.objects.using(using).filter(user__id=user_id).values(
+            "item_count", "total_quantity"
+        ).first() or {"item_count": 0, "total_quantity": 0}
+
+        today = timezone.localdate()
+        start = today - timedelta(days=days - 1)
+        added = dict(
+            ShoppingListDailyStats.objects.using(using)
+            .filter(user__id=user_id, day__gte=start)
+            .values_list("day", "added")
+        )
+
+        added_per_day = []
+        added_per_week = {}
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            week = day - timedelta(days=day.weekday())
+            added_per_day.append({"date": day, "added": added.get(day, 0)})
+            bucket = added_per_week.setdefault(
+                week, {"week": week, "added": 0, "days": 0}
+            )
+            bucket["added"] += added.get(day, 0)
+            bucket["days"] += 1
+
+        return {
+            **totals,
+            "added_per_day": added_per_day,
+            "added_per_week": [
+                {**bucket, "partial": bucket["days"] < 7}
+                for bucket in added_per_week.values()
+            ],
+        }
+
+    @classmethod
+    def rebuild(cls, user_ids, using="default"):
+        """
+        Recompute the rollups of ``user_ids`` from their rows, one grouped
+        aggregation per table. The users' totals rows are locked first, so
+        a write racing the rebuild waits and then applies its delta on top.
+        """
+        user_ids = sorted(user_ids)
+
+        with transaction.atomic(using=using):
+            stats = cls.objects.using(using)
+            stats.bulk_create(
+                [cls(user_id=user_id) for user_id in user_ids], ignore_conflicts=True
+            )
+            list(
+                stats.select_for_update()
+                .filter(user_id__in=user_ids)
+                .order_by("user_id")
+                .values_list("user_id", flat=True)
+            )
+
+            totals = {
+                user_id: (item_count, total_quantity)
+                for user_id, item_count, total_quantity in ShoppingList.objects.using(
+                    using
+                )
+                .filter(user_id__in=user_ids)
+                .values("user")
+                .annotate(item_count=Count("id"), total_quantity=Sum("quantity"))
+                .values_list("user", "item_count", "total_quantity")
+            }
+            stats.bulk_update(
+                [
+                    cls(
+                        user_id=user_id,
+                        item_count=totals.get(user_id, (0, 0))[0],
+                        total_quantity=totals.get(user_id, (0, 0))[1],
+                    )
+                    for user_id in user_ids
+                ],
+                ["item_count", "total_quantity"],
+            )
+
+            # items added count deleted and purged ones too
+            added = Counter()
+            for queryset in [
+                ShoppingList.all_objects.using(using),
+                ShoppingListArchive.objects.using(using),
+            ]:
+                rows = (
+                    queryset.filter(user_id__in=user_ids)
+                    .annotate(day=TruncDate("created_at"))
+                    .values("user", "day")
+                    .annotate(added=Count("id"))
+                    .values_list("user", "day", "added")
+                )
+                for user_id, day, count in rows:
+                    added[user_id, day] += count
+
+            daily_stats = ShoppingListDailyStats.objects.using(using)
+            daily_stats.filter(user_id__in=user_ids).delete()
+            daily_stats.bulk_create(
+                ShoppingListDailyStats(user_id=user_id, day=day, added=count)
+                for (user_id, day), count in added.items()
+            )
+
+
+class ShoppingListDailyStats(models.Model):
+    """
+    Items a user added on a day (in settings.TIME_ZONE), see
+    ShoppingListStats
+    """
+
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, db_constraint=False
+    )
+    day = models.DateField()
+    added = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # leads with user, so it also serves get_stats' range scan
+            models.UniqueConstraint(
+                fields=["user", "day"], name="shopping_daily_stats_uniq"
+            ),
+        ]
+
+
+class ShoppingListShard(models.Model):
+    """
+    Which shard (database alias) holds a user's shopping-list rows, on the
+    default database next to auth_user. ``moving`` is set while
+    main.sharding.ShardMove copies them elsewhere.
+    """
+
+    user = models.OneToOneField(
+        get_user_model(), on_delete=models.CASCADE, primary_key=True
+    )
+    alias = models.CharField(max_length=100)
+    moving = models.BooleanField(default=False)
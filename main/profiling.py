@@ -0,0 +1,199 @@
+import cProfile
+import os
+import pstats
+import random
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+PROFILE_TOKEN_SALT = "main.profiling"
+
+# stack frames below this share of the profile are left out of the flame data
+MIN_STACK_SECONDS = 0.00001
+
+
+def make_profile_token(user):
+    """
+    Signed token that has ``user``'s requests profiled while it is valid
+    (PROFILING_TOKEN_MAX_AGE), sent as the X-Profile-Token header or the
+    ``profile`` query parameter. Only staff get one.
+    """
+    if not user.is_staff:
+        raise ValueError("Only staff users can profile requests")
+
+    return signing.dumps({"user_id": user.pk}, salt=PROFILE_TOKEN_SALT)
+
+
+def get_profile_token_user_id(request):
+    token = request.headers.get(PROFILE_TOKEN_HEADER) or request.GET.get("profile")
+    if not token:
+        return None
+
+    try:
+        data = signing.loads(
+            token, salt=PROFILE_TOKEN_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+
+    return data.get("user_id")
+
+
+def can_profile(user_id):
+    """
+    Whether the token's user is still active staff, a token outlives a
+    demotion by up to PROFILING_TOKEN_MAX_AGE
+    """
+    return (
+        get_user_model()
+        .objects.filter(pk=user_id, is_active=True, is_staff=True)
+        .exists()
+    )
+
+
+def get_profile_dir():
+    return settings.PROFILING_DIR
+
+
+def list_profiles(directory=None):
+    """
+    Names (without extension) of the stored profiles, newest first
+    """
+    directory = directory or get_profile_dir()
+    if not os.path.isdir(directory):
+        return []
+
+    return sorted(
+        (name[: -len(".pstats")] for name in os.listdir(directory) if name.endswith(".pstats")),
+        reverse=True,
+    )
+
+
+def prune_profiles(directory, max_files):
+    """
+    Keep only the newest ``max_files`` profiles, the directory is a ring
+    """
+    for name in list_profiles(directory)[max_files:]:
+        for extension in [".pstats", ".collapsed"]:
+            try:
+                os.remove(os.path.join(directory, name + extension))
+            except FileNotFoundError:
+                # another worker pruned it first
+                pass
+
+
+def frame_label(function):
+    filename, line, name = function
+    if filename == "~":
+        # built-ins, e.g. <method 'execute' of 'sqlite3.Cursor' objects>
+        return name.replace(";", ",")
+
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            filename = filename[len(prefix) + 1 :]
+            break
+
+    return f"{name} ({filename}:{line})".replace(";", ",")
+
+
+def collapse_stacks(stats):
+    """
+    Collapsed stack lines ("a;b;c microseconds") for flame graph tools
+    such as flamegraph.pl or speedscope, from a pstats.Stats. cProfile
+    only keeps caller/callee pairs, so a function's time is split across
+    the paths to it in proportion to the time each caller spent in it.
+    """
+    callees = {}
+    roots = []
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(function)
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge[3]))
+
+    lines = Counter()
+
+    def walk(function, stack, share):
+        _, _, self_time, total_time, _ = stats.stats[function]
+        stack = stack + (frame_label(function),)
+
+        microseconds = int(self_time * share * 1000000)
+        if microseconds:
+            lines[";".join(stack)] += microseconds
+
+        for callee, edge_time in callees.get(function, []):
+            callee_total = stats.stats[callee][3]
+            callee_share = share * edge_time / callee_total if callee_total else 0
+            # skip recursion and slivers too thin to show
+            if callee_total * callee_share < MIN_STACK_SECONDS or frame_label(
+                callee
+            ) in stack:
+                continue
+            walk(callee, stack, callee_share)
+
+    for root in roots:
+        walk(root, (), 1.0)
+
+    return [f"{stack} {microseconds}" for stack, microseconds in lines.most_common()]
+
+
+class ProfilingMixin:
+    """
+    Runs dispatch() under cProfile for a sample of requests
+    (PROFILING_SAMPLE_RATE) and for requests carrying a staff user's
+    profile token. Each profile is written to PROFILING_DIR as .pstats
+    and .collapsed (flame graph) files, keeping the newest
+    PROFILING_MAX_FILES, and named in the X-Profile-Id response header.
+    The native async views (SHOPPING_LIST_ASYNC_VIEWS) are not profiled,
+    cProfile would charge them for whatever else the event loop ran.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not settings.PROFILING_ENABLED:
+            return super().dispatch(request, *args, **kwargs)
+
+        token_user_id = get_profile_token_user_id(request)
+        sampled = random.random() < settings.PROFILING_SAMPLE_RATE
+        if token_user_id is None and not sampled:
+            return super().dispatch(request, *args, **kwargs)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        finally:
+            profiler.disable()
+
+        # the token only counts for the user it was issued to, while staff
+        user_id = getattr(self.request.user, "id", None)
+        if sampled or (
+            token_user_id is not None
+            and token_user_id == user_id
+            and can_profile(user_id)
+        ):
+            response["X-Profile-Id"] = self.save_profile(profiler, request, response)
+
+        return response
+
+    def save_profile(self, profiler, request, response):
+        directory = get_profile_dir()
+        os.makedirs(directory, exist_ok=True)
+
+        name = (
+            f"{time.strftime('%Y%m%dT%H%M%S')}-{time.time_ns() % 1000000000:09d}-"
+            f"{type(self).__name__}-{request.method}-{response.status_code}-{os.getpid()}"
+        )
+        path = os.path.join(directory, name)
+
+        profiler.dump_stats(path + ".pstats")
+        with open(path + ".collapsed", "w") as file:
+            for line in collapse_stacks(pstats.Stats(profiler)):
+                file.write(line + "\n")
+
+        prune_profiles(directory, settings.PROFILING_MAX_FILES)
+        return name
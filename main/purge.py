@@ -0,0 +1,118 @@
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import ShoppingList, ShoppingListArchive, ShoppingListPurgeMark
+
+PURGE_MODES = ["archive", "delete"]
+
+
+class ShoppingListPurge:
+    """
+    Removes soft deleted shopping-list rows deleted more than ``retention``
+    (a timedelta) ago, copying them into ShoppingListArchive first unless
+    ``mode`` is "delete".
+
+    Tombstones are walked in id order ``batch_size`` rows at a time. Each
+    batch is locked with SKIP LOCKED, archived and deleted in its own short
+    transaction, with a ``sleep`` second pause before the next one, so a
+    run never holds long locks against live traffic. A committed batch is
+    final, so an interrupted run picks up where it stopped when started
+    again; ``after_id`` skips ahead explicitly. Each user's
+    ShoppingListPurgeMark is moved forward in the same transaction.
+    """
+
+    def __init__(
+        self,
+        retention,
+        mode="archive",
+        batch_size=500,
+        sleep=0.1,
+        after_id=0,
+        max_batches=None,
+        using="default",
+    ):
+        if mode not in PURGE_MODES:
+            raise ValueError(f"Unknown purge mode {mode}")
+
+        self.cutoff = timezone.now() - retention
+        self.mode = mode
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.after_id = after_id
+        self.max_batches = max_batches
+        self.using = using
+        self.summary = {"batches": 0, "purged": 0, "last_id": after_id}
+
+    def get_queryset(self):
+        return ShoppingList.all_objects.using(self.using).filter(
+            is_deleted=True, updated_at__lt=self.cutoff
+        )
+
+    def count(self):
+        """
+        Rows a run would purge, for dry runs
+        """
+        return self.get_queryset().filter(id__gt=self.after_id).count()
+
+    def run(self, progress=None):
+        """
+        Purge batch after batch until none is left or ``max_batches`` is
+        reached, calling ``progress`` with the summary after each one
+        """
+        while self.max_batches is None or self.summary["batches"] < self.max_batches:
+            if self.summary["batches"] and self.sleep:
+                time.sleep(self.sleep)
+
+            purged = self.purge_batch(self.summary["last_id"])
+            if not purged:
+                break
+
+            self.summary["batches"] += 1
+            self.summary["purged"] += len(purged)
+            self.summary["last_id"] = purged[-1]
+
+            if progress is not None:
+                progress(self.summary)
+
+        return self.summary
+
+    def purge_batch(self, after_id):
+        """
+        Archive and delete the next batch of tombstones after ``after_id``,
+        returning their ids. Rows locked by another transaction are left
+        for a later run.
+        """
+        with transaction.atomic(using=self.using):
+            shopping_lists = list(
+                self.get_queryset()
+                .filter(id__gt=after_id)
+                .order_by("id")
+                .select_for_update(skip_locked=True)[: self.batch_size]
+            )
+            if not shopping_lists:
+                return []
+
+            if self.mode == "archive":
+                ShoppingListArchive.objects.using(self.using).bulk_create(
+                    [
+                        ShoppingListArchive.from_shopping_list(shopping_list)
+                        for shopping_list in shopping_lists
+                    ],
+                    ignore_conflicts=True,
+                )
+
+            # lets the changes feed turn away cursors that missed these
+            purged_through = {}
+            for shopping_list in shopping_lists:
+                purged_through[shopping_list.user_id] = max(
+                    shopping_list.updated_at,
+                    purged_through.get(shopping_list.user_id, shopping_list.updated_at),
+                )
+            ShoppingListPurgeMark.advance(purged_through, using=self.using)
+
+            ids = [shopping_list.id for shopping_list in shopping_lists]
+            self.get_queryset().filter(id__in=ids).delete()
+
+        return ids
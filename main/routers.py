@@ -0,0 +1,154 @@
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+# the replica alias the current request reads from, None reads the primary
+current_read_db = ContextVar("current_read_db", default=None)
+
+
+# per-user tables that live on the user's shard, see main.sharding
+SHARDED_MODELS = {
+    "shoppinglist",
+    "shoppinglistarchive",
+    "shoppinglistpurgemark",
+    "shoppingliststats",
+    "shoppinglistdailystats",
+}
+
+
+def get_replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def is_sharded_model(model):
+    return model._meta.app_label == "main" and model._meta.model_name in SHARDED_MODELS
+
+
+PIN_CACHE_ALIAS = "replica_pin"
+
+
+def pin_key(user_id):
+    return f"replica-pin:{user_id}"
+
+
+def get_pin_cache():
+    # its own alias, settings.REPLICA_PIN_CACHE_BACKEND, so pins survive the
+    # shopping-list cache being off; main.checks insists it is shared
+    return caches[PIN_CACHE_ALIAS]
+
+
+def pin_to_primary(user_id):
+    """
+    Send ``user_id``'s reads to the primary for REPLICA_PIN_SECONDS, long
+    enough for the replicas to catch up with the write they just made
+    """
+    get_pin_cache().set(pin_key(user_id), 1, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+async def apin_to_primary(user_id):
+    await get_pin_cache().aset(
+        pin_key(user_id), 1, timeout=settings.REPLICA_PIN_SECONDS
+    )
+
+
+def choose_replica(pinned):
+    replicas = get_replicas()
+    if not replicas or pinned:
+        return None
+    return random.choice(replicas)
+
+
+def read_from_replica(method):
+    """
+    Run a view method's reads on a replica picked per request, unless the
+    user wrote recently and has to see their own writes
+    """
+    if iscoroutinefunction(method):
+
+        @wraps(method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            pinned = get_replicas() and await get_pin_cache().aget(
+                pin_key(request.user.id)
+            )
+            token = current_read_db.set(choose_replica(pinned))
+            try:
+                return await method(self, request, *args, **kwargs)
+            finally:
+                current_read_db.reset(token)
+
+        return async_wrapper
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        pinned = get_replicas() and get_pin_cache().get(pin_key(request.user.id))
+        token = current_read_db.set(choose_replica(pinned))
+        try:
+            return method(self, request, *args, **kwargs)
+        finally:
+            current_read_db.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Reads made under read_from_replica() go to the replica it picked,
+    everything else goes to the primary. Only views that do not write are
+    decorated, their reads could not see their own writes. Replicas hold
+    the same rows, so relations across them are fine.
+    """
+
+    def db_for_read(self, model, **hints):
+        return current_read_db.get()
+
+    def db_for_write(self, model, **hints):
+        # an instance loaded from a replica is saved to the primary
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db in get_replicas():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ShardRouter:
+    """
+    main.sharding places the per-user shopping-list tables explicitly with
+    .using(), this router keeps everything else, auth_user included, on the
+    default database even when it is reached from a row on a shard (an
+    item's ``user``). Every database carries the full schema, the shards
+    just leave the global tables empty.
+    """
+
+    def get_shards(self):
+        return getattr(settings, "SHOPPING_LIST_SHARDS", None) or []
+
+    def route(self, model, hints):
+        instance = hints.get("instance")
+        if instance is None or is_sharded_model(model):
+            return None
+
+        if instance._state.db in self.get_shards():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # rows on a shard point at users on the default database
+        if is_sharded_model(type(obj1)) or is_sharded_model(type(obj2)):
+            return True
+        return None
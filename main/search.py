@@ -0,0 +1,206 @@
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+# a note match counts for half a name match when ranking
+NOTE_WEIGHT = 0.5
+
+WORD_RE = re.compile(r"[^\W_]+")
+
+
+def trigrams(text):
+    """
+    Trigrams the way pg_trgm builds them: lower cased words, each padded
+    with two leading spaces and one trailing space
+    """
+    result = set()
+    for word in WORD_RE.findall((text or "").lower()):
+        padded = f"  {word} "
+        result.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(left, right):
+    """
+    pg_trgm similarity(): shared trigrams over the union of both sets
+    """
+    if not left or not right:
+        return 0.0
+
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+
+class BaseSearchBackend:
+    """
+    A search engine narrows a user's live ShoppingList queryset to the rows
+    whose name or note contains the search string (case-insensitive) and
+    orders them by relevance, best match first. ``revision`` is the user's
+    ShoppingList.get_revision() when the caller already has it.
+    """
+
+    def search(self, queryset, user_id, search, revision=None):
+        raise NotImplementedError
+
+
+class PostgresTrigramSearchBackend(BaseSearchBackend):
+    """
+    ILIKE on UPPER(name) and UPPER(note), both served by the partial
+    gin_trgm_ops indexes, ranked with pg_trgm similarity()
+    """
+
+    def search(self, queryset, user_id, search, revision=None):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        from main.models import ShoppingList
+
+        return (
+            queryset.filter(ShoppingList.text_match(search))
+            .annotate(
+                rank=TrigramSimilarity("name", search)
+                + TrigramSimilarity(Coalesce("note", Value("")), search) * NOTE_WEIGHT
+            )
+            .order_by("-rank", "-id")
+        )
+
+
+class UserNgramIndex:
+    """
+    Inverted trigram index over one user's live rows
+    """
+
+    def __init__(self, rows, fingerprint):
+        self.fingerprint = fingerprint
+        self.documents = {}
+        self.postings = defaultdict(set)
+
+        for id, name, note in rows:
+            name, note = (name or "").lower(), (note or "").lower()
+            self.documents[id] = (name, note, trigrams(name), trigrams(note))
+
+            for text in (name, note):
+                for i in range(len(text) - 2):
+                    self.postings[text[i : i + 3]].add(id)
+
+    def search(self, search):
+        """
+        Return (id, rank) pairs for every document containing ``search``
+        """
+        search = search.lower()
+        grams = {search[i : i + 3] for i in range(len(search) - 2)}
+
+        if grams:
+            # any text containing the search string contains all its trigrams
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings)
+        else:
+            candidates = self.documents.keys()
+
+        search_trigrams = trigrams(search)
+        results = []
+        for id in candidates:
+            name, note, name_trigrams, note_trigrams = self.documents[id]
+            if search in name or search in note:
+                rank = (
+                    similarity(name_trigrams, search_trigrams)
+                    + similarity(note_trigrams, search_trigrams) * NOTE_WEIGHT
+                )
+                results.append((id, rank))
+
+        return results
+
+
+class NgramSearchBackend(BaseSearchBackend):
+    """
+    Portable engine keeping an in-process trigram index per user, so
+    databases without pg_trgm (SQLite in tests) get the same matches and
+    ranking. Indexes are rebuilt when the user's row count or latest
+    updated_at changes and the least recently used ones are dropped.
+    """
+
+    max_users = 256
+
+    def __init__(self):
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_fingerprint(self, user_id, revision=None):
+        from main.models import ShoppingList
+
+        if revision is None:
+            revision = ShoppingList.get_revision(user_id)
+
+        return (revision["count"], revision["last_modified"])
+
+    def get_index(self, user_id, revision=None):
+        from main.models import ShoppingList
+
+        fingerprint = self.get_fingerprint(user_id, revision)
+
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.fingerprint == fingerprint:
+                self._indexes.move_to_end(user_id)
+                return index
+
+        rows = ShoppingList.get_shopping_list(user_id).values_list("id", "name", "note")
+        index = UserNgramIndex(rows.iterator(), fingerprint)
+
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+
+        return index
+
+    def search(self, queryset, user_id, search, revision=None):
+        results = self.get_index(user_id, revision).search(search)
+        if not results:
+            return queryset.none()
+
+        ranks = defaultdict(list)
+        for id, rank in results:
+            ranks[rank].append(id)
+
+        return (
+            queryset.filter(id__in=[id for id, _ in results])
+            .annotate(
+                rank=Case(
+                    *[When(id__in=ids, then=Value(rank)) for rank, ids in ranks.items()],
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                )
+            )
+            .order_by("-rank", "-id")
+        )
+
+
+_backends = {}
+
+
+def get_search_backend():
+    """
+    The engine named by settings.SHOPPING_LIST_SEARCH_BACKEND, otherwise
+    the trigram engine on PostgreSQL and the n-gram engine elsewhere
+    """
+    from main.models import ShoppingList
+
+    path = getattr(settings, "SHOPPING_LIST_SEARCH_BACKEND", None)
+    if not path:
+        vendor = connections[router.db_for_read(ShoppingList)].vendor
+        if vendor == "postgresql":
+            path = "main.search.PostgresTrigramSearchBackend"
+        else:
+            path = "main.search.NgramSearchBackend"
+
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+
+    return _backends[path]
@@ -1,5 +1,8 @@
-from rest_framework import serializers
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
+from main.helpers import decode_sync_cursor
 from main.models import ShoppingList
 
 
@@ -30,7 +33,303 @@ class ShoppingListSerializer(serializers.Serializer):
     note = serializers.CharField(allow_blank=True, allow_null=True, required=False)
 
 
-class ShoppingListModelSerializer(serializers.ModelSerializer):
+class ShoppingListPatchSerializer(ShoppingListSerializer):
+    quantity_delta = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if "quantity" in attrs and "quantity_delta" in attrs:
+            raise serializers.ValidationError(
+                "Send either quantity or quantity_delta, not both"
+            )
+
+        return attrs
+
+
+class ShoppingListBatchUpdateSerializer(ShoppingListSerializer):
+    id = serializers.IntegerField()
+
+    def validate(self, attrs):
+        # id stays mandatory when validating with partial=True
+        if "id" not in attrs:
+            raise serializers.ValidationError({"id": "This field is required."})
+
+        return attrs
+
+
+class ShoppingListBatchSerializer(serializers.Serializer):
+    create = serializers.ListField(
+        child=serializers.DictField(), required=False, max_length=500
+    )
+    update = serializers.ListField(
+        child=serializers.DictField(), required=False, max_length=500
+    )
+    delete = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=500
+    )
+
+
+class DynamicFieldsMixin:
+    """
+    Takes an extra ``fields`` argument naming the subset of declared fields
+    to output, in declared order. None keeps them all.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class ShoppingListModelSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ShoppingList
         fields = ["id", "name", "quantity", "note", "created_at", "updated_at"]
+
+
+class ValuesListSerializer:
+    """
+    Read-only fast path for a ModelSerializer's list output.
+
+    Rows come from .values_list() for exactly the declared fields, so no
+    model instances are built, and each column is converted in one pass
+    instead of running the DRF field machinery per row and field. ``data``
+    equals ``serializer_class(rows, many=True).data``; the serializer class
+    must take DynamicFieldsMixin's ``fields`` argument.
+    """
+
+    serializer_class = None
+
+    def __init__(self, instance, fields=None):
+        self.instance = instance
+        self.field_names = fields
+
+    @classmethod
+    def get_fields(cls, fields=None):
+        return [
+            field
+            for field in cls.serializer_class(fields=fields).fields.values()
+            if not field.write_only
+        ]
+
+    @classmethod
+    def get_rows(cls, queryset, fields=None):
+        """
+        Named rows for the declared fields (or the ``fields`` subset), plus
+        whatever the queryset is ordered by so cursor pagination can read
+        its position off a row
+        """
+        sources = [field.source for field in cls.get_fields(fields)]
+        ordering = [
+            term.lstrip("-") for term in queryset.query.order_by if isinstance(term, str)
+        ]
+
+        return queryset.values_list(
+            *sources, *[name for name in ordering if name not in sources], named=True
+        )
+
+    @property
+    def data(self):
+        fields = self.get_fields(self.field_names)
+        rows = list(self.instance)
+        if not rows:
+            return []
+
+        columns = [
+            self.to_representation_column(field, column)
+            for field, column in zip(fields, zip(*rows))
+        ]
+        names = [field.field_name for field in fields]
+
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+    def to_representation_column(self, field, column):
+        if isinstance(field, serializers.DateTimeField):
+            return self.to_representation_datetimes(field, column)
+        if type(field) is serializers.IntegerField:
+            return [None if value is None else int(value) for value in column]
+        if type(field) is serializers.CharField:
+            return [None if value is None else str(value) for value in column]
+
+        return [
+            None if value is None else field.to_representation(value)
+            for value in column
+        ]
+
+    def to_representation_datetimes(self, field, column):
+        """
+        DateTimeField.to_representation() over a whole column, the field's
+        format and timezone looked up once
+        """
+        output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+        if hasattr(field, "timezone"):
+            field_timezone = field.timezone
+        else:
+            field_timezone = field.default_timezone()
+
+        if (
+            output_format is None
+            or output_format.lower() != ISO_8601
+            or field_timezone is None
+        ):
+            return [
+                None if value is None else field.to_representation(value)
+                for value in column
+            ]
+
+        result = []
+        for value in column:
+            if not value:
+                result.append(None)
+            elif isinstance(value, str) or timezone.is_naive(value):
+                result.append(field.to_representation(value))
+            else:
+                value = value.astimezone(field_timezone).isoformat()
+                if value.endswith("+00:00"):
+                    value = value[:-6] + "Z"
+                result.append(value)
+
+        return result
+
+
+class ShoppingListValuesSerializer(ValuesListSerializer):
+    serializer_class = ShoppingListModelSerializer
+
+
+class ShoppingListChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShoppingList
+        fields = [
+            "id",
+            "name",
+            "quantity",
+            "note",
+            "created_at",
+            "updated_at",
+            "is_deleted",
+        ]
+
+
+class ShoppingListChangesQuerySerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False, allow_blank=True)
+    limit = serializers.IntegerField(
+        required=False, default=100, min_value=1, max_value=1000
+    )
+
+    def validate_cursor(self, value):
+        if not value:
+            return None
+
+        try:
+            return decode_sync_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor")
+
+
+class ShoppingListStatsQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(
+        required=False, default=30, min_value=1, max_value=366
+    )
+
+
+class ShoppingListFilterSerializer(serializers.Serializer):
+    """
+    Validates the shopping list GET query parameters
+    """
+
+    search = serializers.CharField(required=False, allow_blank=True)
+    start_date = serializers.DateField(
+        required=False,
+        input_formats=["%Y-%m-%d"],
+        error_messages={
+            "invalid": "Invalid date format. Date format should be YYYY-MM-DD"
+        },
+    )
+    end_date = serializers.DateField(
+        required=False,
+        input_formats=["%Y-%m-%d"],
+        error_messages={
+            "invalid": "Invalid date format. Date format should be YYYY-MM-DD"
+        },
+    )
+    min_quantity = serializers.IntegerField(required=False)
+    max_quantity = serializers.IntegerField(required=False)
+    sort_by = serializers.ChoiceField(
+        choices=["asc", "desc"],
+        required=False,
+        allow_blank=True,
+        error_messages={"invalid_choice": "Invalid sort option"},
+    )
+    ordering = serializers.CharField(required=False, allow_blank=True)
+    fields = serializers.CharField(required=False, allow_blank=True)
+    pagination = serializers.ChoiceField(
+        choices=["page", "cursor"],
+        required=False,
+        allow_blank=True,
+        error_messages={"invalid_choice": "Invalid pagination option"},
+    )
+
+    def validate_ordering(self, value):
+        ordering = [term.strip() for term in value.split(",") if term.strip()]
+
+        for term in ordering:
+            if term.lstrip("-") not in ShoppingList.ORDERING_FIELDS:
+                raise serializers.ValidationError(
+                    "Invalid ordering option. Allowed fields are "
+                    + ", ".join(ShoppingList.ORDERING_FIELDS)
+                )
+
+        return ordering
+
+    def validate_fields(self, value):
+        allowed_fields = ShoppingListModelSerializer.Meta.fields
+        fields = [field.strip() for field in value.split(",") if field.strip()]
+
+        for field in fields:
+            if field not in allowed_fields:
+                raise serializers.ValidationError(
+                    "Invalid fields option. Allowed fields are "
+                    + ", ".join(allowed_fields)
+                )
+
+        return fields or None
+
+    def validate(self, attrs):
+        if attrs.get("start_date") and not attrs.get("end_date"):
+            raise serializers.ValidationError("End date is required")
+
+        if attrs.get("end_date") and not attrs.get("start_date"):
+            raise serializers.ValidationError("Start date is required")
+
+        min_quantity = attrs.get("min_quantity")
+        max_quantity = attrs.get("max_quantity")
+        if (
+            min_quantity is not None
+            and max_quantity is not None
+            and min_quantity > max_quantity
+        ):
+            raise serializers.ValidationError(
+                "Minimum quantity cannot be greater than maximum quantity"
+            )
+
+        return attrs
+
+
+class ShoppingListExportSerializer(ShoppingListFilterSerializer):
+    # not "format", DRF reserves that one for picking a renderer
+    export_format = serializers.ChoiceField(
+        choices=["ndjson", "csv"],
+        required=False,
+        default="ndjson",
+        error_messages={"invalid_choice": "Invalid export format"},
+    )
+
+
+class ShoppingListImportSerializer(serializers.Serializer):
+    import_format = serializers.ChoiceField(
+        choices=["ndjson", "csv"],
+        required=False,
+        error_messages={"invalid_choice": "Invalid import format"},
+    )
+    merge = serializers.BooleanField(required=False, default=False)
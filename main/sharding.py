@@ -0,0 +1,445 @@
+import bisect
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from main.routers import current_read_db
+
+# shard N hands out ShoppingList ids from N << SHARD_ID_BITS, so rows keep
+# their ids when a user moves and never collide with the target's own
+SHARD_ID_BITS = 48
+
+# rows changed this long before a move started are copied again at the
+# switch, covering clock skew between the workers and the mover
+MOVE_CLOCK_MARGIN = timedelta(minutes=1)
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Your shopping list is being moved, try again in a few seconds"
+    default_code = "shard_moving"
+
+
+def get_shards():
+    """
+    Database aliases holding the shopping-list rows, just the default one
+    unless SHOPPING_LIST_SHARDS is set
+    """
+    return getattr(settings, "SHOPPING_LIST_SHARDS", None) or [DEFAULT_DB_ALIAS]
+
+
+class HashRing:
+    """
+    Consistent hash of user ids over shard aliases. Each alias owns
+    ``points`` spots on the ring, so adding a shard takes about 1/N of the
+    users from the others and moves nobody between the old ones.
+    """
+
+    def __init__(self, aliases, points=64):
+        self.ring = sorted(
+            (self.hash(f"{alias}:{point}"), alias)
+            for alias in aliases
+            for point in range(points)
+        )
+        self.keys = [key for key, _ in self.ring]
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+    def get(self, user_id):
+        index = bisect.bisect(self.keys, self.hash(str(user_id))) % len(self.ring)
+        return self.ring[index][1]
+
+
+@lru_cache(maxsize=8)
+def get_ring(aliases):
+    return HashRing(aliases)
+
+
+def get_placement(user_id):
+    """
+    The shard the ring puts ``user_id`` on with the current shard list
+    """
+    return get_ring(tuple(get_shards())).get(user_id)
+
+
+class ShardMap:
+    """
+    Per-process TTL and LRU bounded copy of the ShoppingListShard table,
+    user id to (alias, moving). A worker may act on an entry up to
+    SHOPPING_LIST_SHARD_MAP_TTL seconds old, ShardMove waits that long
+    between its steps.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or getattr(settings, "SHOPPING_LIST_SHARD_MAP_MAX_SIZE", 10000)
+        self.ttl = ttl if ttl is not None else getattr(settings, "SHOPPING_LIST_SHARD_MAP_TTL", 5)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+
+            self._entries.move_to_end(user_id)
+            return value
+
+    def set(self, user_id, value):
+        with self._lock:
+            self._entries[user_id] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self, user_id):
+        """
+        The user's map row, created on the first shard for users from
+        before sharding, whose rows are still there
+        """
+        from main.models import ShoppingListShard
+
+        shard, _ = ShoppingListShard.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+            user_id=user_id, defaults={"alias": get_shards()[0]}
+        )
+        value = (shard.alias, shard.moving)
+        self.set(user_id, value)
+        return value
+
+
+shard_map = ShardMap()
+
+
+def is_sharded():
+    return bool(getattr(settings, "SHOPPING_LIST_SHARDS", None))
+
+
+def check_shard(value, write):
+    alias, moving = value
+    if write and moving:
+        raise ShardMoving()
+    return alias
+
+
+def get_shard(user_id, write=False):
+    """
+    Alias of the shard holding ``user_id``'s rows. Writes raise
+    ShardMoving while ShardMove copies the user elsewhere.
+    """
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+
+    value = shard_map.get(user_id) or shard_map.load(user_id)
+    return check_shard(value, write)
+
+
+async def aget_shard(user_id, write=False):
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+
+    value = shard_map.get(user_id) or await sync_to_async(shard_map.load)(user_id)
+    return check_shard(value, write)
+
+
+def get_read_db(user_id):
+    """
+    Where to read ``user_id``'s rows: their shard, or the replica picked by
+    read_from_replica() when the rows live on the default database
+    """
+    alias = get_shard(user_id)
+    if alias == DEFAULT_DB_ALIAS:
+        return current_read_db.get() or alias
+    return alias
+
+
+async def aget_read_db(user_id):
+    alias = await aget_shard(user_id)
+    if alias == DEFAULT_DB_ALIAS:
+        return current_read_db.get() or alias
+    return alias
+
+
+def assign_shard(user_id):
+    """
+    Place a new account on the shard the ring picks, run in the sign-up
+    transaction
+    """
+    from main.models import ShoppingListShard
+
+    if is_sharded():
+        ShoppingListShard.objects.using(DEFAULT_DB_ALIAS).create(
+            user_id=user_id, alias=get_placement(user_id)
+        )
+
+
+def delete_user_rows(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_delete receiver for the user model. The shopping-list foreign
+    keys are not database constraints, and the ORM's cascade only reaches
+    the rows on the default database, so the user's rows on the shards go
+    once the delete commits. Every shard is swept, a move in flight may
+    have copied some of them already.
+    """
+    from main.models import (
+        ShoppingList,
+        ShoppingListArchive,
+        ShoppingListDailyStats,
+        ShoppingListPurgeMark,
+        ShoppingListStats,
+    )
+
+    user_id = instance.pk
+    shard_map.invalidate(user_id)
+
+    def delete():
+        for alias in get_shards():
+            if alias == DEFAULT_DB_ALIAS:
+                continue
+
+            with transaction.atomic(using=alias):
+                for model in [
+                    ShoppingList,
+                    ShoppingListArchive,
+                    ShoppingListStats,
+                    ShoppingListDailyStats,
+                    ShoppingListPurgeMark,
+                ]:
+                    model._base_manager.using(alias).filter(user_id=user_id).delete()
+
+    transaction.on_commit(delete, using=using)
+
+
+def reserve_id_range(alias):
+    """
+    Start ``alias``'s ShoppingList id sequence at its shard's range, never
+    moving it back. Run after migrating each shard. PostgreSQL sequences
+    ignore the ids moved in from other shards; SQLite always continues
+    after the largest id in the table, so on local SQLite shards a move
+    drags the target's new ids into the source's range.
+    """
+    from main.models import ShoppingList
+
+    start = get_shards().index(alias) << SHARD_ID_BITS
+    if not start:
+        return
+
+    connection = connections[alias]
+    table = ShoppingList._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                "GREATEST(%s, nextval(pg_get_serial_sequence(%s, 'id'))))",
+                [table, start, table],
+            )
+        elif connection.vendor == "sqlite":
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, table],
+            )
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s",
+                [start, table],
+            )
+        else:
+            raise NotImplementedError(
+                f"Cannot reserve shard id ranges on {connection.vendor}"
+            )
+
+
+def reserve_id_ranges(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate receiver
+    """
+    if is_sharded() and using in get_shards():
+        reserve_id_range(using)
+
+
+class ShardMove:
+    """
+    Move one user's shopping-list rows to the ``target`` shard while the
+    service runs:
+
+    1. copy the rows from one consistent read of the source, the user
+       keeps reading and writing there
+    2. flag the user as moving and wait out the shard map TTL, from then
+       on their writes get a 503 and the client retries
+    3. copy what changed since step 1, drop rows purged meanwhile and
+       replace the stats, then point the map at the target
+    4. wait out the TTL again so no worker still reads the source, and
+       delete the user's rows there
+
+    Reads never stop; writes pause from step 2 until the switch.
+    """
+
+    def __init__(self, user_id, target, batch_size=500, wait=None):
+        if target not in get_shards():
+            raise ValueError(f"{target} is not one of the shards {get_shards()}")
+
+        self.user_id = user_id
+        self.target = target
+        self.batch_size = batch_size
+        self.wait = wait if wait is not None else shard_map.ttl + 1
+
+    def get_models(self):
+        from main.models import (
+            ShoppingList,
+            ShoppingListArchive,
+            ShoppingListDailyStats,
+            ShoppingListPurgeMark,
+            ShoppingListStats,
+        )
+
+        return (
+            ShoppingList,
+            ShoppingListArchive,
+            [ShoppingListStats, ShoppingListDailyStats, ShoppingListPurgeMark],
+        )
+
+    def set_map(self, **values):
+        from main.models import ShoppingListShard
+
+        ShoppingListShard.objects.using(DEFAULT_DB_ALIAS).filter(
+            user_id=self.user_id
+        ).update(**values)
+        shard_map.invalidate(self.user_id)
+
+    def copy(self, queryset, model, on_conflict=None):
+        """
+        INSERT the rows of ``queryset``, read in one statement, on the
+        target as they are. bulk_create() would stamp the auto_now columns
+        with the current time. Returns how many rows were copied.
+        """
+        ShoppingList = self.get_models()[0]
+        # the other auto ids are local, only ShoppingList ids are reserved
+        fields = [
+            field
+            for field in model._meta.concrete_fields
+            if field is not model._meta.auto_field or model is ShoppingList
+        ]
+        target = model._base_manager.using(self.target)
+        # SQLite caps the parameters per statement, PostgreSQL takes them all
+        batch_size = max(
+            connections[self.target].ops.bulk_batch_size(fields, [None] * self.batch_size), 1
+        )
+
+        batch, count = [], 0
+        for row in queryset.iterator(chunk_size=self.batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                target._insert(batch, fields, raw=True, on_conflict=on_conflict)
+                count += len(batch)
+                batch = []
+
+        if batch:
+            target._insert(batch, fields, raw=True, on_conflict=on_conflict)
+            count += len(batch)
+
+        return count
+
+    def delete_ids(self, model, ids):
+        ids = sorted(ids)
+        for start in range(0, len(ids), self.batch_size):
+            model._base_manager.using(self.target).filter(
+                id__in=ids[start : start + self.batch_size]
+            ).delete()
+
+    def run(self):
+        shard_map.invalidate(self.user_id)
+        source = get_shard(self.user_id)
+        summary = {"user_id": self.user_id, "source": source, "target": self.target}
+        if source == self.target:
+            summary["copied"] = 0
+            return summary
+
+        ShoppingList, ShoppingListArchive, whole_models = self.get_models()
+        user_rows = {"user_id": self.user_id}
+        started_at = timezone.now() - MOVE_CLOCK_MARGIN
+
+        # 1. leftovers of an aborted move go first, then one snapshot
+        with transaction.atomic(using=self.target):
+            for model in [ShoppingList, ShoppingListArchive, *whole_models]:
+                model._base_manager.using(self.target).filter(**user_rows).delete()
+
+        with transaction.atomic(using=source):
+            self.copy(
+                ShoppingList.all_objects.using(source).filter(**user_rows).order_by("id"),
+                ShoppingList,
+            )
+            self.copy(
+                ShoppingListArchive.objects.using(source).filter(**user_rows),
+                ShoppingListArchive,
+            )
+
+        # 2. stop the user's writes everywhere
+        self.set_map(moving=True)
+        try:
+            time.sleep(self.wait)
+
+            # 3. the source is quiet now, catch the target up and switch
+            with transaction.atomic(using=self.target), transaction.atomic(using=source):
+                rows = ShoppingList.all_objects.using(source).filter(**user_rows)
+                changed = rows.filter(updated_at__gte=started_at)
+                changed_ids = set(changed.values_list("id", flat=True))
+                source_ids = set(rows.values_list("id", flat=True))
+                target_ids = set(
+                    ShoppingList.all_objects.using(self.target)
+                    .filter(**user_rows)
+                    .values_list("id", flat=True)
+                )
+
+                self.delete_ids(ShoppingList, (target_ids - source_ids) | changed_ids)
+                self.copy(changed.order_by("id"), ShoppingList)
+                self.copy(
+                    ShoppingListArchive.objects.using(source).filter(
+                        **user_rows, archived_at__gte=started_at
+                    ),
+                    ShoppingListArchive,
+                    on_conflict=OnConflict.IGNORE,
+                )
+
+                for model in whole_models:
+                    model._base_manager.using(self.target).filter(**user_rows).delete()
+                    self.copy(model._base_manager.using(source).filter(**user_rows), model)
+
+            self.set_map(alias=self.target, moving=False)
+        except BaseException:
+            self.set_map(moving=False)
+            raise
+
+        # 4. nobody reads the source copy after another TTL
+        time.sleep(self.wait)
+        with transaction.atomic(using=source):
+            for model in [ShoppingList, ShoppingListArchive, *whole_models]:
+                model._base_manager.using(source).filter(**user_rows).delete()
+
+        summary["copied"] = len(source_ids)
+        return summary
@@ -1,3 +1,2243 @@
-from django.test import TestCase
+import base64
+import io
+import os
+import tempfile
+import tracemalloc
+import warnings
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import IntegrityError, connection, connections, router
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from main.authentication import ActiveUserCache, CachedJWTAuthentication, active_user_cache
+from main.authentication_backend import EmailAndUsernameBackend
+from main.cache import shopping_list_cache
+from main.checks import check_replica_pin_cache
+from main.helpers import (
+    USER_EMAIL_INDEX,
+    encode_sync_cursor,
+    get_duplicate_account_error,
+)
+from main.metrics import MetricsRegistry, get_registry, render_metrics
+from main.models import (
+    ShoppingList,
+    ShoppingListArchive,
+    ShoppingListDailyStats,
+    ShoppingListPurgeMark,
+    ShoppingListShard,
+    ShoppingListStats,
+    compile_update,
+    supports_update_returning,
+)
+from main.profiling import list_profiles, make_profile_token
+from main.purge import ShoppingListPurge
+from main.renderers import FastJSONRenderer
+from main.routers import PIN_CACHE_ALIAS, get_pin_cache, pin_key
+from main.search import NgramSearchBackend, PostgresTrigramSearchBackend
+from main.serializer import ShoppingListModelSerializer, ShoppingListValuesSerializer
+from main.sharding import SHARD_ID_BITS, HashRing, reserve_id_range, shard_map
+from main.urls import get_urlpatterns
+
+
+def add_test_databases(*aliases):
+    """
+    Register SQLite databases standing in for replicas and shards, at
+    import time so the test runner creates them with the others
+    """
+    new = {
+        alias: {"ENGINE": "django.db.backends.sqlite3"}
+        for alias in aliases
+        if alias not in connections.settings
+    }
+    configured = connections.configure_settings({**connections.settings, **new})
+    for alias in new:
+        connections.settings[alias] = configured[alias]
+
+
+add_test_databases("replica1", "shard1", "shard2")
+
+
+def get_client(user, **headers):
+    """
+    APIClient sending ``user``'s access token, and any other ``headers``,
+    with every request
+    """
+    client = APIClient()
+    client.credentials(
+        HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}",
+        **headers,
+    )
+    return client
+
+
+class AuthenticatedClientMixin:
+    """
+    ``self.user``, created once per test case class from ``username``, and
+    ``self.client``, an APIClient sending their access token
+    """
+
+    username = "user"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create(
+            username=cls.username, email=f"{cls.username}@example.com"
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client = get_client(self.user)
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=False)
+class ShoppingListPaginationTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Walking a list's pages, by cursor or by number, returns every matching
+    item exactly once, whatever the query orders and selects.
+    """
+
+    username = "pages"
+
+    def setUp(self):
+        super().setUp()
+        ShoppingList.bulk_create_shopping_list(
+            self.user.id,
+            [
+                {"name": f"item {index:02}", "quantity": index % 4}
+                for index in range(25)
+            ],
+        )
+
+    def walk(self, query):
+        """
+        Items of every page, following the next links from the first one
+        """
+        items = []
+        url = f"/api/shopping-list/?pagination=cursor&page_size=4&{query}"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+
+            results = response.json()["results"]
+            self.assertLessEqual(len(results["data"]), 4)
+            items += results["data"]
+            url = response.json()["next"]
+
+        return items
+
+    def test_cursor_with_fields(self):
+        items = self.walk("fields=name")
+
+        self.assertEqual(
+            [item["name"] for item in items], [f"item {index:02}" for index in range(25)]
+        )
+        self.assertEqual({key for item in items for key in item}, {"name"})
+
+    def test_cursor_pages_match_one_page(self):
+        for query in [
+            "sort_by=asc",
+            "sort_by=desc",
+            "ordering=-quantity,name",
+            "ordering=quantity",
+            "search=item 1",
+        ]:
+            with self.subTest(query=query):
+                response = self.client.get(f"/api/shopping-list/?page_size=100&{query}")
+                expected = response.json()["results"]["data"]
+
+                items = self.walk(query)
+                self.assertEqual(items, expected)
+                self.assertEqual(len({item["id"] for item in items}), len(items))
+
+    def test_page_numbers(self):
+        # without a sort the pages still follow one total order, by id
+        items = []
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", UnorderedObjectListWarning)
+            for page in range(1, 8):
+                response = self.client.get(
+                    "/api/shopping-list/", {"page": page, "page_size": 4}
+                )
+                self.assertEqual(response.status_code, 200, response.content)
+                items += response.json()["results"]["data"]
+                if response.json()["next"] is None:
+                    break
+
+        ids = [item["id"] for item in items]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 25)
+
+    def test_write_between_pages(self):
+        url = "/api/shopping-list/?pagination=cursor&page_size=4&sort_by=asc"
+        first = self.client.get(url).json()
+        ShoppingList.create_shopping_list(user_id=self.user.id, name="new", quantity=1)
+
+        ids = [item["id"] for item in first["results"]["data"]]
+        next_url = first["next"]
+        while next_url:
+            page = self.client.get(next_url).json()
+            ids += [item["id"] for item in page["results"]["data"]]
+            next_url = page["next"]
+
+        # later pages pick up after the last id seen, nothing is repeated
+        self.assertEqual(len(ids), 26)
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_invalid_cursor(self):
+        for cursor in ["not-a-cursor", base64.b64encode(b"p=abc").decode()]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    "/api/shopping-list/",
+                    {"pagination": "cursor", "sort_by": "asc", "cursor": cursor},
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"cursor": "Invalid cursor"})
+
+
+class ShoppingListQueryPlanTestCase(TestCase):
+    """
+    Seeds a few thousand rows across many users and checks that every
+    ShoppingList query shape is answered from an index, not a table scan.
+    """
+
+    users_count = 40
+    items_per_user = 250
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        users = User.objects.bulk_create(
+            User(username=f"user{index}", email=f"user{index}@example.com")
+            for index in range(cls.users_count)
+        )
+
+        now = timezone.now()
+        items = []
+        for user in users:
+            for index in range(cls.items_per_user):
+                items.append(
+                    ShoppingList(
+                        user=user,
+                        name=f"item {index}",
+                        quantity=index % 7 + 1,
+                        note="note" if index % 3 else None,
+                        is_deleted=index % 10 == 0,
+                    )
+                )
+        ShoppingList.objects.bulk_create(items, batch_size=1000)
+
+        # spread created_at over the last year so date ranges are selective
+        items = list(ShoppingList.all_objects.only("id"))
+        for offset, item in enumerate(items):
+            item.created_at = now - timedelta(hours=offset % (24 * 365))
+        ShoppingList.all_objects.bulk_update(items, ["created_at"], batch_size=1000)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        cls.user = users[len(users) // 2]
+        cls.item = ShoppingList.get_shopping_list(cls.user.id).first()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
+            cursor.execute(f"EXPLAIN {sql}")
+            return "\n".join(str(row[0]) for row in cursor.fetchall())
+
+    def assertUsesIndex(self, run_query):
+        with CaptureQueriesContext(connection) as context:
+            run_query()
+
+        self.assertTrue(context.captured_queries)
+        table = ShoppingList._meta.db_table
+        # the implicit user_id FK index would also avoid a scan, so insist on
+        # the purpose-built indexes (or a primary key lookup)
+        access_paths = [index.name for index in ShoppingList._meta.indexes]
+        access_paths += [constraint.name for constraint in ShoppingList._meta.constraints]
+        access_paths.append("PRIMARY KEY" if connection.vendor == "sqlite" else "_pkey")
+        for query in context.captured_queries:
+            plan = self.explain(query["sql"])
+
+            if connection.vendor == "sqlite":
+                self.assertNotIn(f"SCAN {table}", plan, plan)
+                self.assertIn(f"SEARCH {table} USING", plan, plan)
+            else:
+                self.assertNotIn(f"Seq Scan on {table}", plan, plan)
+                self.assertIn("Index", plan, plan)
+
+            self.assertTrue(any(path in plan for path in access_paths), plan)
+
+    def test_get_shopping_list_uses_index(self):
+        self.assertUsesIndex(
+            lambda: list(ShoppingList.get_shopping_list(self.user.id)[:10])
+        )
+
+    def test_get_shopping_list_by_id_uses_index(self):
+        self.assertUsesIndex(
+            lambda: ShoppingList.get_shopping_list_by_id(self.user.id, self.item.id)
+        )
+
+    def test_get_shopping_list_by_name_uses_index(self):
+        self.assertUsesIndex(
+            lambda: ShoppingList.get_shopping_list_by_name(self.user.id, "item 42")
+        )
+
+    def test_filter_by_date_uses_index(self):
+        end_date = timezone.now()
+        start_date = end_date - timedelta(days=7)
+
+        self.assertUsesIndex(
+            lambda: list(
+                ShoppingList.filter_by_date(start_date, end_date, self.user.id)[:10]
+            )
+        )
+
+    def test_sort_data_uses_index(self):
+        for sort_by in ["asc", "desc"]:
+            with self.subTest(sort_by=sort_by):
+                self.assertUsesIndex(
+                    lambda: list(
+                        ShoppingList.sort_data(
+                            ShoppingList.get_shopping_list(self.user.id), sort_by
+                        )[:10]
+                    )
+                )
+
+    def test_purge_batch_uses_index(self):
+        purge = ShoppingListPurge(timedelta(0))
+        self.assertUsesIndex(
+            lambda: list(
+                purge.get_queryset().filter(id__gt=0).order_by("id")[: purge.batch_size]
+            )
+        )
+
+
+class ShoppingListSearchTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    The portable n-gram engine finds what a substring search finds, ranks
+    like pg_trgm and follows the user's writes.
+    """
+
+    username = "search"
+
+    def setUp(self):
+        super().setUp()
+        ShoppingList.bulk_create_shopping_list(
+            self.user.id,
+            [
+                {"name": "milk", "quantity": 1},
+                {"name": "almond milk", "quantity": 1},
+                {"name": "bread", "quantity": 1, "note": "buy milk on the way"},
+                {"name": "milkshake", "quantity": 1},
+                {"name": "eggs", "quantity": 1},
+            ],
+        )
+        self.backend = NgramSearchBackend()
+
+    def search(self, search, backend=None, **kwargs):
+        queryset = (backend or self.backend).search(
+            ShoppingList.get_shopping_list(self.user.id), self.user.id, search, **kwargs
+        )
+        return [item.name for item in queryset]
+
+    def test_ranking(self):
+        # whole name, name containing it, longer word, note only
+        self.assertEqual(
+            self.search("milk"), ["milk", "almond milk", "milkshake", "bread"]
+        )
+        self.assertEqual(self.search("MILK"), self.search("milk"))
+        self.assertEqual(self.search("cheese"), [])
+
+    def test_short_search(self):
+        # fewer than three characters has no trigram to look up
+        self.assertEqual(
+            set(self.search("mi")), {"milk", "almond milk", "milkshake", "bread"}
+        )
+        self.assertEqual(self.search("eg"), ["eggs"])
+
+    def test_index_follows_writes(self):
+        self.assertEqual(self.search("oat"), [])
+
+        eggs = ShoppingList.get_shopping_list_by_name(self.user.id, "eggs")
+        ShoppingList.update_shopping_list(self.user.id, eggs.id, name="oat milk")
+        ShoppingList.create_shopping_list(user_id=self.user.id, name="oats", quantity=1)
+
+        self.assertEqual(self.search("oat"), ["oats", "oat milk"])
+        self.assertNotIn("eggs", self.search("eg"))
+
+    def test_revision_is_reused(self):
+        revision = ShoppingList.get_revision(self.user.id)
+        self.search("milk", revision=revision)
+
+        # the index is current, so the search only builds a queryset
+        with self.assertNumQueries(0):
+            self.backend.search(
+                ShoppingList.get_shopping_list(self.user.id),
+                self.user.id,
+                "milk",
+                revision=revision,
+            )
+        with self.assertNumQueries(1):
+            self.backend.search(
+                ShoppingList.get_shopping_list(self.user.id), self.user.id, "milk"
+            )
+
+    @skipUnless(connection.vendor == "postgresql", "pg_trgm needs PostgreSQL")
+    def test_trigram_engine_agrees(self):
+        for search in ["milk", "mi", "bread", "way"]:
+            with self.subTest(search=search):
+                self.assertEqual(
+                    self.search(search, backend=PostgresTrigramSearchBackend()),
+                    self.search(search),
+                )
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=False)
+class ShoppingListFilterTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Date, quantity and ordering filters combine into one query, and only
+    the allowed fields can be ordered by.
+    """
+
+    username = "filters"
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        for name, quantity, days_ago in [
+            ("milk", 2, 2),
+            ("bread", 5, 3),
+            ("eggs", 5, 4),
+            ("jam", 1, 5),
+            ("rice", 9, 6),
+            ("tea", 3, 30),
+        ]:
+            item = ShoppingList.create_shopping_list(
+                user_id=self.user.id, name=name, quantity=quantity
+            )
+            ShoppingList.objects.filter(id=item.id).update(
+                created_at=now - timedelta(days=days_ago)
+            )
+
+        self.now = now
+        self.end_date = timezone.localdate()
+        self.start_date = self.end_date - timedelta(days=10)
+
+    def test_one_query(self):
+        shopping_list = ShoppingList.order_data(
+            ShoppingList.filter_shopping_list(
+                self.user.id,
+                start_date=self.now - timedelta(days=10),
+                end_date=self.now,
+                min_quantity=2,
+                max_quantity=5,
+            ),
+            ["-quantity", "name"],
+        )
+
+        with self.assertNumQueries(1):
+            names = list(shopping_list.values_list("name", flat=True))
+        self.assertEqual(names, ["bread", "eggs", "milk"])
+
+    def test_combined_filters(self):
+        response = self.client.get(
+            "/api/shopping-list/",
+            {
+                "start_date": self.start_date.isoformat(),
+                "end_date": self.end_date.isoformat(),
+                "min_quantity": 3,
+                "ordering": "-quantity,-name",
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item["name"] for item in response.json()["results"]["data"]],
+            ["rice", "eggs", "bread"],
+        )
+
+    def test_unknown_ordering(self):
+        for ordering in ["password", "-user", "name,note"]:
+            with self.subTest(ordering=ordering):
+                response = self.client.get("/api/shopping-list/", {"ordering": ordering})
+
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["code"], "40007")
+                self.assertIn("Invalid ordering option", response.json()["message"])
+
+        with self.assertRaises(ValueError):
+            ShoppingList.order_data(ShoppingList.objects.all(), ["user__password"])
+
+        response = self.client.get(
+            "/api/shopping-list/", {"min_quantity": 5, "max_quantity": 2}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=True)
+class ShoppingListCacheTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    List pages are served from the cache until the user writes, and a
+    page built while a write lands is never served as current.
+    """
+
+    username = "cache"
+
+    def setUp(self):
+        super().setUp()
+        caches["shopping_list"].clear()
+
+    def get_list(self):
+        response = self.client.get("/api/shopping-list/?sort_by=asc")
+        names = [item["name"] for item in response.json()["results"]["data"]]
+        return response["X-Cache"], names
+
+    def test_writes_invalidate(self):
+        self.client.post("/api/shopping-list/", {"name": "milk", "quantity": 1})
+        self.assertEqual(self.get_list(), ("MISS", ["milk"]))
+        self.assertEqual(self.get_list(), ("HIT", ["milk"]))
+
+        version = shopping_list_cache.get_version(self.user.id)
+        self.client.post("/api/shopping-list/", {"name": "bread", "quantity": 1})
+        self.assertNotEqual(shopping_list_cache.get_version(self.user.id), version)
+        self.assertEqual(self.get_list(), ("MISS", ["milk", "bread"]))
+
+    def test_write_during_miss(self):
+        request = RequestFactory().get("/api/shopping-list/")
+        request.user = self.user
+
+        data, version = shopping_list_cache.get(request)
+        self.assertIsNone(data)
+
+        # the page was read before this write, so it must not be served
+        shopping_list_cache.invalidate(self.user.id)
+        shopping_list_cache.set(request, {"stale": True}, version)
+        self.assertEqual(shopping_list_cache.get(request)[0], None)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_lookups_are_counted(self):
+        counters = get_registry().counters
+        before = {
+            result: counters.get(("shopping_list_cache_lookups_total", (result,)), 0)
+            for result in ["hit", "miss"]
+        }
+
+        self.get_list()
+        self.get_list()
+        self.get_list()
+
+        for result, count in [("hit", 2), ("miss", 1)]:
+            key = ("shopping_list_cache_lookups_total", (result,))
+            self.assertEqual(counters[key], before[result] + count)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_stats_without_metrics(self):
+        before = shopping_list_cache.stats()
+
+        self.get_list()
+        self.get_list()
+        self.get_list()
+
+        stats = shopping_list_cache.stats()
+        self.assertEqual(stats["hits"], before["hits"] + 2)
+        self.assertEqual(stats["misses"], before["misses"] + 1)
+        self.assertEqual(
+            stats["hit_rate"], stats["hits"] / (stats["hits"] + stats["misses"])
+        )
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=False)
+class ShoppingListConditionalRequestTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    List reads answer 304 while the client's ETag is current, and item
+    writes carrying a stale If-Match answer 412 without writing.
+    """
+
+    username = "etag"
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/api/shopping-list/", {"name": "milk", "quantity": 1})
+        self.item_id = response.json()["data"]["id"]
+        self.item_etag = response["ETag"]
+
+    def test_not_modified(self):
+        url = "/api/shopping-list/?sort_by=asc"
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertNotIn("Last-Modified", response)
+
+        # another query of the same list has its own validator
+        response = self.client.get(
+            "/api/shopping-list/?sort_by=desc", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # a write within the same second still changes the validator
+        self.client.post("/api/shopping-list/", {"name": "bread", "quantity": 1})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()["results"]["data"]), 2)
+
+    def test_if_match(self):
+        url = f"/api/shopping-list/?item_id={self.item_id}"
+
+        response = self.client.patch(
+            url, {"quantity": 2}, format="json", HTTP_IF_MATCH=self.item_etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], self.item_etag)
+
+        # the first write moved the etag on, so the old one is stale
+        for method in [self.client.patch, self.client.put, self.client.delete]:
+            with self.subTest(method=method.__name__):
+                response = method(
+                    url,
+                    {"name": "milk", "quantity": 5},
+                    format="json",
+                    HTTP_IF_MATCH=self.item_etag,
+                )
+                self.assertEqual(response.status_code, 412)
+                self.assertEqual(response.json()["code"], "40011")
+
+        self.assertEqual(
+            ShoppingList.get_shopping_list_by_id(self.user.id, self.item_id).quantity, 2
+        )
+
+        response = self.client.delete(
+            "/api/shopping-list/?item_id=0", HTTP_IF_MATCH=self.item_etag
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "40004")
+
+    def test_if_match_other_item(self):
+        bread = ShoppingList.create_shopping_list(
+            user_id=self.user.id, name="bread", quantity=1
+        )
+        # as a bulk update leaves them, both rows written at the same instant
+        ShoppingList.objects.filter(user=self.user).update(updated_at=timezone.now())
+        milk, bread = (
+            ShoppingList.objects.get(id=self.item_id),
+            ShoppingList.objects.get(id=bread.id),
+        )
+        url = f"/api/shopping-list/?item_id={bread.id}"
+
+        response = self.client.patch(
+            url, {"quantity": 2}, format="json", HTTP_IF_MATCH=milk.etag
+        )
+        self.assertEqual(response.status_code, 412)
+
+        response = self.client.patch(
+            url,
+            {"quantity": 2},
+            format="json",
+            HTTP_IF_MATCH=f'{milk.etag}, "x-1", {bread.etag}',
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ShoppingListBatchTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    A batch applies every valid operation and reports each one by index,
+    a name clash included, instead of failing as a whole.
+    """
+
+    username = "batch"
+
+    def setUp(self):
+        super().setUp()
+        self.ids = {
+            item.name: item.id
+            for item in ShoppingList.bulk_create_shopping_list(
+                self.user.id,
+                [
+                    {"name": name, "quantity": 1}
+                    for name in ["milk", "bread", "eggs", "jam"]
+                ],
+            )
+        }
+
+    def batch(self, **operations):
+        response = self.client.post(
+            "/api/shopping-list/batch/", operations, format="json"
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()["data"]
+
+    def statuses(self, results):
+        return [result["status"] for result in results]
+
+    def test_mixed_batch(self):
+        results = self.batch(
+            create=[
+                {"name": "rice", "quantity": 2},
+                {"name": "MILK", "quantity": 1},
+                {"name": "tea"},
+                {"name": "jam", "quantity": 1},
+            ],
+            update=[
+                {"id": self.ids["bread"], "quantity": 3},
+                {"id": 0, "quantity": 3},
+                {"quantity": 3},
+            ],
+            delete=[self.ids["jam"], 0],
+        )
+
+        # jam is deleted before the creates run, so it can be added again
+        self.assertEqual(
+            self.statuses(results["create"]),
+            ["created", "duplicate", "invalid", "created"],
+        )
+        self.assertEqual(
+            self.statuses(results["update"]), ["updated", "not_found", "invalid"]
+        )
+        self.assertEqual(self.statuses(results["delete"]), ["deleted", "not_found"])
+        self.assertEqual(results["update"][0]["data"]["quantity"], 3)
+
+        names = ShoppingList.get_shopping_list(self.user.id).values_list("name", flat=True)
+        self.assertEqual(sorted(names), ["bread", "eggs", "jam", "milk", "rice"])
+
+    def test_rename_conflicts(self):
+        results = self.batch(
+            update=[
+                # taken by another item
+                {"id": self.ids["milk"], "name": "Bread", "quantity": 5},
+                # a swap would trip the unique index halfway through
+                {"id": self.ids["eggs"], "name": "jam"},
+                {"id": self.ids["jam"], "name": "eggs"},
+                # a case change of its own name is fine
+                {"id": self.ids["bread"], "name": "BREAD"},
+            ],
+        )
+
+        self.assertEqual(
+            self.statuses(results["update"]),
+            ["conflict", "conflict", "conflict", "updated"],
+        )
+        self.assertEqual(results["update"][0]["id"], self.ids["milk"])
+
+        milk = ShoppingList.get_shopping_list_by_id(self.user.id, self.ids["milk"])
+        self.assertEqual((milk.name, milk.quantity), ("milk", 1))
+
+        # two items renamed to the same free name, the older one gets it
+        results = self.batch(
+            update=[
+                {"id": self.ids["jam"], "name": "honey"},
+                {"id": self.ids["eggs"], "name": "HONEY"},
+            ],
+        )
+        self.assertEqual(self.statuses(results["update"]), ["conflict", "updated"])
+
+
+class ShoppingListUpdateReturningTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Item writes are one UPDATE ... RETURNING that yields the same instance
+    a fresh read would, and None when no row matched.
+    """
+
+    username = "returning"
+
+    def setUp(self):
+        super().setUp()
+        self.item = ShoppingList.create_shopping_list(
+            user_id=self.user.id, name="milk", quantity=2
+        )
+
+    def get_item(self, id):
+        return ShoppingList.get_shopping_list(self.user.id).filter(id=id)
+
+    def assertSameAsStored(self, item):
+        stored = ShoppingList.all_objects.get(id=item.id)
+        for field in ShoppingList._meta.concrete_fields:
+            self.assertEqual(
+                getattr(item, field.attname), getattr(stored, field.attname)
+            )
+
+    def test_one_statement(self):
+        with self.assertNumQueries(1):
+            updated = ShoppingList.update_returning(
+                self.get_item(self.item.id), note="2%"
+            )
+
+        self.assertEqual(updated.note, "2%")
+        self.assertIs(updated.is_deleted, False)
+        self.assertTrue(timezone.is_aware(updated.updated_at))
+        self.assertGreater(updated.updated_at, self.item.updated_at)
+        self.assertSameAsStored(updated)
+
+    def test_without_returning(self):
+        for patched in ["supports_update_returning", "compile_update"]:
+            # no UPDATE ... RETURNING, or no UpdateQuery to build it from
+            with self.subTest(patched=patched), mock.patch(
+                f"main.models.{patched}", return_value=None
+            ):
+                updated = ShoppingList.update_returning(
+                    self.get_item(self.item.id), note=patched
+                )
+                missing = ShoppingList.update_returning(self.get_item(0), note="x")
+
+                self.assertEqual(updated.note, patched)
+                self.assertSameAsStored(updated)
+                self.assertIsNone(missing)
+
+    def test_supports_update_returning(self):
+        for vendor, version, supported in [
+            ("postgresql", None, True),
+            ("sqlite", (3, 35, 0), True),
+            ("sqlite", (3, 34, 1), False),
+            # MariaDB returns from INSERT and DELETE only
+            ("mysql", None, False),
+        ]:
+            fake = mock.Mock(vendor=vendor)
+            fake.Database.sqlite_version_info = version
+            with self.subTest(vendor=vendor, version=version):
+                self.assertIs(supports_update_returning(fake), supported)
+
+    def test_compile_update(self):
+        sql, params = compile_update(self.get_item(self.item.id), {"note": "x"})
+        self.assertTrue(sql.startswith("UPDATE "))
+        self.assertIn("x", params)
+
+        with mock.patch(
+            "django.db.models.sql.UpdateQuery.add_update_values",
+            side_effect=AttributeError,
+        ):
+            self.assertIsNone(
+                compile_update(self.get_item(self.item.id), {"note": "x"})
+            )
+
+    def test_not_found(self):
+        other = get_user_model().objects.create(
+            username="other", email="other@example.com"
+        )
+
+        self.assertIsNone(ShoppingList.update_returning(self.get_item(0), note="x"))
+        self.assertIsNone(
+            ShoppingList.update_returning(
+                ShoppingList.objects.filter(id__in=[]), note="x"
+            )
+        )
+        self.assertIsNone(
+            ShoppingList.update_shopping_list(other.id, self.item.id, quantity=9)
+        )
+        self.assertIsNone(ShoppingList.adjust_quantity(other.id, self.item.id, 1))
+        self.assertIsNone(ShoppingList.delete_shopping_list(self.user.id, 0))
+
+        self.assertEqual(ShoppingList.objects.get(id=self.item.id).quantity, 2)
+
+    def test_quantity_delta(self):
+        for delta, quantity in [(3, 5), (-1, 4)]:
+            updated = ShoppingList.adjust_quantity(self.user.id, self.item.id, delta)
+            self.assertEqual(updated.quantity, quantity)
+        self.assertEqual(ShoppingListStats.get_stats(self.user.id)["total_quantity"], 4)
+
+        url = f"/api/shopping-list/?item_id={self.item.id}"
+
+        response = self.client.patch(url, {"quantity_delta": -4}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["quantity"], 0)
+
+        response = self.client.patch(url, {"quantity": 1, "quantity_delta": 1}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.patch(
+            "/api/shopping-list/?item_id=0", {"quantity_delta": 1}, format="json"
+        )
+        self.assertEqual(response.json()["code"], "40004")
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=False)
+class ShoppingListMergeTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Merges add to the live item with the same name (case insensitive) and
+    report whether they inserted it, even when both land in the same tick.
+    """
+
+    username = "merge"
+
+    def test_insert_then_merge(self):
+        now = timezone.now()
+        with mock.patch("django.utils.timezone.now", return_value=now):
+            inserted, created = ShoppingList.merge_shopping_list(
+                self.user.id, "milk", 2, note="2%"
+            )
+            self.assertIs(created, True)
+
+            merged, created = ShoppingList.merge_shopping_list(
+                self.user.id, "MILK", 3, note="skimmed"
+            )
+            self.assertIs(created, False)
+
+        self.assertEqual(merged.id, inserted.id)
+        self.assertEqual((merged.name, merged.quantity, merged.note), ("milk", 5, "2%"))
+        self.assertEqual(merged.created_at, merged.updated_at)
+        self.assertEqual(ShoppingListStats.get_stats(self.user.id)["item_count"], 1)
+
+    def test_bulk_merge(self):
+        milk = ShoppingList.create_shopping_list(
+            user_id=self.user.id, name="milk", quantity=1
+        )
+
+        now = timezone.now()
+        with mock.patch("django.utils.timezone.now", return_value=now):
+            ShoppingList.objects.filter(id=milk.id).update(created_at=now)
+            results = ShoppingList.bulk_merge_shopping_list(
+                self.user.id,
+                [
+                    {"name": "Milk", "quantity": 2},
+                    {"name": "jam", "quantity": 1},
+                    {"name": "JAM", "quantity": 4, "note": "apricot"},
+                ],
+            )
+
+        created = {shopping_list.name: created for shopping_list, created in results}
+        self.assertEqual(created, {"milk": False, "jam": True})
+        self.assertEqual(
+            dict(
+                ShoppingList.get_shopping_list(self.user.id).values_list(
+                    "name", "quantity"
+                )
+            ),
+            {"milk": 3, "jam": 5},
+        )
+        self.assertEqual(ShoppingList.objects.get(name="jam").note, "apricot")
+
+    def test_live_name_unique(self):
+        url = "/api/shopping-list/"
+
+        response = self.client.post(url, {"name": "milk", "quantity": 1}, format="json")
+        self.assertEqual(response.status_code, 201)
+        item_id = response.json()["data"]["id"]
+
+        response = self.client.post(url, {"name": "MILK", "quantity": 1}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "40006")
+
+        # deleted items do not hold on to their name
+        self.client.delete(f"{url}?item_id={item_id}")
+        response = self.client.post(url, {"name": "Milk", "quantity": 1}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+        other = get_user_model().objects.create(
+            username="other", email="other@example.com"
+        )
+        ShoppingList.create_shopping_list(user_id=other.id, name="milk", quantity=1)
+        self.assertEqual(ShoppingList.all_objects.filter(name__iexact="milk").count(), 3)
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=False, SHOPPING_LIST_CHANGES_LAG_SECONDS=0)
+class ShoppingListChangesTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    The changes feed pages through every write exactly once, oldest first,
+    deletes included as tombstones.
+    """
+
+    url = "/api/shopping-list/changes/"
+
+    username = "changes"
+
+    def setUp(self):
+        super().setUp()
+        self.items = [
+            ShoppingList.create_shopping_list(
+                user_id=self.user.id, name=f"item {i}", quantity=1
+            )
+            for i in range(5)
+        ]
+
+    def sync(self, cursor=None, limit=2):
+        """
+        Follow the feed from ``cursor`` until has_more is false, returning
+        the rows seen and the final cursor
+        """
+        rows = []
+        while True:
+            params = {"limit": limit}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+
+            body = response.json()
+            self.assertLessEqual(len(body["data"]), limit)
+            rows += body["data"]
+            cursor = body["cursor"]
+            if not body["has_more"]:
+                return rows, cursor
+
+    def test_cursor_paging(self):
+        rows, cursor = self.sync()
+        self.assertEqual([row["id"] for row in rows], [item.id for item in self.items])
+
+        # caught up: nothing new, and the cursor stays put
+        response = self.client.get(self.url, {"cursor": cursor})
+        self.assertEqual(response.json()["data"], [])
+        self.assertEqual(response.json()["cursor"], cursor)
+        self.assertIs(response.json()["has_more"], False)
+
+        ShoppingList.update_shopping_list(self.user.id, self.items[1].id, quantity=4)
+        rows, _ = self.sync(cursor)
+        self.assertEqual(
+            [(row["id"], row["quantity"]) for row in rows], [(self.items[1].id, 4)]
+        )
+
+    def test_tombstones(self):
+        _, cursor = self.sync()
+
+        ShoppingList.delete_shopping_list(self.user.id, self.items[0].id)
+        rows, _ = self.sync(cursor)
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["id"], self.items[0].id)
+        self.assertIs(rows[0]["is_deleted"], True)
+
+    def test_same_updated_at(self):
+        # rows sharing an updated_at are ordered, and resumed, by id
+        now = timezone.now()
+        ShoppingList.all_objects.filter(user=self.user).update(updated_at=now)
+
+        for limit in (1, 2, 3):
+            rows, _ = self.sync(limit=limit)
+            self.assertEqual(
+                [row["id"] for row in rows], [item.id for item in self.items]
+            )
+
+    @override_settings(SHOPPING_LIST_CHANGES_LAG_SECONDS=5)
+    def test_late_commit(self):
+        now = timezone.now()
+        ShoppingList.all_objects.filter(user=self.user).update(
+            updated_at=now - timedelta(seconds=60)
+        )
+        latest = ShoppingList.create_shopping_list(
+            user_id=self.user.id, name="latest", quantity=1
+        )
+        ShoppingList.objects.filter(id=latest.id).update(
+            updated_at=now - timedelta(seconds=1)
+        )
+
+        # the row stamped within the lag is held back, and the cursor with it
+        with mock.patch("django.utils.timezone.now", return_value=now):
+            rows, cursor = self.sync()
+        self.assertEqual([row["id"] for row in rows], [item.id for item in self.items])
+
+        # a transaction stamped before "latest" but committed after it
+        late = ShoppingList.create_shopping_list(
+            user_id=self.user.id, name="late", quantity=1
+        )
+        ShoppingList.objects.filter(id=late.id).update(
+            updated_at=now - timedelta(seconds=3)
+        )
+
+        later = now + timedelta(seconds=10)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            rows, _ = self.sync(cursor)
+        self.assertEqual([row["id"] for row in rows], [late.id, latest.id])
+
+    def test_invalid_cursor(self):
+        for cursor in ["not a cursor", encode_sync_cursor(timezone.now(), 0)[:-4]]:
+            response = self.client.get(self.url, {"cursor": cursor})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["code"], "40007")
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=False)
+class CachedJWTAuthenticationTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Tokens are checked against the cached active status of their user, so
+    deactivated and deleted users are turned away once the cache entry goes.
+    """
+
+    url = "/api/shopping-list/"
+
+    username = "auth"
+
+    def setUp(self):
+        super().setUp()
+        active_user_cache.clear()
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def tearDown(self):
+        active_user_cache.clear()
+
+    def get(self, token=None):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {token or self.token}")
+        return client.get(self.url)
+
+    def count_user_queries(self):
+        """
+        Status code and number of auth_user queries of one request
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get()
+        return response.status_code, sum(
+            '"auth_user"' in query["sql"] for query in queries.captured_queries
+        )
+
+    def test_active_status_cached(self):
+        self.assertEqual(self.count_user_queries(), (200, 1))
+        self.assertEqual(self.count_user_queries(), (200, 0))
+
+    def test_deactivated_user(self):
+        self.assertEqual(self.get().status_code, 200)
+
+        # a save invalidates the entry through the post_save receiver
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_deactivated_without_signal(self):
+        self.assertEqual(self.get().status_code, 200)
+
+        # a bulk update sends no signal, the stale entry holds until it
+        # is invalidated or expires
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.get().status_code, 200)
+
+        active_user_cache.invalidate(self.user.pk)
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_entry_expires(self):
+        cache = ActiveUserCache(ttl=60)
+        with mock.patch("main.authentication.time.monotonic", return_value=1000):
+            cache.set(self.user.pk, True)
+            self.assertIs(cache.get(self.user.pk), True)
+        with mock.patch("main.authentication.time.monotonic", return_value=1061):
+            self.assertIsNone(cache.get(self.user.pk))
+
+    def test_deleted_user(self):
+        self.assertEqual(self.get().status_code, 200)
+
+        self.user.delete()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_invalid_token(self):
+        self.assertEqual(self.get(f"{self.token[:-4]}abcd").status_code, 401)
+        self.assertEqual(self.get("not-a-token").status_code, 401)
+
+        token = RefreshToken.for_user(self.user).access_token
+        del token["user_id"]
+        self.assertEqual(self.get(str(token)).status_code, 401)
+
+    def test_async(self):
+        authentication = CachedJWTAuthentication()
+        request = RequestFactory().get(
+            self.url, HTTP_AUTHORIZATION=f"Bearer {self.token}"
+        )
+
+        user, _ = async_to_sync(authentication.aauthenticate)(request)
+        self.assertEqual(user.id, self.user.id)
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            async_to_sync(authentication.aauthenticate)(request)
+
+
+class EmailAndUsernameBackendTestCase(TestCase):
+    """
+    A login by e-mail or username is one query and one password hash,
+    whether or not the account exists.
+    """
+
+    password = "correct horse"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(
+            username="login", email="Login@Example.com"
+        )
+        self.user.set_password(self.password)
+        self.user.save()
+
+        self.backend = EmailAndUsernameBackend()
+
+    def authenticate(self, identifier, password):
+        """
+        (user or exception, queries, hashes) of one attempt
+        """
+        hasher = type(get_hasher())
+        with CaptureQueriesContext(connection) as queries, mock.patch.object(
+            hasher, "encode", autospec=True, side_effect=hasher.encode
+        ) as encode:
+            try:
+                result = self.backend.authenticate(
+                    None, email=identifier, password=password
+                )
+            except Exception as e:
+                result = e
+
+        return result, len(queries), encode.call_count
+
+    def test_login(self):
+        for identifier in ["login@example.com", "LOGIN@EXAMPLE.COM", "login"]:
+            with self.subTest(identifier=identifier):
+                self.assertEqual(
+                    self.authenticate(identifier, self.password), (self.user, 1, 1)
+                )
+
+    def test_failed_login(self):
+        for identifier, password in [
+            ("login@example.com", "wrong"),
+            ("login", "wrong"),
+            ("nobody@example.com", self.password),
+        ]:
+            with self.subTest(identifier=identifier, password=password):
+                result, queries, hashes = self.authenticate(identifier, password)
+                self.assertIsInstance(result, Exception)
+                self.assertEqual((queries, hashes), (1, 1))
+
+    def test_email_wins_over_username(self):
+        other = get_user_model().objects.create(username="login@example.com")
+
+        self.assertEqual(
+            self.backend.get_user_by_identifier("login@example.com"), self.user
+        )
+        self.assertEqual(self.backend.get_user_by_identifier("login"), self.user)
+        self.assertNotEqual(other, self.user)
+
+    def test_async_login(self):
+        user = async_to_sync(self.backend.aauthenticate)(
+            None, email="LOGIN@example.com", password=self.password
+        )
+        self.assertEqual(user, self.user)
+
+    def test_inactive(self):
+        self.user.is_active = False
+        self.user.save()
+
+        result, _, _ = self.authenticate("login", self.password)
+        self.assertEqual(str(result), "User is inactive")
+
+        with self.assertRaisesMessage(Exception, "User is inactive"):
+            async_to_sync(self.backend.aauthenticate)(
+                None, email="login", password=self.password
+            )
+
+        response = APIClient().post(
+            "/api/login/",
+            {"username_or_email": "login", "password": self.password},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("tokens", response.json())
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite query plan")
+    def test_uses_indexes(self):
+        plan = self.backend.get_users("login@example.com").explain()
+
+        self.assertIn("main_user_email_upper_uniq", plan)
+        self.assertNotIn("SCAN auth_user", plan)
+
+
+class CreateAccountDuplicateTestCase(TestCase):
+    """
+    Duplicate sign-ups are reported against the field whose unique index
+    rejected them, whatever the submitted values contain.
+    """
+
+    password = "S3cret-pass!"
+
+    def sign_up(self, username, email):
+        return APIClient().post(
+            "/api/create/",
+            {
+                "username": username,
+                "email": email,
+                "password": self.password,
+                "confirm_password": self.password,
+            },
+            format="json",
+        )
+
+    def test_duplicates(self):
+        response = self.sign_up("email", "first@example.com")
+        self.assertEqual(response.status_code, 201)
+
+        response = self.sign_up("email", "second@example.com")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ["username"])
+
+        response = self.sign_up("username", "FIRST@example.com")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ["email"])
+
+        self.assertEqual(get_user_model().objects.count(), 1)
+
+    def test_constraint_name(self):
+        # psycopg's message also quotes the rejected values
+        for constraint, field in [
+            ("auth_user_username_key", "username"),
+            (USER_EMAIL_INDEX, "email"),
+        ]:
+            message = (
+                f'duplicate key value violates unique constraint "{constraint}"\n'
+                "DETAIL:  Key (username)=(email) already exists."
+            )
+            error = IntegrityError(message)
+            error.__cause__ = Exception(message)
+            error.__cause__.diag = mock.Mock(constraint_name=constraint)
+
+            with self.subTest(constraint=constraint):
+                self.assertEqual(
+                    list(get_duplicate_account_error(error).detail), [field]
+                )
+
+
+class AsyncUrls:
+    urlpatterns = [path("api/", include(get_urlpatterns(async_views=True)))]
+
+
+@override_settings(
+    ROOT_URLCONF=AsyncUrls,
+    SHOPPING_LIST_SHARDS=["shard1", "shard2"],
+    SHOPPING_LIST_CACHE_ENABLED=False,
+)
+class AsyncShoppingListApiTestCase(TestCase):
+    """
+    The native async views answer like the sync ones, and never reach a
+    sync database lookup from the event loop, sharded or not.
+    """
+
+    databases = {"default", "shard1", "shard2"}
+    url = "/api/shopping-list/"
+
+    def setUp(self):
+        shard_map.clear()
+        self.addCleanup(shard_map.clear)
+
+        password = "S3cret-pass!"
+        response = self.client.post(
+            "/api/create/",
+            {
+                "username": "async",
+                "email": "async@example.com",
+                "password": password,
+                "confirm_password": password,
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.post(
+            "/api/login/",
+            {"username_or_email": "async@example.com", "password": password},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.api = APIClient()
+        self.api.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.json()['tokens']['access']}"
+        )
+
+    def test_crud(self):
+        # every shard lookup goes to the map table, none is answered from
+        # memory
+        patcher = mock.patch.object(shard_map, "ttl", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        response = self.api.post(
+            self.url, {"name": "milk", "quantity": 2}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        item_id = response.json()["data"]["id"]
+
+        response = self.api.post(
+            f"{self.url}?merge=true", {"name": "MILK", "quantity": 1}, format="json"
+        )
+        self.assertEqual(response.json()["data"]["quantity"], 3)
+
+        for params in [
+            {},
+            {"min_quantity": 1, "ordering": "-name"},
+            {"search": "mil"},
+            {"pagination": "cursor"},
+        ]:
+            with self.subTest(params=params):
+                response = self.api.get(self.url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [item["id"] for item in response.json()["results"]["data"]],
+                    [item_id],
+                )
+
+        response = self.api.patch(
+            f"{self.url}?item_id={item_id}", {"note": "2%"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["note"], "2%")
+
+        response = self.api.delete(f"{self.url}?item_id={item_id}")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.api.get(self.url)
+        self.assertEqual(response.json()["results"]["data"], [])
+
+    def test_errors(self):
+        response = self.api.get(self.url, {"min_quantity": "x"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "40007")
+
+        response = self.api.patch(f"{self.url}?item_id=0", {"note": "x"}, format="json")
+        self.assertEqual(response.json()["code"], "40004")
+
+        response = APIClient().get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=False)
+class ShoppingListImportTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Imports accept NDJSON and CSV, merge on request and report rejected rows
+    in line order, whichever step rejected them.
+    """
+
+    url = "/api/shopping-list/import/"
+
+    username = "import"
+
+    def setUp(self):
+        super().setUp()
+        ShoppingList.create_shopping_list(user_id=self.user.id, name="milk", quantity=1)
+
+    def get_items(self):
+        return dict(
+            ShoppingList.get_shopping_list(self.user.id).values_list("name", "quantity")
+        )
+
+    def post_ndjson(self, lines, merge=False):
+        return self.client.post(
+            f"{self.url}?merge=true" if merge else self.url,
+            "\n".join(lines).encode(),
+            content_type="application/x-ndjson",
+        )
+
+    def test_ndjson(self):
+        lines = [
+            '{"name": "bread", "quantity": 1}',
+            "not json",
+            '{"name": "MILK", "quantity": 2}',
+            '{"name": "jam"}',
+            "",
+            "[1, 2]",
+            '{"name": "eggs", "quantity": 12, "note": "free range"}',
+            '{"name": "Bread", "quantity": 1}',
+        ]
+
+        # the chunk boundaries must not change the order either
+        for chunk_size in (500, 3):
+            ShoppingList.all_objects.exclude(name="milk").delete()
+            with self.subTest(chunk_size=chunk_size), override_settings(
+                SHOPPING_LIST_IMPORT_CHUNK_SIZE=chunk_size
+            ):
+                response = self.post_ndjson(lines)
+                self.assertEqual(response.status_code, 200)
+
+                summary = response.json()["data"]
+                self.assertEqual(
+                    (summary["accepted"], summary["created"], summary["rejected"]),
+                    (2, 2, 5),
+                )
+                self.assertEqual(
+                    [(error["line"], error["status"]) for error in summary["errors"]],
+                    [
+                        (2, "invalid"),
+                        (3, "duplicate"),
+                        (4, "invalid"),
+                        (6, "invalid"),
+                        (8, "duplicate"),
+                    ],
+                )
+                self.assertEqual(
+                    self.get_items(), {"milk": 1, "bread": 1, "eggs": 12}
+                )
+
+    def test_csv(self):
+        content = (
+            "id,name,quantity,note\r\n"
+            '1,bread,2,"white,\r\nsliced"\r\n'
+            "2,jam,,\r\n"
+            "3,milk,1,\r\n"
+            "4,eggs,6,\r\n"
+        )
+        upload = SimpleUploadedFile("list.csv", content.encode(), "text/csv")
+
+        response = self.client.post(self.url, {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+
+        summary = response.json()["data"]
+        self.assertEqual((summary["accepted"], summary["rejected"]), (2, 2))
+        # a record is reported where it starts, the quoted note spans two lines
+        self.assertEqual(
+            [(error["line"], error["status"]) for error in summary["errors"]],
+            [(4, "invalid"), (5, "duplicate")],
+        )
+        self.assertEqual(self.get_items(), {"milk": 1, "bread": 2, "eggs": 6})
+        self.assertEqual(
+            ShoppingList.objects.get(name="bread").note, "white,\r\nsliced"
+        )
+
+        response = self.client.post(
+            self.url, b"title,amount\r\nbread,1\r\n", content_type="text/csv"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "40007")
+
+    def test_merge(self):
+        response = self.post_ndjson(
+            [
+                '{"name": "MILK", "quantity": 2}',
+                '{"name": "jam", "quantity": 0.5}',
+                '{"name": "jam", "quantity": 1}',
+                '{"name": "milk", "quantity": 3, "note": "2%"}',
+            ],
+            merge=True,
+        )
+        self.assertEqual(response.status_code, 200)
+
+        summary = response.json()["data"]
+        self.assertEqual(
+            (summary["accepted"], summary["created"], summary["rejected"]), (3, 1, 1)
+        )
+        self.assertEqual(
+            [(error["line"], error["status"]) for error in summary["errors"]],
+            [(2, "invalid")],
+        )
+        self.assertEqual(self.get_items(), {"milk": 6, "jam": 1})
+        self.assertEqual(ShoppingList.objects.get(name="milk").note, "2%")
+
+
+class ShoppingListValuesSerializerTestCase(TestCase):
+    """
+    The values_list() fast path and FastJSONRenderer must produce exactly
+    the bytes of ShoppingListModelSerializer and DRF's JSONRenderer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(
+            username="fast", email="fast@example.com"
+        )
+
+        now = timezone.now()
+        for index, (name, note) in enumerate(
+            [
+                ("milk", None),
+                ("crème fraîche", "the \u2028 separator and \u2029 too"),
+                ('"quoted" \\ name', ""),
+                ("eggs", "x" * 500),
+            ]
+        ):
+            item = ShoppingList.objects.create(
+                user=cls.user, name=name, note=note, quantity=index * 1000
+            )
+            # one row without microseconds, one past midnight UTC
+            item.created_at = now.replace(microsecond=0) - timedelta(days=index)
+            item.updated_at = now - timedelta(hours=index * 7)
+            item.save(update_fields=["created_at"])
+            ShoppingList.objects.filter(pk=item.pk).update(updated_at=item.updated_at)
+
+    def render_both(self, queryset, fields=None):
+        expected = JSONRenderer().render(
+            ShoppingListModelSerializer(queryset, many=True, fields=fields).data
+        )
+        actual = FastJSONRenderer().render(
+            ShoppingListValuesSerializer(
+                ShoppingListValuesSerializer.get_rows(queryset, fields), fields=fields
+            ).data
+        )
+        return expected, actual
+
+    def test_same_bytes(self):
+        queryset = ShoppingList.get_shopping_list(self.user.id).order_by("id")
+
+        for zone in ["Africa/Lagos", "UTC", "America/St_Johns"]:
+            with self.subTest(zone=zone), timezone.override(zone):
+                expected, actual = self.render_both(queryset)
+                self.assertEqual(expected, actual)
+
+    def test_same_bytes_for_fields(self):
+        queryset = ShoppingList.get_shopping_list(self.user.id).order_by("-name")
+
+        for fields in [["id", "name", "quantity"], ["updated_at", "note"]]:
+            with self.subTest(fields=fields):
+                expected, actual = self.render_both(queryset, fields)
+                self.assertEqual(expected, actual)
+
+    def test_empty_page(self):
+        expected, actual = self.render_both(ShoppingList.objects.none())
+        self.assertEqual(expected, actual)
+
+
+@override_settings(SHOPPING_LIST_EXPORT_CHUNK_SIZE=200)
+class ShoppingListExportTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Streaming exports hold one chunk of rows at a time, so peak memory
+    while consuming the response must not grow with the list.
+    """
+
+    username = "export"
+
+    def add_items(self, count):
+        start = ShoppingList.objects.filter(user=self.user).count()
+        ShoppingList.bulk_create_shopping_list(
+            self.user.id,
+            [
+                {"name": f"item {index}", "quantity": index, "note": "note " * 40}
+                for index in range(start, start + count)
+            ],
+        )
+
+    def export_peak(self, export_format):
+        """
+        Peak traced memory while streaming the export, and its line count
+        """
+        response = self.client.get(
+            f"/api/shopping-list/export/?export_format={export_format}"
+        )
+        self.assertEqual(response.status_code, 200)
+
+        lines = 0
+        tracemalloc.start()
+        try:
+            for chunk in response.streaming_content:
+                lines += chunk.count(b"\n")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return peak, lines
+
+    def test_memory_is_constant(self):
+        for export_format, header_lines in [("ndjson", 0), ("csv", 1)]:
+            with self.subTest(export_format=export_format):
+                ShoppingList.objects.filter(user=self.user).delete()
+
+                self.add_items(1000)
+                small_peak, lines = self.export_peak(export_format)
+                self.assertEqual(lines, 1000 + header_lines)
+
+                self.add_items(9000)
+                large_peak, lines = self.export_peak(export_format)
+                self.assertEqual(lines, 10000 + header_lines)
+
+                # ten times the rows, less than 1.5 times the memory
+                self.assertLess(large_peak, small_peak * 1.5, (small_peak, large_peak))
+
+
+@override_settings(SHOPPING_LIST_CHANGES_LAG_SECONDS=0)
+class ShoppingListPurgeTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Purging moves only tombstones past the retention window, and sync
+    cursors that could have missed one of them are turned away.
+    """
+
+    username = "purge"
+
+    def setUp(self):
+        super().setUp()
+        ShoppingList.bulk_create_shopping_list(
+            self.user.id,
+            [{"name": f"item {index}", "quantity": index} for index in range(10)],
+        )
+        self.ids = list(
+            ShoppingList.get_shopping_list(self.user.id)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+        self.deleted_at = timezone.now() - timedelta(days=40)
+        ShoppingList.objects.filter(id__in=self.ids[:5]).update(
+            is_deleted=True, updated_at=self.deleted_at
+        )
+        ShoppingList.delete_shopping_list(self.user.id, self.ids[5])
+
+    def test_purge_archives_old_tombstones(self):
+        summary = ShoppingListPurge(timedelta(days=30), batch_size=2, sleep=0).run()
+
+        self.assertEqual(summary, {"batches": 3, "purged": 5, "last_id": self.ids[4]})
+        self.assertEqual(
+            sorted(ShoppingListArchive.objects.values_list("id", flat=True)),
+            self.ids[:5],
+        )
+        # the recent tombstone and the live rows stay
+        self.assertEqual(
+            sorted(ShoppingList.all_objects.values_list("id", flat=True)), self.ids[5:]
+        )
+        self.assertEqual(ShoppingList.objects.count(), 4)
+
+        # nothing left to do on a second run
+        self.assertEqual(ShoppingListPurge(timedelta(days=30), sleep=0).run()["purged"], 0)
+
+    def test_hard_delete(self):
+        ShoppingListPurge(timedelta(days=30), mode="delete", sleep=0).run()
+
+        self.assertFalse(ShoppingListArchive.objects.exists())
+        self.assertEqual(ShoppingList.all_objects.count(), 5)
+
+    def test_changes_cursor_expires(self):
+        stale_cursor = encode_sync_cursor(self.deleted_at - timedelta(days=1), 0)
+        ShoppingListPurge(timedelta(days=30), sleep=0).run()
+
+        response = self.client.get(f"/api/shopping-list/changes/?cursor={stale_cursor}")
+        self.assertEqual(response.status_code, 400)
+
+        # a full sync hands out a cursor past the purge that keeps working
+        response = self.client.get("/api/shopping-list/changes/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"]), 5)
+
+        cursor = response.json()["cursor"]
+        response = self.client.get(f"/api/shopping-list/changes/?cursor={cursor}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"], [])
+
+
+class ShoppingListStatsTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    The rollups maintained by every write path must match a rebuild from
+    the items, and reading them must not depend on the list's length.
+    """
+
+    username = "stats"
+
+    def item_id(self, name):
+        return ShoppingList.get_shopping_list_by_name(self.user.id, name).id
+
+    def test_writes_keep_stats_current(self):
+        url = "/api/shopping-list/"
+        for name, quantity in [("milk", 2), ("bread", 1), ("eggs", 12)]:
+            self.client.post(url, {"name": name, "quantity": quantity}, format="json")
+        self.client.post(f"{url}?merge=true", {"name": "MILK", "quantity": 3}, format="json")
+        self.client.post(f"{url}?merge=true", {"name": "jam", "quantity": 1}, format="json")
+        self.client.patch(
+            f"{url}?item_id={self.item_id('eggs')}", {"quantity": 6}, format="json"
+        )
+        self.client.patch(
+            f"{url}?item_id={self.item_id('bread')}", {"quantity_delta": 4}, format="json"
+        )
+        self.client.delete(f"{url}?item_id={self.item_id('jam')}")
+        self.client.post(
+            "/api/shopping-list/batch/",
+            {
+                "create": [{"name": "rice", "quantity": 2}],
+                "update": [{"id": self.item_id("milk"), "quantity": 1}],
+                "delete": [self.item_id("eggs")],
+            },
+            format="json",
+        )
+
+        stats = ShoppingListStats.get_stats(self.user.id, days=7)
+        self.assertEqual(stats["item_count"], 3)
+        self.assertEqual(stats["total_quantity"], 1 + 5 + 2)
+        self.assertEqual(stats["added_per_day"][-1]["added"], 5)
+        self.assertEqual(sum(week["added"] for week in stats["added_per_week"]), 5)
+
+        ShoppingListStats.rebuild([self.user.id])
+        self.assertEqual(ShoppingListStats.get_stats(self.user.id, days=7), stats)
+
+        response = self.client.get("/api/shopping-list/stats/?days=7")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["total_quantity"], 8)
+
+    def test_partial_weeks(self):
+        # Wednesday 2026-10-14
+        today = date(2026, 10, 14)
+        for day, count in [(date(2026, 10, 5), 1), (date(2026, 10, 6), 2), (today, 3)]:
+            ShoppingListDailyStats.objects.create(user=self.user, day=day, added=count)
+
+        with mock.patch("django.utils.timezone.localdate", return_value=today):
+            stats = ShoppingListStats.get_stats(self.user.id, days=9)
+
+        self.assertEqual(
+            stats["added_per_week"],
+            [
+                {"week": date(2026, 10, 5), "added": 2, "days": 6, "partial": True},
+                {"week": date(2026, 10, 12), "added": 3, "days": 3, "partial": True},
+            ],
+        )
+        with mock.patch(
+            "django.utils.timezone.localdate", return_value=date(2026, 10, 18)
+        ):
+            stats = ShoppingListStats.get_stats(self.user.id, days=14)
+        self.assertEqual(
+            stats["added_per_week"],
+            [
+                {"week": date(2026, 10, 5), "added": 3, "days": 7, "partial": False},
+                {"week": date(2026, 10, 12), "added": 3, "days": 7, "partial": False},
+            ],
+        )
+
+    def test_read_is_constant(self):
+        ShoppingList.bulk_create_shopping_list(
+            self.user.id,
+            [{"name": f"item {index}", "quantity": 1} for index in range(500)],
+        )
+
+        with self.assertNumQueries(2):
+            stats = ShoppingListStats.get_stats(self.user.id)
+        self.assertEqual(stats["item_count"], 500)
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=False)
+class RequestTimingMiddlewareTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    Server-Timing reports what the request ran, and slow requests log
+    their SQL; with timing off the middleware is not loaded at all.
+    """
+
+    username = "timing"
+
+    def setUp(self):
+        super().setUp()
+        ShoppingList.bulk_create_shopping_list(
+            self.user.id, [{"name": "milk", "quantity": 1}]
+        )
+
+    def get_list(self):
+        # a new client loads the middleware with the current settings
+        return get_client(self.user).get("/api/shopping-list/?sort_by=asc")
+
+    def test_server_timing(self):
+        with override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_SLOW_MS=60000):
+            with self.assertLogs("main.timing", "INFO") as logs, CaptureQueriesContext(
+                connection
+            ) as context:
+                response = self.get_list()
+
+        metrics = {
+            metric.split(";")[0]: metric for metric in response["Server-Timing"].split(", ")
+        }
+        self.assertEqual(
+            list(metrics), ["db", "auth", "page", "serialize", "render", "view", "total"]
+        )
+        self.assertIn(f'desc="{len(context.captured_queries)} queries"', metrics["db"])
+        self.assertIn("view=shopping-list status=200", logs.output[0])
+
+    def test_slow_request_dumps_sql(self):
+        with override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_SLOW_MS=0):
+            with self.assertLogs("main.timing", "WARNING") as logs:
+                self.get_list()
+
+        self.assertIn("slow request", logs.output[0])
+        self.assertIn("main_shoppinglist", logs.output[0])
+        self.assertTrue(logs.records[0].timing["slowest"])
+
+    @override_settings(REQUEST_TIMING_ENABLED=False)
+    def test_disabled(self):
+        self.assertNotIn("Server-Timing", self.get_list())
+
+
+class MetricsTestCase(TestCase):
+    """
+    Every worker's numbers add up in one scrape, dead workers' included,
+    and the middleware feeds the registry the endpoint reads.
+    """
+
+    def test_workers_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = MetricsRegistry(directory), MetricsRegistry(directory)
+            first.record_request("shopping-list", "GET", 200, 0.02, 3)
+            first.record_request("shopping-list", "GET", 200, 0.3, 4)
+            second.record_request("shopping-list", "GET", 200, 0.004, 3)
+            second.record_request("login", "POST", 401, 0.1, 1)
+            first.flush()
+
+            text = render_metrics(*second.collect())
+
+        labels = 'view="shopping-list",method="GET",status="200"'
+        self.assertIn(f"shopping_http_requests_total{{{labels}}} 3\n", text)
+        self.assertIn(
+            f'shopping_http_request_duration_seconds_bucket{{{labels},le="0.005"}} 1\n',
+            text,
+        )
+        self.assertIn(
+            f'shopping_http_request_duration_seconds_bucket{{{labels},le="0.025"}} 2\n',
+            text,
+        )
+        self.assertIn(
+            f'shopping_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3\n',
+            text,
+        )
+        self.assertIn(f"shopping_http_request_duration_seconds_count{{{labels}}} 3\n", text)
+        self.assertIn(
+            'shopping_db_queries_per_request_bucket{view="shopping-list",method="GET",'
+            'le="3"} 2\n',
+            text,
+        )
+        self.assertIn(
+            'shopping_http_requests_total{view="login",method="POST",status="401"} 1\n',
+            text,
+        )
+
+    def test_dead_workers_are_retired(self):
+        key = ("shopping_http_requests_total", ("shopping-list", "GET", "200"))
+        dead_pid = 4000001
+
+        def kill(pid, signal):
+            if pid == dead_pid:
+                raise ProcessLookupError(pid)
+
+        with tempfile.TemporaryDirectory() as directory, mock.patch(
+            "main.metrics.os.kill", side_effect=kill
+        ):
+            dead, idle, live = [MetricsRegistry(directory) for _ in range(3)]
+            dead.filename = f"metrics-{dead_pid}-1.json"
+            for registry in [dead, idle, live]:
+                registry.record_request("shopping-list", "GET", 200, 0.01, 1)
+            dead.flush()
+            idle.flush()
+            # alive, but silent for longer than stale_after
+            os.utime(os.path.join(directory, idle.filename), (0, 0))
+
+            self.assertEqual(live.collect()[0][key], 3)
+            self.assertEqual(
+                sorted(os.listdir(directory)), [".lock", "metrics-retired.json"]
+            )
+
+            # the idle worker's next flush only adds what came after
+            idle.record_request("shopping-list", "GET", 200, 0.01, 1)
+            idle.flush()
+            self.assertEqual(live.collect()[0][key], 4)
+            self.assertEqual(live.collect()[0][key], 4)
+            self.assertEqual(len(os.listdir(directory)), 3)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_middleware_records_requests(self):
+        key = ("shopping_http_requests_total", ("shopping-list", "GET", "401"))
+        before = get_registry().collect()[0].get(key, 0)
+
+        client = APIClient()
+        client.get("/api/shopping-list/")
+        client.get("/api/shopping-list/")
+
+        response = client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_registry().collect()[0][key], before + 2)
+        self.assertIn(
+            "shopping_http_requests_total"
+            f'{{view="shopping-list",method="GET",status="401"}} {before + 2}',
+            response.content.decode(),
+        )
+
+
+class ProfilingTestCase(TestCase):
+    """
+    A staff user's profile token gets the request profiled into the ring
+    directory; a token sent by someone else does not.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.settings = override_settings(
+            PROFILING_ENABLED=True,
+            PROFILING_DIR=self.directory.name,
+            PROFILING_MAX_FILES=2,
+            SHOPPING_LIST_CACHE_ENABLED=False,
+        )
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+        User = get_user_model()
+        self.staff = User.objects.create(
+            username="staff", email="staff@example.com", is_staff=True
+        )
+        self.other = User.objects.create(username="other", email="other@example.com")
+
+    def get_changes(self, user, token):
+        client = get_client(user, HTTP_X_PROFILE_TOKEN=token)
+        # served by an APIView with SHOPPING_LIST_ASYNC_VIEWS on too
+        return client.get("/api/shopping-list/changes/")
+
+    def test_profile_token(self):
+        token = make_profile_token(self.staff)
+        with self.assertRaises(ValueError):
+            make_profile_token(self.other)
+
+        self.assertNotIn("X-Profile-Id", self.get_changes(self.other, token))
+        self.assertEqual(list_profiles(), [])
+
+        names = [self.get_changes(self.staff, token)["X-Profile-Id"] for _ in range(3)]
+        # a ring of two
+        self.assertEqual(list_profiles(), names[:0:-1])
+
+        with open(os.path.join(self.directory.name, f"{names[-1]}.collapsed")) as file:
+            lines = file.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertTrue(any("ShoppingList" in line or "views.py" in line for line in lines))
+
+        output = io.StringIO()
+        call_command("profile_requests", "show", stdout=output)
+        self.assertIn(names[-1], output.getvalue())
+        self.assertIn("cumulative", output.getvalue())
+
+    def test_demoted_staff(self):
+        token = make_profile_token(self.staff)
+        self.assertIn("X-Profile-Id", self.get_changes(self.staff, token))
+
+        get_user_model().objects.filter(pk=self.staff.pk).update(is_staff=False)
+        response = self.get_changes(self.staff, token)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(len(list_profiles()), 1)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"], SHOPPING_LIST_CACHE_ENABLED=False)
+class ReplicaRoutingTestCase(AuthenticatedClientMixin, TestCase):
+    """
+    List and stats reads go to a replica until the user writes, then to
+    the primary while they are pinned. The replica holds different rows
+    here, so the responses show which database answered.
+    """
+
+    databases = {"default", "replica1"}
+
+    username = "replica"
+
+    def setUp(self):
+        super().setUp()
+        get_user_model().objects.using("replica1").create(
+            id=self.user.id, username="replica", email="replica@example.com"
+        )
+        ShoppingList.objects.using("replica1").create(
+            user_id=self.user.id, name="from replica", quantity=1
+        )
+        ShoppingListStats.objects.using("replica1").create(
+            user_id=self.user.id, item_count=1, total_quantity=1
+        )
+        get_pin_cache().delete(pin_key(self.user.id))
+
+    def get_names(self):
+        response = self.client.get("/api/shopping-list/?sort_by=asc")
+        return [item["name"] for item in response.json()["results"]["data"]]
+
+    def test_reads_follow_pin(self):
+        self.assertEqual(self.get_names(), ["from replica"])
+        response = self.client.get("/api/shopping-list/stats/")
+        self.assertEqual(response.json()["data"]["item_count"], 1)
+
+        response = self.client.post(
+            "/api/shopping-list/", {"name": "bread", "quantity": 2}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_names(), ["bread"])
+
+        get_pin_cache().delete(pin_key(self.user.id))
+        self.assertEqual(self.get_names(), ["from replica"])
+
+    def test_replica_instances_save_to_primary(self):
+        item = ShoppingList.objects.using("replica1").get(user_id=self.user.id)
+        self.assertEqual(router.db_for_write(ShoppingList, instance=item), "default")
+        self.assertEqual(router.db_for_read(ShoppingList), "default")
+
+
+class ReplicaPinCacheCheckTestCase(SimpleTestCase):
+    """
+    Replicas need a pin cache that every worker shares.
+    """
+
+    def get_ids(self, backend):
+        caches = {
+            **settings.CACHES,
+            PIN_CACHE_ALIAS: {"BACKEND": backend, "LOCATION": "replica_pin"},
+        }
+        with override_settings(CACHES=caches):
+            return [error.id for error in check_replica_pin_cache(None)]
+
+    def test_check(self):
+        locmem = "django.core.cache.backends.locmem.LocMemCache"
+        database = "django.core.cache.backends.db.DatabaseCache"
+
+        self.assertEqual(self.get_ids(locmem), [])
+        with override_settings(DATABASE_REPLICAS=["replica1"]):
+            self.assertEqual(self.get_ids(locmem), ["main.E001"])
+            self.assertEqual(self.get_ids(database), [])
+
+    def test_own_alias(self):
+        self.assertIs(get_pin_cache(), caches[PIN_CACHE_ALIAS])
+        self.assertIsNot(get_pin_cache(), caches["shopping_list"])
+
+
+@override_settings(SHOPPING_LIST_SHARDS=["shard1", "shard2"], SHOPPING_LIST_CACHE_ENABLED=False)
+class ShardingTestCase(TestCase):
+    """
+    Shopping-list rows live on the user's shard and auth_user on default;
+    a rebalance moves a user's rows, ids and timestamps intact.
+    """
+
+    databases = {"default", "shard1", "shard2"}
+
+    def setUp(self):
+        shard_map.clear()
+        self.addCleanup(shard_map.clear)
+        reserve_id_range("shard2")
+
+    def sign_up(self, username):
+        password = "S3cret-pass!"
+        response = APIClient().post(
+            "/api/create/",
+            {
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": password,
+                "confirm_password": password,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        user = get_user_model().objects.get(username=username)
+        client = get_client(user)
+        return user, client
+
+    def get_rows(self, alias, user):
+        return list(
+            ShoppingList.all_objects.using(alias)
+            .filter(user_id=user.id)
+            .order_by("id")
+            .values_list("id", "name", "quantity", "is_deleted", "created_at", "updated_at")
+        )
+
+    def test_hash_ring(self):
+        old = HashRing(["shard1", "shard2"])
+        new = HashRing(["shard1", "shard2", "shard3"])
+        moved = [user_id for user_id in range(3000) if old.get(user_id) != new.get(user_id)]
+
+        # only users the new shard takes move, about a third of them
+        self.assertTrue(all(new.get(user_id) == "shard3" for user_id in moved))
+        self.assertAlmostEqual(len(moved) / 3000, 1 / 3, delta=0.1)
+
+    def test_rows_follow_user(self):
+        user, client = self.sign_up("sharded")
+        alias = ShoppingListShard.objects.get(user=user).alias
+        other = {"shard1": "shard2", "shard2": "shard1"}[alias]
+
+        for name in ["milk", "bread"]:
+            client.post("/api/shopping-list/", {"name": name, "quantity": 2}, format="json")
+
+        self.assertEqual(len(self.get_rows(alias, user)), 2)
+        self.assertEqual(self.get_rows(other, user), [])
+        self.assertEqual(self.get_rows("default", user), [])
+
+        response = client.get("/api/shopping-list/?sort_by=asc")
+        self.assertEqual(
+            [item["name"] for item in response.json()["results"]["data"]], ["milk", "bread"]
+        )
+        response = client.get("/api/shopping-list/stats/")
+        self.assertEqual(response.json()["data"]["total_quantity"], 4)
+
+    def test_rebalance(self):
+        user = get_user_model().objects.create(username="mover", email="mover@example.com")
+        ShoppingListShard.objects.create(user=user, alias="shard2")
+        client = get_client(user)
+        for name in ["milk", "bread", "eggs"]:
+            client.post("/api/shopping-list/", {"name": name, "quantity": 3}, format="json")
+        bread = ShoppingList.get_shopping_list_by_name(user.id, "bread")
+        client.delete(f"/api/shopping-list/?item_id={bread.id}")
+
+        rows = self.get_rows("shard2", user)
+        self.assertTrue(all(row[0] >= 1 << SHARD_ID_BITS for row in rows))
+        stats = ShoppingListStats.get_stats(user.id)
+
+        output = io.StringIO()
+        call_command(
+            "rebalance_shopping_list_shards",
+            "--user",
+            str(user.id),
+            "--to",
+            "shard1",
+            "--wait",
+            "0",
+            stdout=output,
+        )
+        self.assertIn("shard2 -> shard1, 3 items copied", output.getvalue())
+
+        self.assertEqual(self.get_rows("shard1", user), rows)
+        self.assertEqual(self.get_rows("shard2", user), [])
+        self.assertEqual(ShoppingListShard.objects.get(user=user).alias, "shard1")
+        self.assertEqual(ShoppingListStats.get_stats(user.id), stats)
+
+        response = client.post(
+            "/api/shopping-list/", {"name": "jam", "quantity": 1}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.get_rows("shard1", user)), 4)
+
+    def test_delete_user(self):
+        models = [
+            ShoppingList._base_manager,
+            ShoppingListArchive.objects,
+            ShoppingListStats.objects,
+            ShoppingListDailyStats.objects,
+            ShoppingListPurgeMark.objects,
+        ]
+        users = []
+        for username in ["leaver", "stayer"]:
+            user = get_user_model().objects.create(
+                username=username, email=f"{username}@example.com"
+            )
+            ShoppingListShard.objects.create(user=user, alias="shard1")
+            client = get_client(user)
+            for name in ["milk", "bread"]:
+                client.post(
+                    "/api/shopping-list/", {"name": name, "quantity": 1}, format="json"
+                )
+            bread = ShoppingList.get_shopping_list_by_name(user.id, "bread")
+            ShoppingListArchive.from_shopping_list(bread).save(using="shard1")
+            ShoppingListPurgeMark.objects.using("shard1").create(
+                user=user, purged_through=timezone.now()
+            )
+            users.append(user)
+
+        leaver_id, stayer_id = [user.id for user in users]
+        for manager in models:
+            with self.subTest(model=manager.model.__name__):
+                self.assertTrue(manager.using("shard1").filter(user_id=leaver_id).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            users[0].delete()
+
+        self.assertFalse(ShoppingListShard.objects.filter(user_id=leaver_id).exists())
+        for manager in models:
+            rows = manager.using("shard1")
+            with self.subTest(model=manager.model.__name__):
+                self.assertFalse(rows.filter(user_id=leaver_id).exists())
+                self.assertTrue(rows.filter(user_id=stayer_id).exists())
+
+    def test_moving_user_cannot_write(self):
+        user, client = self.sign_up("frozen")
+        ShoppingListShard.objects.filter(user=user).update(moving=True)
+        shard_map.clear()
+
+        response = client.post(
+            "/api/shopping-list/", {"name": "milk", "quantity": 1}, format="json"
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(client.get("/api/shopping-list/").status_code, 200)
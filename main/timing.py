@@ -0,0 +1,102 @@
+import heapq
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# the RequestTiming of the request being served, None when timing is off
+current_timing = ContextVar("current_timing", default=None)
+
+
+class RequestTiming:
+    """
+    What one request spent: every SQL statement (up to ``max_queries``
+    kept for dumps, the ``slowest`` longest always kept) and named
+    segments such as auth, page, serialize and render
+    """
+
+    def __init__(self, max_queries=200, slowest=5):
+        self.start = time.perf_counter()
+        self.view_start = None
+        self.max_queries = max_queries
+        self.slowest_count = slowest
+        self.query_count = 0
+        self.query_time = 0.0
+        self.queries = []
+        self.slowest = []
+        self.segments = {}
+
+    def add_query(self, sql, duration, alias):
+        self.query_count += 1
+        self.query_time += duration
+
+        if len(self.queries) < self.max_queries:
+            self.queries.append((duration, alias, sql))
+
+        # a min-heap holding the longest statements seen so far
+        entry = (duration, self.query_count, alias, sql)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def add_segment(self, name, duration):
+        self.segments[name] = self.segments.get(name, 0.0) + duration
+
+    def get_slowest(self):
+        return [
+            (duration, alias, sql)
+            for duration, _, alias, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to segment ``name`` of the current
+    request, a no-op when timing is off
+    """
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add_segment(name, time.perf_counter() - start)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Connection execute wrapper feeding the current RequestTiming
+    """
+    timing = current_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add_query(
+            sql, time.perf_counter() - start, context["connection"].alias
+        )
+
+
+def add_query_recorder(sender=None, connection=None, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_query_recorder():
+    """
+    Put record_query on every database connection, the open ones and any
+    opened later on other threads (sync_to_async, worker threads)
+    """
+    connection_created.connect(add_query_recorder, dispatch_uid="main.timing")
+    for connection in connections.all(initialized_only=True):
+        add_query_recorder(connection=connection)
@@ -1,14 +1,79 @@
+from django.conf import settings
 from django.urls import path
 
-from main.views import CreateAccountApiView, LoginApiView, ShoppingListApiView
+from main.async_views import (
+    AsyncCreateAccountApiView,
+    AsyncLoginApiView,
+    AsyncShoppingListApiView,
+)
+from main.views import (
+    CreateAccountApiView,
+    LoginApiView,
+    ShoppingListApiView,
+    ShoppingListBatchApiView,
+    ShoppingListChangesApiView,
+    ShoppingListExportApiView,
+    ShoppingListImportApiView,
+    ShoppingListStatsApiView,
+    metrics_view,
+)
 
 ACCOUNT_URLS = [
     path("create/", CreateAccountApiView.as_view(), name="create-account"),
     path("login/", LoginApiView.as_view(), name="login"),
 ]
 
-
-urlpatterns = [
+SHOPPING_LIST_URLS = [
     path("shopping-list/", ShoppingListApiView.as_view(), name="shopping-list"),
-    *ACCOUNT_URLS,
 ]
+
+ASYNC_ACCOUNT_URLS = [
+    path("create/", AsyncCreateAccountApiView.as_view(), name="create-account"),
+    path("login/", AsyncLoginApiView.as_view(), name="login"),
+]
+
+ASYNC_SHOPPING_LIST_URLS = [
+    path("shopping-list/", AsyncShoppingListApiView.as_view(), name="shopping-list"),
+]
+
+
+def get_urlpatterns(async_views=False):
+    if async_views:
+        account_urls, shopping_list_urls = ASYNC_ACCOUNT_URLS, ASYNC_SHOPPING_LIST_URLS
+    else:
+        account_urls, shopping_list_urls = ACCOUNT_URLS, SHOPPING_LIST_URLS
+
+    return [
+        *shopping_list_urls,
+        path(
+            "shopping-list/batch/",
+            ShoppingListBatchApiView.as_view(),
+            name="shopping-list-batch",
+        ),
+        path(
+            "shopping-list/changes/",
+            ShoppingListChangesApiView.as_view(),
+            name="shopping-list-changes",
+        ),
+        path(
+            "shopping-list/stats/",
+            ShoppingListStatsApiView.as_view(),
+            name="shopping-list-stats",
+        ),
+        path(
+            "shopping-list/export/",
+            ShoppingListExportApiView.as_view(),
+            name="shopping-list-export",
+        ),
+        path(
+            "shopping-list/import/",
+            ShoppingListImportApiView.as_view(),
+            name="shopping-list-import",
+        ),
+        *account_urls,
+        path("metrics/", metrics_view, name="metrics"),
+    ]
+
+
+# the async views only pay off when served over ASGI (core.asgi)
+urlpatterns = get_urlpatterns(settings.SHOPPING_LIST_ASYNC_VIEWS)
@@ -1,29 +1,61 @@
-from datetime import datetime
+from datetime import timedelta
 
-from django.contrib.auth import authenticate, get_user_model
+from django.conf import settings
+from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework import exceptions, status
+from rest_framework import status
 from rest_framework.decorators import authentication_classes
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-from main.helpers import CustomPagination, Paginator
-from main.models import ShoppingList
+from main.authentication import CachedJWTAuthentication
+from main.cache import shopping_list_cache
+from main.exports import CONTENT_TYPES, EXPORTERS
+from main.imports import ROW_READERS, ImportFormatError, ShoppingListImport, iter_lines
+from main.helpers import (
+    CustomCursorPagination,
+    CustomPagination,
+    Paginator,
+    create_account,
+    encode_sync_cursor,
+    get_duplicate_account_error,
+    get_error_message,
+    get_if_match_etags,
+    get_list_validators,
+    get_tokens_for_user,
+    validate_items,
+)
+from main.metrics import get_registry, render_metrics
+from main.models import ShoppingList, ShoppingListPurgeMark, ShoppingListStats
+from main.profiling import ProfilingMixin
+from main.routers import read_from_replica
+from main.sharding import get_shard
 from main.serializer import (
     CreateAccountSerializer,
     LoginSerializer,
+    ShoppingListBatchSerializer,
+    ShoppingListBatchUpdateSerializer,
+    ShoppingListChangeSerializer,
+    ShoppingListChangesQuerySerializer,
+    ShoppingListExportSerializer,
+    ShoppingListFilterSerializer,
+    ShoppingListImportSerializer,
     ShoppingListModelSerializer,
+    ShoppingListPatchSerializer,
     ShoppingListSerializer,
+    ShoppingListStatsQuerySerializer,
+    ShoppingListValuesSerializer,
 )
+from main.timing import timed
 
 # error_codes = {
 #     "40001": "User not found",
@@ -35,7 +67,8 @@ from main.serializer import (
 #     "40007": "Invalid request",
 #     "40008": "Permission denied",
 #     "40009": "Invalid token",
-#     "40010": "Expired token"
+#     "40010": "Expired token",
+#     "40011": "Precondition failed"
 # }
 
 
@@ -43,7 +76,7 @@ from main.serializer import (
 """ USER ACCOUNT SECTION """
 
 
-class CreateAccountApiView(APIView):
+class CreateAccountApiView(ProfilingMixin, APIView):
     serializer_class = CreateAccountSerializer
 
     create_user_schema = openapi.Schema(
@@ -94,33 +127,27 @@ class CreateAccountApiView(APIView):
         password = serializer.validated_data.get("password")
         email = serializer.validated_data.get("email")
 
-        User = get_user_model()
-
-        # check if user email or username already exists
-        if User.objects.filter(email=email).exists():
-            raise exceptions.ValidationError({"email": "Email already exists"})
-        elif User.objects.filter(username=username).exists():
-            raise exceptions.ValidationError({"username": "Username already exists"})
-        else:
-            user = User.objects.create(
-                username=username, password=make_password(password), email=email
-            )
-            user.save()
-
-            tokenr = TokenObtainPairSerializer().get_token(user)
-            tokena = AccessToken().for_user(user)
+        # one INSERT, the unique indexes on username and e-mail decide
+        # whether the account already exists
+        try:
+            with transaction.atomic():
+                user = create_account(
+                    username=username, password=make_password(password), email=email
+                )
+        except IntegrityError as e:
+            raise get_duplicate_account_error(e)
 
-            data = {
-                "error": False,
-                "code": "201",
-            }
+        data = {
+            "error": False,
+            "code": "201",
+        }
 
-            data["tokens"] = {"refresh": str(tokenr), "access": str(tokena)}
+        data["tokens"] = get_tokens_for_user(user)
 
-            return Response(data, status=status.HTTP_201_CREATED)
+        return Response(data, status=status.HTTP_201_CREATED)
 
 
-class LoginApiView(APIView):
+class LoginApiView(ProfilingMixin, APIView):
     serilaier_class = LoginSerializer
 
     login_schema = openapi.Schema(
@@ -181,15 +208,12 @@ class LoginApiView(APIView):
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-        tokenr = TokenObtainPairSerializer().get_token(user)
-        tokena = AccessToken().for_user(user)
-
         data = {
             "error": False,
             "code": "200",
         }
 
-        data["tokens"] = {"refresh": str(tokenr), "access": str(tokena)}
+        data["tokens"] = get_tokens_for_user(user)
 
         return Response(data, status=status.HTTP_200_OK)
 
@@ -200,13 +224,14 @@ class LoginApiView(APIView):
 """ SHOPPING LIST SECTION """
 
 
-class ShoppingListApiView(APIView, Paginator):
-    authentication_classes = [JWTAuthentication]
+class ShoppingListApiView(ProfilingMixin, APIView, Paginator):
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = (IsAuthenticated,)
 
     serializer_class = ShoppingListSerializer
 
     pagination_class = CustomPagination
+    cursor_pagination_class = CustomCursorPagination
 
     create_shopping_list_schema = openapi.Schema(
         type=openapi.TYPE_OBJECT,
@@ -259,108 +284,239 @@ class ShoppingListApiView(APIView, Paginator):
         serializer.is_valid(raise_exception=True)
 
         create_shopping_list_payload = {
-            "user": request.user,
+            "user_id": request.user.id,
             "name": serializer.validated_data.get("name"),
             "quantity": serializer.validated_data.get("quantity"),
             "note": serializer.validated_data.get("note"),
         }
 
-        shopping_list = ShoppingList.create_shopping_list(
-            **create_shopping_list_payload
-        )
+        # ?merge=true adds to the quantity of a live item with the same name
+        if request.GET.get("merge", "").lower() in ["1", "true"]:
+            shopping_list, created = ShoppingList.merge_shopping_list(
+                user_id=request.user.id,
+                name=create_shopping_list_payload["name"],
+                quantity=create_shopping_list_payload["quantity"],
+                note=create_shopping_list_payload["note"],
+            )
+        else:
+            try:
+                with transaction.atomic(using=get_shard(request.user.id, write=True)):
+                    shopping_list = ShoppingList.create_shopping_list(
+                        **create_shopping_list_payload
+                    )
+            except IntegrityError:
+                return self.duplicate_name_response()
 
-        data = {
-            "error": False,
-            "code": "201",
-            "message": "Shopping list created successfully",
-            "data": ShoppingListModelSerializer(shopping_list).data,
-        }
+            created = True
 
-        return Response(data, status=status.HTTP_201_CREATED)
+        shopping_list_cache.invalidate(request.user.id)
+
+        if created:
+            data = {
+                "error": False,
+                "code": "201",
+                "message": "Shopping list created successfully",
+                "data": ShoppingListModelSerializer(shopping_list).data,
+            }
+            response_status = status.HTTP_201_CREATED
+        else:
+            data = {
+                "error": False,
+                "code": "200",
+                "message": "Shopping list merged successfully",
+                "data": ShoppingListModelSerializer(shopping_list).data,
+            }
+            response_status = status.HTTP_200_OK
+
+        return Response(
+            data, status=response_status, headers={"ETag": shopping_list.etag}
+        )
 
     @method_decorator(csrf_exempt)
     @swagger_auto_schema(
         tags=["shopping-list"],
     )
+    @read_from_replica
     def get(self, request):
-        sort_by = request.GET.get("sort_by")
-        search = request.GET.get("search")
-        start_date = request.GET.get("start_date")
-        end_date = request.GET.get("end_date")
+        # one aggregate query decides whether the client's copy is current
+        revision = ShoppingList.get_revision(request.user.id)
+        validators, not_modified = get_list_validators(request, revision)
+        if not_modified is not None:
+            return not_modified
 
-        sort_options = ["asc", "desc"]
+        cached_data, cache_version = shopping_list_cache.get(request)
+        if cached_data is not None:
+            return Response(cached_data, headers={"X-Cache": "HIT", **validators})
 
-        if sort_by and sort_by not in sort_options:
+        filter_serializer = ShoppingListFilterSerializer(data=request.GET)
+
+        if not filter_serializer.is_valid():
             data = {
                 "error": True,
                 "code": "40007",
-                "message": "Invalid sort option",
+                "message": get_error_message(filter_serializer.errors),
             }
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-        if start_date and not end_date:
+        filters = filter_serializer.validated_data
+
+        shopping_list = ShoppingList.filter_shopping_list(
+            request.user.id,
+            search=filters.get("search"),
+            start_date=filters.get("start_date"),
+            end_date=filters.get("end_date"),
+            min_quantity=filters.get("min_quantity"),
+            max_quantity=filters.get("max_quantity"),
+            revision=revision,
+        )
+
+        if filters.get("ordering"):
+            shopping_list = ShoppingList.order_data(shopping_list, filters["ordering"])
+        elif filters.get("sort_by"):
+            shopping_list = ShoppingList.sort_data(shopping_list, filters["sort_by"])
+
+        # pages are only stable over a total order, and the cursor reads its
+        # position off the ordering columns, so they have to be in the query
+        # before the fast path picks what to select
+        if not shopping_list.query.order_by:
+            shopping_list = shopping_list.order_by("id")
+
+        # ?fields=id,name,quantity prunes the columns read and the keys sent
+        fields = filters.get("fields")
+
+        fast_serializer = settings.SHOPPING_LIST_FAST_SERIALIZER
+        if fast_serializer:
+            # rows straight from values_list(), no model instances
+            shopping_list = ShoppingListValuesSerializer.get_rows(shopping_list, fields)
+        elif fields:
+            shopping_list = ShoppingList.select_fields(shopping_list, fields)
+
+        # cursor mode keysets on the query's ordering and never runs COUNT
+        if filters.get("pagination") == "cursor":
+            paginator = self.cursor_pagination_class()
+        else:
+            paginator = self.pagination_class()
+
+        with timed("page"):
+            result_page = paginator.paginate_queryset(shopping_list, request)
+
+        with timed("serialize"):
+            if fast_serializer:
+                serialized_data = ShoppingListValuesSerializer(
+                    result_page, fields=fields
+                ).data
+            else:
+                serialized_data = ShoppingListModelSerializer(
+                    result_page, many=True, fields=fields
+                ).data
+
+        data = {
+            "error": False,
+            "code": "200",
+            "message": "Shopping list retrieved successfully",
+            "data": serialized_data,
+        }
+
+        response = paginator.get_paginated_response(data)
+
+        shopping_list_cache.set(request, response.data, cache_version)
+        response["X-Cache"] = "MISS"
+        for header, value in validators.items():
+            response[header] = value
+
+        return response
+
+    def duplicate_name_response(self):
+        data = {
+            "error": True,
+            "code": "40006",
+            "message": "Shopping list with this name already exists",
+        }
+
+        return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+    def write_failed_response(self, request, item_id):
+        """
+        An UPDATE matched nothing: the item is gone or If-Match failed
+        """
+        if (
+            request.headers.get("If-Match")
+            and ShoppingList.get_shopping_list_by_id(request.user.id, item_id)
+            is not None
+        ):
             data = {
                 "error": True,
-                "code": "40007",
-                "message": "End date is required",
+                "code": "40011",
+                "message": "Shopping list has been modified",
             }
 
-            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+            return Response(data, status=status.HTTP_412_PRECONDITION_FAILED)
 
-        if end_date and not start_date:
+        data = {
+            "error": True,
+            "code": "40004",
+            "message": "Shopping list does not exist",
+        }
+
+        return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+    def patch(self, request):
+        item_id = request.GET.get("item_id")
+        if not item_id:
             data = {
                 "error": True,
                 "code": "40007",
-                "message": "Start date is required",
+                "message": "Item id is required",
             }
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-        if start_date and end_date:
-            # formate date
-            try:
-                if start_date:
-                    datetime.strptime(start_date, "%Y-%m-%d")
-                if end_date:
-                    datetime.strptime(end_date, "%Y-%m-%d")
-            except:
-                data = {
-                    "error": True,
-                    "code": "40007",
-                    "message": "Invalid date format. Date format should be YYYY-MM-DD",
-                }
-
-                return Response(data, status=status.HTTP_400_BAD_REQUEST)
-        if start_date and end_date:
-            shopping_list = ShoppingList.filter_by_date(
-                user_id=request.user.id, start_date=start_date, end_date=end_date
-            )
-        elif search:
-            shopping_list = ShoppingList.search_shopping_list(request.user.id, search)
-        else:
-            shopping_list = ShoppingList.get_shopping_list(request.user.id)
+        serilaizer = ShoppingListPatchSerializer(data=request.data, partial=True)
+        serilaizer.is_valid(raise_exception=True)
 
-        if sort_by:
-            shopping_list = ShoppingList.sort_data(shopping_list, sort_by)
+        fields = dict(serilaizer.validated_data)
+        quantity_delta = fields.pop("quantity_delta", None)
 
-        paginator = PageNumberPagination()
-        paginator.page_size = 10
+        try:
+            with transaction.atomic(using=get_shard(request.user.id, write=True)):
+                if quantity_delta is not None:
+                    shopping_list = ShoppingList.adjust_quantity(
+                        request.user.id,
+                        item_id,
+                        quantity_delta,
+                        etags=get_if_match_etags(request),
+                    )
+                else:
+                    shopping_list = ShoppingList.update_shopping_list(
+                        request.user.id,
+                        item_id,
+                        etags=get_if_match_etags(request),
+                        **fields,
+                    )
+        except IntegrityError:
+            return self.duplicate_name_response()
 
-        result_page = paginator.paginate_queryset(shopping_list, request)
+        if shopping_list is None:
+            return self.write_failed_response(request, item_id)
 
-        serialized_data = ShoppingListModelSerializer(result_page, many=True).data
+        shopping_list_cache.invalidate(request.user.id)
 
         data = {
             "error": False,
             "code": "200",
             "message": "Shopping list retrieved successfully",
-            "data": serialized_data,
+            "data": ShoppingListModelSerializer(shopping_list).data,
         }
 
-        return paginator.get_paginated_response(data)
+        return Response(
+            data, status=status.HTTP_200_OK, headers={"ETag": shopping_list.etag}
+        )
+
+    def put(self, request):
+        serilaizer = self.serializer_class(data=request.data)
+        serilaizer.is_valid(raise_exception=True)
 
-    def patch(self, request):
         item_id = request.GET.get("item_id")
         if not item_id:
             data = {
@@ -371,25 +527,23 @@ class ShoppingListApiView(APIView, Paginator):
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-        shopping_list = ShoppingList.get_shopping_list_by_id(request.user.id, item_id)
+        try:
+            with transaction.atomic(using=get_shard(request.user.id, write=True)):
+                shopping_list = ShoppingList.update_shopping_list(
+                    request.user.id,
+                    item_id,
+                    etags=get_if_match_etags(request),
+                    name=serilaizer.validated_data.get("name"),
+                    quantity=serilaizer.validated_data.get("quantity"),
+                    note=serilaizer.validated_data.get("note"),
+                )
+        except IntegrityError:
+            return self.duplicate_name_response()
 
         if shopping_list is None:
-            data = {
-                "error": True,
-                "code": "40004",
-                "message": "Shopping list does not exist",
-            }
-
-            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+            return self.write_failed_response(request, item_id)
 
-        name = request.data.get("name", shopping_list.name)
-        quantity = request.data.get("quantity", shopping_list.quantity)
-        note = request.data.get("note", shopping_list.note)
-
-        shopping_list.name = name
-        shopping_list.quantity = quantity
-        shopping_list.note = note
-        shopping_list.save()
+        shopping_list_cache.invalidate(request.user.id)
 
         data = {
             "error": False,
@@ -398,12 +552,11 @@ class ShoppingListApiView(APIView, Paginator):
             "data": ShoppingListModelSerializer(shopping_list).data,
         }
 
-        return Response(data, status=status.HTTP_200_OK)
-
-    def put(self, request):
-        serilaizer = self.serializer_class(data=request.data)
-        serilaizer.is_valid(raise_exception=True)
+        return Response(
+            data, status=status.HTTP_200_OK, headers={"ETag": shopping_list.etag}
+        )
 
+    def delete(self, request):
         item_id = request.GET.get("item_id")
         if not item_id:
             data = {
@@ -414,63 +567,483 @@ class ShoppingListApiView(APIView, Paginator):
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-        shopping_list = ShoppingList.get_shopping_list_by_id(request.user.id, item_id)
+        shopping_list = ShoppingList.delete_shopping_list(
+            request.user.id, item_id, etags=get_if_match_etags(request)
+        )
 
         if shopping_list is None:
+            return self.write_failed_response(request, item_id)
+
+        shopping_list_cache.invalidate(request.user.id)
+
+        data = {
+            "error": False,
+            "code": "200",
+            "message": "Shopping list deleted successfully",
+        }
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ShoppingListBatchApiView(ProfilingMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = (IsAuthenticated,)
+
+    serializer_class = ShoppingListBatchSerializer
+
+    batch_schema = openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            "create": openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=ShoppingListApiView.create_shopping_list_schema,
+            ),
+            "update": openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "id": openapi.Schema(type=openapi.TYPE_INTEGER),
+                        "name": openapi.Schema(type=openapi.TYPE_STRING),
+                        "quantity": openapi.Schema(type=openapi.TYPE_INTEGER),
+                        "note": openapi.Schema(type=openapi.TYPE_STRING),
+                    },
+                    required=["id"],
+                ),
+            ),
+            "delete": openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(type=openapi.TYPE_INTEGER),
+            ),
+        },
+    )
+
+    @method_decorator(csrf_exempt)
+    @swagger_auto_schema(
+        tags=["shopping-list"],
+        request_body=batch_schema,
+    )
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        creates, invalid_creates = validate_items(
+            ShoppingListSerializer, serializer.validated_data.get("create", [])
+        )
+        updates, invalid_updates = validate_items(
+            ShoppingListBatchUpdateSerializer,
+            serializer.validated_data.get("update", []),
+            partial=True,
+        )
+        delete_ids = serializer.validated_data.get("delete", [])
+
+        update_fields = {}
+        for _, item in updates:
+            fields = {field: value for field, value in item.items() if field != "id"}
+            update_fields.setdefault(item["id"], {}).update(fields)
+
+        try:
+            with transaction.atomic(using=get_shard(request.user.id, write=True)):
+                # deletes first, so a batch may delete a name and re-add it
+                deleted_ids = set(
+                    ShoppingList.bulk_delete_shopping_list(request.user.id, delete_ids)
+                )
+                updated, conflict_ids = ShoppingList.bulk_update_shopping_list(
+                    request.user.id, update_fields
+                )
+
+                taken_names = ShoppingList.get_live_names(
+                    request.user.id, [item["name"] for _, item in creates]
+                )
+                accepted_creates, duplicate_creates = [], []
+                for index, item in creates:
+                    if item["name"].lower() in taken_names:
+                        duplicate_creates.append(index)
+                    else:
+                        taken_names.add(item["name"].lower())
+                        accepted_creates.append((index, item))
+
+                created = ShoppingList.bulk_create_shopping_list(
+                    request.user.id, [item for _, item in accepted_creates]
+                )
+        except IntegrityError:
+            # only a concurrent write can get a name past the checks above
             data = {
                 "error": True,
-                "code": "40004",
-                "message": "Shopping list does not exist",
+                "code": "40006",
+                "message": "Shopping list with this name already exists",
             }
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-        shopping_list.name = serilaizer.validated_data.get("name")
-        shopping_list.quantity = serilaizer.validated_data.get("quantity")
-        shopping_list.note = serilaizer.validated_data.get("note")
-        shopping_list.save()
+        shopping_list_cache.invalidate(request.user.id)
+
+        results = {"create": [], "update": [], "delete": []}
+
+        for index in duplicate_creates:
+            results["create"].append({"index": index, "status": "duplicate"})
+        for (index, _), shopping_list in zip(accepted_creates, created):
+            results["create"].append(
+                {
+                    "index": index,
+                    "status": "created",
+                    "data": ShoppingListModelSerializer(shopping_list).data,
+                }
+            )
+        for index, errors in invalid_creates:
+            results["create"].append({"index": index, "status": "invalid", "errors": errors})
+
+        updated = {shopping_list.id: shopping_list for shopping_list in updated}
+        for index, item in updates:
+            if item["id"] in conflict_ids:
+                results["update"].append(
+                    {"index": index, "status": "conflict", "id": item["id"]}
+                )
+            elif item["id"] in updated:
+                results["update"].append(
+                    {
+                        "index": index,
+                        "status": "updated",
+                        "data": ShoppingListModelSerializer(updated[item["id"]]).data,
+                    }
+                )
+            else:
+                results["update"].append(
+                    {"index": index, "status": "not_found", "id": item["id"]}
+                )
+        for index, errors in invalid_updates:
+            results["update"].append({"index": index, "status": "invalid", "errors": errors})
+
+        for index, item_id in enumerate(delete_ids):
+            results["delete"].append(
+                {
+                    "index": index,
+                    "status": "deleted" if item_id in deleted_ids else "not_found",
+                    "id": item_id,
+                }
+            )
+
+        for operation_results in results.values():
+            operation_results.sort(key=lambda result: result["index"])
 
         data = {
             "error": False,
             "code": "200",
-            "message": "Shopping list retrieved successfully",
-            "data": ShoppingListModelSerializer(shopping_list).data,
+            "message": "Shopping list batch applied successfully",
+            "data": results,
         }
 
         return Response(data, status=status.HTTP_200_OK)
 
-    def delete(self, request):
-        item_id = request.GET.get("item_id")
-        if not item_id:
+
+class ShoppingListChangesApiView(ProfilingMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = (IsAuthenticated,)
+
+    serializer_class = ShoppingListChangesQuerySerializer
+
+    @method_decorator(csrf_exempt)
+    @swagger_auto_schema(
+        tags=["shopping-list"],
+        manual_parameters=[
+            openapi.Parameter("cursor", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter("limit", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+    )
+    def get(self, request):
+        """
+        Incremental sync: rows changed since ``cursor``, deletes included
+        as is_deleted tombstones. Keep calling with the returned cursor
+        until has_more is false.
+        """
+        serializer = self.serializer_class(data=request.GET)
+
+        if not serializer.is_valid():
             data = {
                 "error": True,
                 "code": "40007",
-                "message": "Item id is required",
+                "message": get_error_message(serializer.errors),
             }
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-        shopping_list = ShoppingList.get_shopping_list_by_id(request.user.id, item_id)
+        since = serializer.validated_data.get("cursor")
+        limit = serializer.validated_data["limit"]
 
-        if shopping_list is None:
+        # tombstones up to purged_through are gone, an older cursor may have
+        # missed a delete and has to sync again from the start
+        purged_through = ShoppingListPurgeMark.get_purged_through(request.user.id)
+        if since is not None and purged_through and since[0] < purged_through:
             data = {
                 "error": True,
-                "code": "40004",
-                "message": "Shopping list does not exist",
+                "code": "40007",
+                "message": "Cursor expired, sync again without a cursor",
             }
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-        shopping_list.is_deleted = True
-        shopping_list.save()
+        # rows stamped within the lag may still be joined by earlier stamped
+        # ones committing late, so the cursor never moves past it
+        until = timezone.now() - timedelta(
+            seconds=settings.SHOPPING_LIST_CHANGES_LAG_SECONDS
+        )
+        changes = list(
+            ShoppingList.get_changes(
+                request.user.id, since=since, limit=limit + 1, until=until
+            )
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        if changes:
+            position = changes[-1].updated_at
+            cursor = encode_sync_cursor(position, changes[-1].id)
+        else:
+            position = since[0] if since is not None else None
+            cursor = request.GET.get("cursor") or None
+
+        # once caught up, move the cursor past the purged tombstones so it
+        # does not count as expired on the next call
+        if not has_more and purged_through:
+            if position is None or position < purged_through:
+                cursor = encode_sync_cursor(purged_through, 0)
 
         data = {
             "error": False,
             "code": "200",
-            "message": "Shopping list deleted successfully",
+            "message": "Shopping list changes retrieved successfully",
+            "data": ShoppingListChangeSerializer(changes, many=True).data,
+            "cursor": cursor,
+            "has_more": has_more,
         }
 
         return Response(data, status=status.HTTP_200_OK)
 
 
+class ShoppingListStatsApiView(ProfilingMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = (IsAuthenticated,)
+
+    serializer_class = ShoppingListStatsQuerySerializer
+
+    @method_decorator(csrf_exempt)
+    @swagger_auto_schema(
+        tags=["shopping-list"],
+        manual_parameters=[
+            openapi.Parameter("days", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+    )
+    @read_from_replica
+    def get(self, request):
+        """
+        Item count, total quantity and the items added per day and week over
+        the last ``days`` days, read from the user's rollup rather than
+        their items
+        """
+        serializer = self.serializer_class(data=request.GET)
+
+        if not serializer.is_valid():
+            data = {
+                "error": True,
+                "code": "40007",
+                "message": get_error_message(serializer.errors),
+            }
+
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+        data = {
+            "error": False,
+            "code": "200",
+            "message": "Shopping list stats retrieved successfully",
+            "data": ShoppingListStats.get_stats(
+                request.user.id, days=serializer.validated_data["days"]
+            ),
+        }
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ShoppingListExportApiView(ProfilingMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = (IsAuthenticated,)
+
+    serializer_class = ShoppingListExportSerializer
+
+    @method_decorator(csrf_exempt)
+    @swagger_auto_schema(
+        tags=["shopping-list"],
+        manual_parameters=[
+            openapi.Parameter(
+                "export_format",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                enum=["ndjson", "csv"],
+            ),
+            openapi.Parameter("fields", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+        ],
+    )
+    def get(self, request):
+        """
+        The whole list (or the part matching the usual filters) in one
+        streamed NDJSON or CSV response, oldest first unless ordered
+        """
+        serializer = self.serializer_class(data=request.GET)
+
+        if not serializer.is_valid():
+            data = {
+                "error": True,
+                "code": "40007",
+                "message": get_error_message(serializer.errors),
+            }
+
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = serializer.validated_data
+
+        shopping_list = ShoppingList.filter_shopping_list(
+            request.user.id,
+            search=filters.get("search"),
+            start_date=filters.get("start_date"),
+            end_date=filters.get("end_date"),
+            min_quantity=filters.get("min_quantity"),
+            max_quantity=filters.get("max_quantity"),
+        )
+
+        if filters.get("ordering"):
+            shopping_list = ShoppingList.order_data(shopping_list, filters["ordering"])
+        elif filters.get("sort_by"):
+            shopping_list = ShoppingList.sort_data(shopping_list, filters["sort_by"])
+        elif not filters.get("search"):
+            shopping_list = shopping_list.order_by("id")
+
+        export_format = filters["export_format"]
+        response = StreamingHttpResponse(
+            EXPORTERS[export_format](
+                shopping_list,
+                fields=filters.get("fields"),
+                chunk_size=settings.SHOPPING_LIST_EXPORT_CHUNK_SIZE,
+            ),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="shopping-list.{export_format}"'
+        )
+
+        return response
+
+
+class ShoppingListImportApiView(ProfilingMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = (IsAuthenticated,)
+
+    serializer_class = ShoppingListImportSerializer
+
+    @method_decorator(csrf_exempt)
+    @swagger_auto_schema(
+        tags=["shopping-list"],
+        manual_parameters=[
+            openapi.Parameter(
+                "import_format",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                enum=["ndjson", "csv"],
+            ),
+            openapi.Parameter("merge", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+            openapi.Parameter("file", openapi.IN_FORM, type=openapi.TYPE_FILE),
+        ],
+    )
+    def post(self, request):
+        """
+        Import NDJSON or CSV rows, uploaded as the multipart ``file`` field
+        or sent as the raw body. The file is read line by line, never whole.
+        ?merge=true adds to items with the same name instead of rejecting
+        them as duplicates.
+        """
+        serializer = self.serializer_class(data=request.GET)
+
+        if not serializer.is_valid():
+            data = {
+                "error": True,
+                "code": "40007",
+                "message": get_error_message(serializer.errors),
+            }
+
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.content_type.startswith("multipart/form-data"):
+            upload = request.FILES.get("file")
+            stream = upload
+            content_type = upload and upload.content_type
+            file_name = upload and upload.name
+        else:
+            stream = request.stream
+            content_type = request.content_type
+            file_name = ""
+
+        if stream is None:
+            data = {
+                "error": True,
+                "code": "40007",
+                "message": "File is required",
+            }
+
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+        import_format = serializer.validated_data.get("import_format")
+        if import_format is None:
+            is_csv = content_type == "text/csv" or file_name.lower().endswith(".csv")
+            import_format = "csv" if is_csv else "ndjson"
+
+        shopping_list_import = ShoppingListImport(
+            request.user.id,
+            merge=serializer.validated_data["merge"],
+            chunk_size=settings.SHOPPING_LIST_IMPORT_CHUNK_SIZE,
+        )
+
+        try:
+            summary = shopping_list_import.run(
+                ROW_READERS[import_format](iter_lines(stream))
+            )
+        except ImportFormatError as e:
+            # chunks imported before the bad line stay imported
+            summary = shopping_list_import.summary
+            data = {
+                "error": True,
+                "code": "40007",
+                "message": str(e),
+                "data": summary,
+            }
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            data = {
+                "error": False,
+                "code": "200",
+                "message": "Shopping list imported successfully",
+                "data": summary,
+            }
+            response_status = status.HTTP_200_OK
+
+        if summary["accepted"]:
+            shopping_list_cache.invalidate(request.user.id)
+
+        return Response(data, status=response_status)
+
+
 """ END OF SHOPPING LIST SECTION """
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, the metrics of all worker processes summed
+    """
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+
+    counters, histograms = get_registry().collect()
+    return HttpResponse(
+        render_metrics(counters, histograms),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )